@@ -1,22 +1,74 @@
+import time
+import uuid
+from pathlib import Path
+
 import streamlit as st
 import pandas as pd
-import streamlit_folium
-
-if "datos_filtrados" not in st.session_state:
-    st.session_state.datos_filtrados = None
-
-# Funciones externas
-from modulos.filtros import aplicar_filtros
-from modulos.graficos import (
-    mapa_repostajes,
-    grafico_barras_temporal,
-    grafico_tarta_distribucion,
-    grafico_dia_semana,
-    grafico_lineal_consumo,
-    grafico_comparativo_modelo,
-    mostrar_top_vehiculos
+
+if "seleccion_filtros" not in st.session_state:
+    st.session_state.seleccion_filtros = None
+
+# Funciones externas.
+# Plotly, Folium y modulos.graficos no se importan aquí: se cargan al dibujar el primer gráfico
+# o mapa, así la aplicación se pinta antes de que se suba ningún archivo.
+inicio_importaciones = time.perf_counter()
+from modulos.filtros import (
+    calcular_mascara,
+    comprimir_seleccion,
+    construir_facetas,
+    construir_indice,
+    materializar_seleccion,
+    opciones_validas
+)
+from modulos.utilidades import memoria_sesion, set_star_background
+from modulos.agregados import construir_cubo, reducir_cubo, totales_por_vehiculo
+from modulos.tendencias import calcular_tendencias, tendencias_vehiculo
+from modulos.anomalias import (
+    MAX_FILAS_ANOMALIAS,
+    UMBRAL_ANOMALIA,
+    anomalias_vehiculo,
+    detectar_anomalias,
+    ranking_anomalias
+)
+from modulos.cache_figuras import CacheFiguras, huella_datos
+from modulos.indices import construir_indice_vehiculos, construir_particiones, filas_valor
+from modulos.almacen import RegistroDatos
+from modulos.carga import (
+    CARPETAS_PERMITIDAS,
+    UMBRAL_STREAMING_BYTES,
+    cargar_carpeta,
+    carpeta_permitida,
+    cargar_excel,
+    huella_carpeta,
+    huella_contenido,
+    leer_bytes
 )
-from modulos.utilidades import set_star_background
+from modulos.historico import (
+    anadir_al_historico,
+    cargar_historico,
+    huella_historico,
+    mensual_historico,
+    resumen_historico,
+    totales_historico
+)
+from modulos.perfilado import (
+    ARRANQUE,
+    PERFILADO_INICIAL,
+    finalizar_registro,
+    importar,
+    iniciar_registro,
+    medir,
+    perfilado_activo,
+    registrar_importacion,
+    registrar_primera_pintura,
+    tabla_etapas,
+    tabla_importaciones,
+    tamano_envio
+)
+registrar_importacion("modulos (app.py)", time.perf_counter() - inicio_importaciones)
+
+# Registro de tiempos de esta ejecución (solo si el perfilado está activo en el panel lateral)
+registro_perfilado = iniciar_registro(st.session_state.get("perfilado", PERFILADO_INICIAL))
 
 set_star_background()
 
@@ -25,46 +77,299 @@ set_star_background()
 st.set_page_config(page_title="Repostajes", layout="wide")
 st.title("🚗 Análisis de Repostajes")
 
+# Calcula la huella del archivo subido una sola vez por archivo
+def obtener_huella(archivo):
+    huellas = st.session_state.setdefault("huellas_archivos", {})
+    if archivo.file_id not in huellas:
+        huellas[archivo.file_id] = huella_contenido(leer_bytes(archivo))
+    return huellas[archivo.file_id]
+
+# Registro de conjuntos de datos compartido por todas las sesiones del proceso
+@st.cache_resource
+def obtener_registro():
+    registro = RegistroDatos()
+    registro.al_expulsar.append(liberar_derivados)
+    return registro
+
+# Al expulsar un conjunto del registro se liberan también los índices, cubos, selecciones y figuras
+# calculados a partir de él; si no, esas cachés lo seguirían manteniendo en memoria.
+# Las cachés por clave de datos (con los filtros en la clave) se vacían enteras: se recalculan al usarlas.
+def liberar_derivados(huella):
+    obtener_indice_filtros.clear(huella, None)
+    obtener_facetas.clear(huella, None)
+    obtener_cubo_base.clear(huella, None)
+    for cache in (obtener_datos_filtrados, obtener_cubo, obtener_totales_vehiculo, obtener_tendencias,
+                  obtener_particiones, obtener_indice_vehiculos, obtener_anomalias):
+        cache.clear()
+    obtener_cache_figuras().descartar(lambda clave: isinstance(clave[0], tuple) and clave[0][0] == huella)
+
+# Lee el archivo una única vez por contenido; las siguientes ejecuciones y las demás sesiones
+# que suban el mismo archivo reutilizan el mismo dataframe
+def cargar_datos(huella, archivo, streaming=False, progreso=None):
+    with st.spinner("Cargando datos..."):
+        return obtener_registro().obtener(
+            huella,
+            lambda: cargar_excel(archivo, huella, streaming=streaming, progreso=progreso)
+        )
+
+# Carga el histórico de la flota una vez por versión (cambia al añadir archivos).
+# Los gráficos se calculan sobre todas sus filas; de los acumulados incrementales solo salen los
+# totales mensuales del panel lateral y los totales por vehículo sin filtros. Para no cargarlo
+# en memoria está el modo de consulta en disco (modulos.motor_sql).
+def cargar_datos_historico(huella):
+    with st.spinner("Cargando histórico..."):
+        return obtener_registro().obtener(huella, cargar_historico)
+
+# Carga una carpeta local una vez por contenido (nombres, tamaños y fechas de sus archivos).
+# El informe con el tiempo de cada archivo se guarda en la sesión; si otra sesión ya la cargó no hay informe nuevo.
+def cargar_datos_carpeta(huella, carpeta, progreso=None):
+    def cargador():
+        informe = {}
+        df = cargar_carpeta(carpeta, progreso=progreso, informe=informe)
+        st.session_state.informe_carpeta = {**informe, "huella": huella}
+        return df
+
+    with st.spinner("Cargando carpeta..."):
+        return obtener_registro().obtener(huella, cargador)
+
+# Índice de filtrado, construido una vez por conjunto de datos
+@st.cache_resource(max_entries=4)
+def obtener_indice_filtros(huella, _df):
+    return construir_indice(_df)
+
+# Tabla de facetas del panel lateral, construida una vez por conjunto de datos
+@st.cache_resource(max_entries=4)
+def obtener_facetas(huella, _df):
+    return construir_facetas(_df)
+
+# Materializa una selección de filas; la copia se comparte entre las sesiones con los mismos filtros
+@st.cache_resource(max_entries=8)
+def obtener_datos_filtrados(clave, _df, _seleccion):
+    return materializar_seleccion(_df, _seleccion)
+
+# Cubo filtrable de un conjunto de datos (desglosado por las columnas de los filtros laterales),
+# construido una vez por conjunto de datos
+@st.cache_resource(max_entries=4)
+def obtener_cubo_base(huella, _df):
+    return construir_cubo(_df, filtrable=True)
+
+# Cubo temporal de un conjunto de datos activo, identificado por su clave.
+# Con el cubo base y los filtros que producen los datos activos se obtiene reduciendo el cubo base;
+# solo si un filtro de rango recorta valores (o no hay cubo base) se agrupan otra vez las filas.
+@st.cache_resource(max_entries=16)
+def obtener_cubo(clave, _df, _base=None, _filtros=None):
+    if _base is not None and _filtros is not None:
+        cubo = reducir_cubo(_base, **_filtros)
+        if cubo is not None:
+            return cubo
+    return construir_cubo(_df)
+
+# Totales por vehículo de un conjunto de datos activo; el slider del top solo cambia N
+@st.cache_resource(max_entries=16)
+def obtener_totales_vehiculo(clave, _df):
+    return totales_por_vehiculo(_df)
+
+# Tendencias de una métrica para todos los vehículos de un conjunto de datos activo
+@st.cache_resource(max_entries=16)
+def obtener_tendencias(clave, columna, _df):
+    return calcular_tendencias(_df, "fecha", columna)
+
+# Puntuaciones de anomalía de todos los repostajes de un conjunto de datos activo
+@st.cache_resource(max_entries=8)
+def obtener_anomalias(clave, _df):
+    return detectar_anomalias(_df)
+
+# Índice de particiones de una columna de un conjunto de datos activo
+@st.cache_resource(max_entries=16)
+def obtener_particiones(clave, columna, _df):
+    return construir_particiones(_df, columna)
+
+# Índice de vehículos (filas por matrícula y modelo de cada vehículo) de un conjunto de datos activo
+@st.cache_resource(max_entries=16)
+def obtener_indice_vehiculos(clave, _df):
+    return construir_indice_vehiculos(_df)
+
+# Motor de consultas sobre las particiones del histórico, uno por versión del histórico
+@st.cache_resource(max_entries=2)
+def obtener_motor(huella):
+    return importar("modulos.motor_sql").motor_historico()
+
+# Resultado de una consulta del motor (cubo, totales, rejilla...) para los datos activos identificados por su clave.
+# Los filtros no forman parte de la clave de la caché: ya van en la clave de los datos.
+@st.cache_resource(max_entries=64)
+def consultar_motor(clave, consulta, parametros, _motor, _filtros):
+    return getattr(_motor, consulta)(*parametros, filtros=_filtros)
+
+# Totales por vehículo; los del histórico sin filtrar salen de sus acumulados, que se
+# actualizan al añadir archivos sin recorrer todo el histórico
+def totales_vehiculo(clave, df):
+    if modo == MODO_HISTORICO and clave == (huella, None):
+        totales = totales_historico()
+        if totales is not None:
+            return totales
+    return obtener_totales_vehiculo(clave, df)
+
+# Caché de figuras compartida por todas las sesiones
+@st.cache_resource
+def obtener_cache_figuras():
+    return CacheFiguras()
+
+# Devuelve la figura guardada para estos datos y parámetros o la construye y la guarda
+def figura_en_cache(clave_datos, nombre, constructor, *parametros):
+    with medir(f"figura {nombre}"):
+        return obtener_cache_figuras().obtener((clave_datos, nombre) + parametros, constructor)
+
+# Envía una figura al navegador; con el perfilado activo se anotan el tiempo y los bytes enviados
+def mostrar_figura(figura, clave):
+    with medir(f"st.plotly_chart {clave}") as medida:
+        st.plotly_chart(figura, use_container_width=True, key=clave)
+    if perfilado_activo():
+        medida["bytes"] = tamano_envio(figura)
+
+# Envía un mapa de Folium al navegador, igual que mostrar_figura.
+# Devuelve los bytes del HTML enviado (se miden siempre: se muestran bajo el mapa).
+def mostrar_mapa(mapa, clave=None, **opciones):
+    with medir(f"st_folium {clave or ''}".strip()) as medida:
+        importar("streamlit_folium").st_folium(mapa, use_container_width=True, key=clave, **opciones)
+    medida["bytes"] = tamano_envio(mapa)
+    return medida["bytes"]
+
 # Carga de datos
 st.sidebar.header("Datos de entrada")
-modo = st.sidebar.radio("Fuente de datos", ["📤 Subir archivo"])
-
-if modo == "📤 Subir archivo":
+MODO_ARCHIVO = "📤 Subir archivo"
+MODO_CARPETA = "📁 Carpeta local"
+MODO_HISTORICO = "🗄️ Histórico de la flota"
+# La carga desde carpeta lee rutas del servidor: solo se ofrece si hay carpetas permitidas configuradas
+modos = [MODO_ARCHIVO, MODO_CARPETA, MODO_HISTORICO] if CARPETAS_PERMITIDAS else [MODO_ARCHIVO, MODO_HISTORICO]
+modo = st.sidebar.radio("Fuente de datos", modos)
+huella = None
+df = None
+motor = None
+
+if modo == MODO_ARCHIVO:
     archivo = st.sidebar.file_uploader("Sube un Excel (.xlsx)", type=["xlsx"])
     if archivo:
 
-        df = pd.read_excel(archivo)  #lee el excel que se carga
-
-        #Vista previa de los datos subidos
-        st.subheader("Vista previa de los datos")
-        st.dataframe(df.head(10), width='stretch') 
-
-        #Se transforman las columnas a minusculas
-        df.columns = df.columns.str.lower().str.strip()
-
-        #Se estandariza la columna 'provincia'
-        if "provincia" not in df.columns:
-            if "direccion" in df.columns:
-                # Se extrae provincia de dirección
-                def extraer_provincia(dir_str):
-                    parts = str(dir_str).split(',')
-                    if len(parts) > 1:
-                        return parts[1].strip()
-                    return str(dir_str).strip()
-                df["provincia"] = df["direccion"].apply(extraer_provincia)
-            else:
-                st.error("El archivo no tiene columna 'provincia' ni 'direccion'.")
-                df = None
-    
+        huella = obtener_huella(archivo)
+
+        # Los archivos grandes se leen por bloques para acotar la memoria
+        streaming = st.sidebar.checkbox(
+            "Lectura por bloques (archivos grandes)",
+            value=archivo.size > UMBRAL_STREAMING_BYTES,
+            key="lectura_streaming"
+        )
+        barra_progreso = st.sidebar.empty()
+
+        def mostrar_progreso(fraccion, texto):
+            barra_progreso.progress(fraccion, text=texto)
+
+        with medir("cargar_datos") as medida:
+            df = cargar_datos(huella, archivo, streaming, mostrar_progreso)  #lee el excel (o su copia en caché)
+            medida["filas_salida"] = len(df)
+        barra_progreso.empty()
+
+elif modo == MODO_HISTORICO:
+    # Las nuevas exportaciones se añaden al histórico; los repostajes repetidos se descartan
+    nuevos = st.sidebar.file_uploader("Añadir exportaciones (.xlsx)", type=["xlsx"], accept_multiple_files=True, key="archivos_historico")
+    if nuevos and st.sidebar.button("Añadir al histórico"):
+        informes_historico = []
+        with st.spinner("Añadiendo al histórico..."):
+            for nuevo in nuevos:
+                huella_nuevo = obtener_huella(nuevo)
+                informes_historico.append(anadir_al_historico(cargar_excel(nuevo, huella_nuevo), huella_nuevo, nuevo.name))
+        st.session_state.informes_historico = informes_historico
+
+    for informe in st.session_state.get("informes_historico", []):
+        st.sidebar.caption(
+            f"{informe['archivo']}: {informe['nuevas']:,} nuevos, {informe['duplicadas']:,} repetidos · "
+            f"{len(informe['meses'])} meses y {informe['vehiculos']:,} vehículos actualizados"
+        )
+
+    resumen = resumen_historico()
+    if resumen["filas"]:
+        st.sidebar.caption(
+            f"{resumen['filas']:,} repostajes de {resumen['archivos']} archivos · "
+            f"{resumen['meses']} meses ({resumen['desde']} a {resumen['hasta']})"
+        )
+        with st.sidebar.expander("Totales mensuales"):
+            mensual = mensual_historico()
+            if mensual is not None:
+                columnas_mensual = [c for c in ["repostajes", "repostado_suma", "distancia_suma", "coste_suma"] if c in mensual.columns]
+                st.dataframe(mensual[columnas_mensual], use_container_width=True)
+
+        huella = huella_historico()
+
+        # Con DuckDB el histórico se puede consultar en disco sin cargarlo en memoria
+        motor_sql = importar("modulos.motor_sql")
+        en_disco = motor_sql.MOTOR_DISPONIBLE and st.sidebar.toggle(
+            "Consultar en disco (DuckDB)",
+            key="motor_disco",
+            help="Los filtros y agregaciones se calculan sobre los archivos del histórico; solo se cargan los resultados."
+        )
+        if en_disco:
+            motor = obtener_motor(huella)
+        else:
+            with medir("cargar_datos") as medida:
+                df = cargar_datos_historico(huella)
+                medida["filas_salida"] = len(df)
     else:
+        st.sidebar.info("El histórico está vacío: añade una exportación.")
+elif modo == MODO_CARPETA:
+    # Todos los .xlsx, .csv y .parquet de la carpeta se leen en paralelo y se unen en un solo conjunto
+    carpeta = st.sidebar.text_input("Carpeta con los archivos", value=st.session_state.get("carpeta_datos", ""))
+    if st.sidebar.button("Cargar"):
+        st.session_state.carpeta_datos = carpeta
+
+    carpeta_cargada = st.session_state.get("carpeta_datos")
+    if carpeta_cargada:
+        if not carpeta_permitida(carpeta_cargada):
+            st.sidebar.error(f"La carpeta {carpeta_cargada} no está dentro de las carpetas permitidas")
+        elif not Path(carpeta_cargada).is_dir():
+            st.sidebar.error(f"No existe la carpeta {carpeta_cargada}")
+        else:
+            huella = huella_carpeta(carpeta_cargada)
+            barra_progreso = st.sidebar.empty()
+
+            def mostrar_progreso(fraccion, texto):
+                barra_progreso.progress(fraccion, text=texto)
+
+            with medir("cargar_datos") as medida:
+                df = cargar_datos_carpeta(huella, carpeta_cargada, mostrar_progreso)
+                medida["filas_salida"] = len(df)
+            barra_progreso.empty()
+
+            informe_carpeta = st.session_state.get("informe_carpeta")
+            if informe_carpeta and informe_carpeta["huella"] == huella:
+                with st.sidebar.expander(f"{len(informe_carpeta['archivos'])} archivos en {informe_carpeta['segundos']:.1f} s ({informe_carpeta['procesos']} {informe_carpeta['modo']})"):
+                    st.dataframe(pd.DataFrame(informe_carpeta["archivos"]), hide_index=True, use_container_width=True)
+
+            if df.empty:
+                st.sidebar.warning("La carpeta no tiene archivos .xlsx, .csv ni .parquet que se puedan leer.")
+                df = None
+
+if df is not None:
+    #Vista previa de los datos subidos
+    st.subheader("Vista previa de los datos")
+    st.dataframe(df.head(10), width='stretch') 
+
+    #Se comprueba que exista la columna 'provincia'
+    if "provincia" not in df.columns:
+        st.error("El archivo no tiene columna 'provincia' ni 'direccion'.")
         df = None
-else:
-    st.sidebar.button("Cargar")
+elif motor is not None:
+    st.subheader("Vista previa de los datos")
+    st.dataframe(motor.consultar("SELECT * FROM repostajes LIMIT 10"), width='stretch')
+
+    if "provincia" not in motor.columnas:
+        st.error("El histórico no tiene columna 'provincia'.")
+        motor = None
 
 st.sidebar.divider()
 
 # Filtros del panel lateral
-def mostrar_filtros_laterales(df):
+# Con el motor en disco las facetas y los rangos salen de consultas y los filtros se guardan
+# como criterios (se aplican en cada consulta) en lugar de como selección de filas.
+def mostrar_filtros_laterales(df, motor=None):
     st.header("Filtros")
 
     # Se inicializan las opciones vacías
@@ -72,33 +377,24 @@ def mostrar_filtros_laterales(df):
     combustibles_seleccionados = st.session_state.get("filter_combustible", [])
     provincias_seleccionadas = st.session_state.get("filter_provincia", [])
 
-    # Función auxiliar para obtener opciones válidas basadas en otros filtros
-    def obtener_opciones_validas(df, col_objetivo, filtros_dict):
-        if df is None:
-            return []
-        
-        df_temp = df.copy()
-        for col, valores in filtros_dict.items():
-            if valores and col in df_temp.columns:
-                df_temp = df_temp[df_temp[col].isin(valores)]
-                
-        if col_objetivo in df_temp.columns:
-            return sorted(df_temp[col_objetivo].dropna().unique())
-        return []
-
     # Calcula las opciones disponibles para cada filtro basado en los otros filtros seleccionados
-    if df is not None:
-        vehiculos_disponibles = obtener_opciones_validas(df, "tipo_vehiculo", {
+    if df is not None or motor is not None:
+        if motor is not None:
+            facetas = consultar_motor((huella, "motor", None), "facetas", (), motor, None)
+        else:
+            facetas = obtener_facetas(huella, df)
+
+        vehiculos_disponibles = opciones_validas(facetas, "tipo_vehiculo", {
             "tipo_combustible": combustibles_seleccionados,
             "provincia": provincias_seleccionadas
         })
         
-        combustibles_disponibles = obtener_opciones_validas(df, "tipo_combustible", {
+        combustibles_disponibles = opciones_validas(facetas, "tipo_combustible", {
             "tipo_vehiculo": vehiculos_seleccionados,
             "provincia": provincias_seleccionadas
         })
         
-        provincias_disponibles = obtener_opciones_validas(df, "provincia", {
+        provincias_disponibles = opciones_validas(facetas, "provincia", {
             "tipo_vehiculo": vehiculos_seleccionados,
             "tipo_combustible": combustibles_seleccionados
         })
@@ -121,88 +417,180 @@ def mostrar_filtros_laterales(df):
     rangos_activos = {}
 
     st.subheader("Rangos")
+    if motor is not None:
+        extremos = consultar_motor((huella, "motor", None), "rangos", (tuple(metricas_rango),), motor, None)
+    elif df is not None:
+        # Calcula el min/max (la columna ya es numérica desde la carga)
+        extremos = {}
+        for metrica in metricas_rango:
+            if metrica in df.columns and df[metrica].notna().any():
+                extremos[metrica] = (df[metrica].min(), df[metrica].max())
+    else:
+        extremos = {}
+
     for metrica in metricas_rango:
-        if df is not None and metrica in df.columns:
-            # Calcula el min/max y asegura que el tipo sea numérico
-            datos_columna = pd.to_numeric(df[metrica], errors='coerce').dropna()
-            
-            if not datos_columna.empty:
-                valor_min = float(datos_columna.min())
-                valor_max = float(datos_columna.max())
-                
-                if valor_min < valor_max:
-                    rango_seleccionado = st.slider(f"Rango {metrica.capitalize()}", valor_min, valor_max, (valor_min, valor_max), key=f"slider_{metrica}")
-                    rangos_activos[metrica] = rango_seleccionado
-                else:
-                    st.info(f"{metrica.capitalize()}: {valor_min}")
+        if metrica in extremos:
+            valor_min = float(extremos[metrica][0])
+            valor_max = float(extremos[metrica][1])
+
+            if valor_min < valor_max:
+                rango_seleccionado = st.slider(f"Rango {metrica.capitalize()}", valor_min, valor_max, (valor_min, valor_max), key=f"slider_{metrica}")
+                rangos_activos[metrica] = rango_seleccionado
+            else:
+                st.info(f"{metrica.capitalize()}: {valor_min}")
     
     rango_fechas = st.date_input("Rango de fechas", [])
 
     aplicar = st.button("Aplicar filtros")
 
     if aplicar:
-        if df is not None:
-            datos_filtrados = aplicar_filtros(
-                df,
+        if motor is not None:
+            # Los criterios se traducen a SQL en cada consulta del motor
+            st.session_state.filtros_motor = {
+                "tipos_vehiculo": tipos_vehiculo,
+                "tipos_combustible": tipos_combustible,
+                "provincia": provincia,
+                "rangos": rangos_activos,
+                "fechas": rango_fechas
+            }
+            st.session_state.clave_filtros_motor = (huella, "motor", repr((tipos_vehiculo, tipos_combustible, provincia, rangos_activos, rango_fechas)))
+            st.rerun()
+        elif df is not None:
+            # Solo se guarda la selección de filas; los datos se comparten entre sesiones
+            mascara = calcular_mascara(
+                obtener_indice_filtros(huella, df),
                 tipos_vehiculo=tipos_vehiculo,
                 tipos_combustible=tipos_combustible,
                 provincia=provincia,
                 rangos=rangos_activos,
                 fechas=rango_fechas
             )
-            st.session_state.datos_filtrados = datos_filtrados
+            st.session_state.seleccion_filtros = comprimir_seleccion(mascara)
+            st.session_state.filtros_activos = {
+                "tipos_vehiculo": tipos_vehiculo,
+                "tipos_combustible": tipos_combustible,
+                "provincia": provincia,
+                "rangos": rangos_activos,
+                "fechas": rango_fechas
+            }
+            st.session_state.clave_filtros = (huella, repr((tipos_vehiculo, tipos_combustible, provincia, rangos_activos, rango_fechas)))
             st.rerun()
 
 # Llamada a la función para mostrar los filtros
-with st.sidebar:
-    mostrar_filtros_laterales(df)
+with st.sidebar, medir("panel_filtros"):
+    mostrar_filtros_laterales(df, motor)
+
+# Recupera los datos filtrados (solo si corresponden al archivo cargado)
+seleccion_filtros = st.session_state.seleccion_filtros
+clave_filtros = st.session_state.get("clave_filtros")
+if df is not None and clave_filtros is not None and clave_filtros[0] == huella:
+    with medir("datos_filtrados", len(df)) as medida:
+        datos_activos = obtener_datos_filtrados(clave_filtros, df, seleccion_filtros)
+        medida["filas_salida"] = len(datos_activos)
+    clave_activa = clave_filtros
+    filtros_activos = st.session_state.filtros_activos
+else:
+    datos_activos = df
+    clave_activa = (huella, None)
+    filtros_activos = {}
+
+# Con el motor en disco no hay filas en memoria: los datos activos son los criterios de filtrado
+filtros_motor = None
+if motor is not None:
+    clave_filtros_motor = st.session_state.get("clave_filtros_motor")
+    if clave_filtros_motor is not None and clave_filtros_motor[0] == huella:
+        filtros_motor = st.session_state.filtros_motor
+        clave_activa = clave_filtros_motor
+    else:
+        clave_activa = (huella, "motor", None)
 
-# Recupera los datos filtrados 
-datos_filtrados = st.session_state.datos_filtrados
-datos_activos = datos_filtrados if datos_filtrados is not None else df
+with st.sidebar:
+    st.caption(f"Memoria de la sesión: {memoria_sesion() / 1024:,.1f} KB")
+    with st.expander("Almacén de datos compartido"):
+        estadisticas = obtener_registro().estadisticas()
+        st.caption(
+            f"{estadisticas['conjuntos']} conjuntos · "
+            f"{estadisticas['bytes_residentes'] / 1024 ** 2:,.1f} de {estadisticas['presupuesto_bytes'] / 1024 ** 2:,.0f} MB\n\n"
+            f"Aciertos: {estadisticas['aciertos']} · Fallos: {estadisticas['fallos']} · Expulsiones: {estadisticas['expulsiones']}"
+        )
 
 # Crea las distintas pestañas
-tab_general, tab_provincia, tab_vehiculo = st.tabs(["Vista General", "Vista por Provincia", "Detalle Vehículo"])
-
-# Función para mostrar los gráficos repetidos en General y Provincia
-def mostrar_graficos_resumen(datos_locales, clave_sufijo=""):
-
-    if datos_locales is None or datos_locales.empty:
+tab_general, tab_provincia, tab_vehiculo, tab_anomalias = st.tabs(["Vista General", "Vista por Provincia", "Detalle Vehículo", "Anomalías"])
+
+# Cubo de unos datos en memoria. Si se conocen los filtros laterales que los producen se reduce el
+# cubo base del conjunto cargado; al cambiar de filtros o de provincia no se vuelven a agrupar las filas.
+def cubo_local(clave, datos, filtros=None):
+    base = obtener_cubo_base(huella, df) if filtros is not None and df is not None else None
+    return obtener_cubo(clave, datos, base, filtros)
+
+# Función para mostrar los gráficos repetidos en General y Provincia.
+# Con el motor en disco no se pasan filas: los gráficos se construyen con sus consultas agregadas.
+# 'filtros' son los criterios que producen los datos (para el motor o para reducir el cubo base).
+def mostrar_graficos_resumen(datos_locales, clave_sufijo="", clave_datos=None, motor=None, filtros=None):
+
+    if motor is not None:
+        if consultar_motor(clave_datos, "contar", (), motor, filtros) == 0:
+            st.info("No hay datos para mostrar.")
+            return
+        columnas = motor.columnas
+    elif datos_locales is None or datos_locales.empty:
         st.info("No hay datos para mostrar.")
         return
+    else:
+        columnas = datos_locales.columns
+
+    graficos = importar("modulos.graficos")
+
+    # Los gráficos temporales leen del cubo en lugar de agrupar las filas en cada ejecución.
+    # Las figuras ya construidas para estos datos se reutilizan desde la caché de figuras.
+    if clave_datos is None:
+        clave_datos = huella_datos(datos_locales)
+    if motor is not None:
+        cubo = consultar_motor(clave_datos, "cubo", (), motor, filtros)
+    else:
+        cubo = cubo_local(clave_datos, datos_locales, filtros)
 
     # 1. Gráficos Temporales
     col1, col2 = st.columns(2)
     with col1:
-        if "repostado" in datos_locales.columns and "fecha" in datos_locales.columns:
-            fig_rep = grafico_barras_temporal(datos_locales, "fecha", "repostado", "M", "Repostado Mensual (l)")
-            if fig_rep: st.plotly_chart(fig_rep, use_container_width=True, key=f"bar_rep_{clave_sufijo}")
+        if "repostado" in columnas and "fecha" in columnas:
+            fig_rep = figura_en_cache(clave_datos, "barras_repostado", lambda: graficos.grafico_barras_temporal(datos_locales, "fecha", "repostado", "M", "Repostado Mensual (l)", cubo=cubo))
+            if fig_rep: mostrar_figura(fig_rep, f"bar_rep_{clave_sufijo}")
     
     with col2:
-        if "distancia" in datos_locales.columns and "fecha" in datos_locales.columns:
-            fig_dist = grafico_barras_temporal(datos_locales, "fecha", "distancia", "M", "Recorrido Mensual (km)")
-            if fig_dist: st.plotly_chart(fig_dist, use_container_width=True, key=f"bar_dist_{clave_sufijo}")
+        if "distancia" in columnas and "fecha" in columnas:
+            fig_dist = figura_en_cache(clave_datos, "barras_distancia", lambda: graficos.grafico_barras_temporal(datos_locales, "fecha", "distancia", "M", "Recorrido Mensual (km)", cubo=cubo))
+            if fig_dist: mostrar_figura(fig_dist, f"bar_dist_{clave_sufijo}")
             
     st.divider()
     
     # 2. Tipos de Combustible y Día de la Semana
     col3, col4 = st.columns(2)
     with col3:
-        if "tipo_combustible" in datos_locales.columns:
-            fig_comb = grafico_tarta_distribucion(datos_locales, "tipo_combustible", "Tipos de Combustible")
-            if fig_comb: st.plotly_chart(fig_comb, use_container_width=True, key=f"pie_comb_{clave_sufijo}")
+        if "tipo_combustible" in columnas:
+            def construir_tarta():
+                totales = consultar_motor(clave_datos, "distribucion", ("tipo_combustible",), motor, filtros) if motor is not None else None
+                return graficos.grafico_tarta_distribucion(datos_locales, "tipo_combustible", "Tipos de Combustible", totales=totales)
+            fig_comb = figura_en_cache(clave_datos, "tarta_combustible", construir_tarta)
+            if fig_comb: mostrar_figura(fig_comb, f"pie_comb_{clave_sufijo}")
             
     with col4:
-        if "fecha" in datos_locales.columns:
-            fig_sem = grafico_dia_semana(datos_locales, "fecha")
-            if fig_sem: st.plotly_chart(fig_sem, use_container_width=True, key=f"pie_sem_{clave_sufijo}")
+        if "fecha" in columnas:
+            fig_sem = figura_en_cache(clave_datos, "dia_semana", lambda: graficos.grafico_dia_semana(datos_locales, "fecha", cubo=cubo))
+            if fig_sem: mostrar_figura(fig_sem, f"pie_sem_{clave_sufijo}")
 
     st.divider()
     
     # 3. Top Vehículos
     st.subheader("Top Vehículos")
     num_vehiculos = st.slider("Número de vehículos a mostrar:", min_value=5, max_value=20, value=5, key=f"slider_top_{clave_sufijo}")
-    top_vehiculos = mostrar_top_vehiculos(datos_locales, top_n=num_vehiculos)
+    def construir_top():
+        if motor is not None:
+            totales = consultar_motor(clave_datos, "totales_vehiculo", (), motor, filtros)
+        else:
+            totales = totales_vehiculo(clave_datos, datos_locales) if "vehiculo" in columnas else None
+        return graficos.mostrar_top_vehiculos(datos_locales, top_n=num_vehiculos, totales=totales)
+    top_vehiculos = figura_en_cache(clave_datos, "top_vehiculos", construir_top, num_vehiculos)
     if top_vehiculos:
         
         col_top1, col_top2, col_top3 = st.columns(3)
@@ -224,42 +612,102 @@ def mostrar_graficos_resumen(datos_locales, clave_sufijo=""):
 
     st.divider()
 
-with tab_general:
-    if datos_activos is not None:
+    # 4. Mapa de la flota agregado en una rejilla
+    if "latitud" in columnas and "longitud" in columnas:
+        st.subheader("Mapa de la Flota")
+        if st.toggle("Mostrar mapa", key=f"mapa_flota_{clave_sufijo}"):
+            tamano_celda = st.select_slider(
+                "Tamaño de celda (grados):",
+                options=[0.01, 0.02, 0.05, 0.1, 0.25, 0.5],
+                value=graficos.TAMANO_CELDA,
+                key=f"celda_{clave_sufijo}"
+            )
+            informe_flota = {}
+            celdas = consultar_motor(clave_datos, "rejilla", (tamano_celda,), motor, filtros) if motor is not None else None
+            f_flota = graficos.mapa_flota(datos_locales, tamano_celda, informe=informe_flota, celdas=celdas)
+            if f_flota:
+                bytes_mapa = mostrar_mapa(f_flota, f"mapa_{clave_sufijo}", height=600, returned_objects=[])
+                st.caption(
+                    f"{informe_flota['celdas']:,} celdas con {informe_flota['repostajes']:,} repostajes · "
+                    f"{bytes_mapa / 1024:,.0f} KB · {informe_flota['tiempo_ms']:.0f} ms"
+                )
+
+with tab_general, medir("pestaña general"):
+    if motor is not None:
+        st.subheader("Vista General de la Flota")
+        mostrar_graficos_resumen(None, "general", clave_activa, motor, filtros_motor)
+    elif datos_activos is not None:
         st.subheader("Vista General de la Flota")
-        mostrar_graficos_resumen(datos_activos, "general")
+        mostrar_graficos_resumen(datos_activos, "general", clave_activa, filtros=filtros_activos)
     else:
         st.info("Carga un archivo para ver los datos.")
 
-with tab_provincia:
-    if datos_activos is not None:
+with tab_provincia, medir("pestaña provincia"):
+    if motor is not None:
+        st.subheader("Vista por Provincia")
+
+        # Lista de provincias y resumen calculados por el motor; la provincia elegida se añade a los filtros
+        lugares = consultar_motor(clave_activa, "valores", ("provincia",), motor, filtros_motor)
+        lugar_sel = st.selectbox("Selecciona Provincia:", lugares, index=0)
+
+        if lugar_sel:
+            resumen = consultar_motor(clave_activa, "resumen", ("provincia",), motor, filtros_motor).loc[lugar_sel]
+            columnas_resumen = st.columns(len(resumen))
+            etiquetas = {"repostajes": "Repostajes", "repostado": "Litros", "distancia": "Kilómetros", "coste": "Coste (€)"}
+            for columna_resumen, (nombre, valor) in zip(columnas_resumen, resumen.items()):
+                columna_resumen.metric(etiquetas.get(nombre, nombre), f"{valor:,.0f}")
+
+            filtros_prov = {**(filtros_motor or {}), "provincia": [lugar_sel]}
+            mostrar_graficos_resumen(None, "provincia", clave_activa + (lugar_sel,), motor, filtros_prov)
+    elif datos_activos is not None:
         st.subheader("Vista por Provincia")
         
         if "provincia" in datos_activos.columns:
-            lugares = sorted(datos_activos["provincia"].astype(str).unique())
+            # Lista de provincias, filas y resumen salen del índice de particiones
+            particiones = obtener_particiones(clave_activa, "provincia", datos_activos)
+            lugares = particiones["valores"]
             lugar_sel = st.selectbox("Selecciona Provincia:", lugares, index=0)
             
             if lugar_sel:
-                datos_prov = datos_activos[datos_activos["provincia"] == lugar_sel]
-                mostrar_graficos_resumen(datos_prov, "provincia")
+                resumen = particiones["resumen"].loc[lugar_sel]
+                columnas_resumen = st.columns(len(resumen))
+                etiquetas = {"repostajes": "Repostajes", "repostado": "Litros", "distancia": "Kilómetros", "coste": "Coste (€)"}
+                for columna_resumen, (nombre, valor) in zip(columnas_resumen, resumen.items()):
+                    columna_resumen.metric(etiquetas.get(nombre, nombre), f"{valor:,.0f}")
+
+                datos_prov = filas_valor(datos_activos, particiones, lugar_sel)
+                mostrar_graficos_resumen(datos_prov, "provincia", clave_activa + (lugar_sel,), filtros={**filtros_activos, "provincia": [lugar_sel]})
         else:
             st.warning("No se encontró columna de Provincia.")
     else:
         st.info("Carga un archivo.")
 
-with tab_vehiculo:
-    if df is not None:
+with tab_vehiculo, medir("pestaña vehículo"):
+    if df is not None or motor is not None:
         st.subheader("Vista Detallada del Vehículo")
         
         # Selector de vehículo
         datos_base = datos_activos
+        columnas_base = motor.columnas if motor is not None else datos_base.columns
         
-        if "vehiculo" in datos_base.columns:
-            vehiculos = sorted(datos_base["vehiculo"].astype(str).unique())
+        if "vehiculo" in columnas_base:
+            if motor is not None:
+                indice_vehiculos = None
+                vehiculos = consultar_motor(clave_activa, "valores", ("vehiculo",), motor, filtros_motor)
+            else:
+                indice_vehiculos = obtener_indice_vehiculos(clave_activa, datos_base)
+                vehiculos = indice_vehiculos["valores"]
             vehiculo_sel = st.selectbox("Selecciona Vehículo:", vehiculos, index=None, placeholder="Matrícula...")
             
             if vehiculo_sel:
-                datos_vehiculo = datos_base[datos_base["vehiculo"].astype(str) == str(vehiculo_sel)]
+                graficos = importar("modulos.graficos")
+                if motor is not None:
+                    # Del disco solo se traen las filas del vehículo elegido; la comparativa usa el cubo
+                    cubo_activo = consultar_motor(clave_activa, "cubo", (), motor, filtros_motor)
+                    datos_vehiculo = consultar_motor(clave_activa, "filas_vehiculo", (vehiculo_sel,), motor, filtros_motor)
+                else:
+                    cubo_activo = cubo_local(clave_activa, datos_activos, filtros_activos)
+                    datos_vehiculo = filas_valor(datos_base, indice_vehiculos, vehiculo_sel)
                 
                 # Gráficos mensuales, semanales y anuales
                 periodo = st.radio("Agrupación temporal:", ["Mensual", "Semanal", "Anual"], horizontal=True)
@@ -273,12 +721,12 @@ with tab_vehiculo:
                 c1, c2 = st.columns(2)
                 with c1:
                      if "repostado" in datos_vehiculo.columns:
-                         f1 = grafico_barras_temporal(datos_vehiculo, "fecha", "repostado", codigo_periodo, f"Repostado ({periodo})")
-                         if f1: st.plotly_chart(f1, use_container_width=True, key="v_rep")
+                         f1 = graficos.grafico_barras_temporal(datos_vehiculo, "fecha", "repostado", codigo_periodo, f"Repostado ({periodo})", cubo=cubo_activo, vehiculo=vehiculo_sel)
+                         if f1: mostrar_figura(f1, "v_rep")
                 with c2:
                     if "distancia" in datos_vehiculo.columns:
-                         f2 = grafico_barras_temporal(datos_vehiculo, "fecha", "distancia", codigo_periodo, f"Recorrido ({periodo})")
-                         if f2: st.plotly_chart(f2, use_container_width=True, key="v_dist")
+                         f2 = graficos.grafico_barras_temporal(datos_vehiculo, "fecha", "distancia", codigo_periodo, f"Recorrido ({periodo})", cubo=cubo_activo, vehiculo=vehiculo_sel)
+                         if f2: mostrar_figura(f2, "v_dist")
                          
                 st.divider()
                 
@@ -290,27 +738,122 @@ with tab_vehiculo:
                         st.warning("No se encontró columna 'consumo'. Se muestra evolución de 'repostado'.")
                         columna_consumo = "repostado"
 
-                    tendencia = grafico_lineal_consumo(datos_vehiculo, "fecha", columna_consumo)
-                    if tendencia: st.plotly_chart(tendencia, use_container_width=True, key="v_trend")
+                    if motor is not None:
+                        tendencias_base = obtener_tendencias(clave_activa + (vehiculo_sel,), columna_consumo, datos_vehiculo)
+                    else:
+                        tendencias_base = obtener_tendencias(clave_activa, columna_consumo, datos_activos)
+                    tendencias = tendencias_vehiculo(tendencias_base, vehiculo_sel)
+
+                    # Repostajes anómalos del vehículo (con el umbral elegido en la pestaña de anomalías)
+                    anomalias_sel = None
+                    if motor is None:
+                        umbral = st.session_state.get("umbral_anomalias", UMBRAL_ANOMALIA)
+                        anomalias_sel = anomalias_vehiculo(obtener_anomalias(clave_activa, datos_activos), vehiculo_sel, umbral)
+                    tendencia = graficos.grafico_lineal_consumo(datos_vehiculo, "fecha", columna_consumo, tendencias=tendencias, anomalias=anomalias_sel)
+                    if tendencia: mostrar_figura(tendencia, "v_trend")
                 
                 st.divider()
                 st.subheader("Comparativa con Modelo")
-                metricas = [c for c in ["repostado", "distancia", "consumo"] if c in datos_activos.columns]
+                metricas = [c for c in ["repostado", "distancia", "consumo"] if c in columnas_base]
                 if metricas:
                     metrica_comp = st.selectbox("Métrica a comparar:", metricas)
-                    f_comp = grafico_comparativo_modelo(datos_activos, vehiculo_sel, "fecha", metrica_comp, "tipo_vehiculo")
-                    if f_comp: st.plotly_chart(f_comp, use_container_width=True, key="v_comp")
+                    f_comp = graficos.grafico_comparativo_modelo(datos_activos, vehiculo_sel, "fecha", metrica_comp, "tipo_vehiculo", cubo=cubo_activo, indice_vehiculos=indice_vehiculos)
+                    if f_comp: mostrar_figura(f_comp, "v_comp")
                     else: st.info("No se pudo generar la comparativa (faltan datos del modelo).")
                 
             # Mapa
                 st.divider()
                 st.subheader("Mapa de Repostajes")
                 if "latitud" in datos_vehiculo.columns:
-                     f_map = mapa_repostajes(datos_vehiculo, vehiculo_sel)
+                     informe_mapa = {}
+                     datos_mapa = datos_vehiculo if motor is not None else datos_activos
+                     f_map = graficos.mapa_repostajes(datos_mapa, vehiculo_sel, informe=informe_mapa, indice_vehiculos=indice_vehiculos)
                      if f_map: 
-                         streamlit_folium.st_folium(f_map, use_container_width=True, height=700)
+                         bytes_mapa = mostrar_mapa(f_map, height=700)
+                         st.caption(
+                             f"{informe_mapa['puntos']:,} puntos de {informe_mapa['repostajes']:,} repostajes · "
+                             f"{bytes_mapa / 1024:,.0f} KB · {informe_mapa['tiempo_ms']:.0f} ms"
+                         )
                 
             else:
                 st.info("Selecciona un vehículo.")
         else:
-            st.warning("No se encontró la columna 'vehiculo'.")
\ No newline at end of file
+            st.warning("No se encontró la columna 'vehiculo'.")
+
+with tab_anomalias, medir("pestaña anomalías"):
+    if motor is not None:
+        st.info("La detección de anomalías puntúa todos los repostajes en memoria: desactiva 'Consultar en disco' para usarla.")
+    elif datos_activos is not None:
+        st.subheader("Repostajes Anómalos")
+        st.caption(
+            "Cada repostaje se compara con los repostajes cercanos de su vehículo (consumo y litros por 100 km) "
+            "y con los vehículos de su modelo, con medianas y desviaciones robustas."
+        )
+        anomalias = obtener_anomalias(clave_activa, datos_activos)
+
+        if anomalias is None:
+            st.warning("Se necesitan las columnas 'vehiculo', 'fecha' y 'consumo' (o 'repostado' y 'distancia').")
+        else:
+            col_umbral, col_motivo, col_vehiculo = st.columns(3)
+            with col_umbral:
+                umbral = st.slider("Puntuación mínima:", min_value=2.0, max_value=10.0, value=UMBRAL_ANOMALIA, step=0.5, key="umbral_anomalias")
+            with col_motivo:
+                motivos = st.multiselect("Motivo:", list(anomalias["motivo"].cat.categories), key="motivo_anomalias")
+            candidatas = ranking_anomalias(anomalias, umbral, motivos=motivos)
+            with col_vehiculo:
+                vehiculos_anomalos = st.multiselect("Vehículo:", sorted(candidatas["vehiculo"].astype(str).unique()), key="vehiculo_anomalias")
+            ranking = ranking_anomalias(candidatas, umbral, vehiculos=vehiculos_anomalos)
+
+            col_num, col_veh, col_litros = st.columns(3)
+            col_num.metric("Repostajes anómalos", f"{len(ranking):,}", f"{len(ranking) / len(anomalias):.2%} del total", delta_color="off")
+            col_veh.metric("Vehículos afectados", f"{ranking['vehiculo'].nunique():,}")
+            if "repostado" in ranking.columns:
+                col_litros.metric("Litros implicados", f"{ranking['repostado'].sum():,.0f}")
+
+            # Solo se envían al navegador las filas de mayor puntuación
+            columnas_tabla = [c for c in ["vehiculo", "fecha", "tipo_vehiculo", "provincia", "repostado", "distancia", "consumo",
+                                          "litros_100km", "puntuacion", "motivo", "z_consumo", "z_litros", "z_modelo"] if c in ranking.columns]
+            with medir("tabla anomalías", len(ranking)):
+                st.dataframe(
+                    ranking[columnas_tabla].head(MAX_FILAS_ANOMALIAS),
+                    hide_index=True,
+                    use_container_width=True,
+                    column_config={
+                        "litros_100km": st.column_config.NumberColumn("l/100 km", format="%.2f"),
+                        "puntuacion": st.column_config.ProgressColumn("Puntuación", format="%.1f", min_value=0.0, max_value=max(float(ranking["puntuacion"].max()), umbral) if len(ranking) else umbral),
+                        "z_consumo": st.column_config.NumberColumn(format="%.1f"),
+                        "z_litros": st.column_config.NumberColumn(format="%.1f"),
+                        "z_modelo": st.column_config.NumberColumn(format="%.1f")
+                    }
+                )
+            if len(ranking) > MAX_FILAS_ANOMALIAS:
+                st.caption(f"Se muestran los {MAX_FILAS_ANOMALIAS:,} de mayor puntuación de {len(ranking):,}.")
+    else:
+        st.info("Carga un archivo.")
+
+# Panel de perfilado: tiempos, filas y bytes de cada etapa de esta ejecución.
+# Se cierra el registro antes de dibujar el panel para que el propio panel no cuente.
+registro_perfilado = finalizar_registro(registro_perfilado, sesion=st.session_state.setdefault("id_sesion", uuid.uuid4().hex[:8]))
+informe_arranque = registrar_primera_pintura()
+with st.sidebar:
+    st.divider()
+    st.toggle("Perfilado (depuración)", value=PERFILADO_INICIAL, key="perfilado")
+    if registro_perfilado:
+        with st.expander("Arranque"):
+            if informe_arranque["servidor_listo"] is not None:
+                st.caption(f"Servidor listo: {informe_arranque['servidor_listo']:.2f} s")
+            if informe_arranque["primera_pintura"] is not None:
+                st.caption(f"Primera pintura: {informe_arranque['primera_pintura']:.2f} s")
+            importaciones = {**informe_arranque["importaciones"], **ARRANQUE["importaciones"]}
+            st.dataframe(tabla_importaciones(importaciones), hide_index=True, use_container_width=True)
+        with st.expander("Perfilado de la ejecución", expanded=True):
+            st.caption(f"Ejecución completa: {registro_perfilado['total_segundos'] * 1000:,.0f} ms")
+            st.dataframe(
+                tabla_etapas(registro_perfilado),
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    "ms": st.column_config.NumberColumn(format="%.1f"),
+                    "KB enviados": st.column_config.NumberColumn(format="%.1f")
+                }
+            )
@@ -0,0 +1,199 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Se ejecuta como módulo desde la raíz del repositorio: python -m benchmarks.benchmark
+from benchmarks.generador import generar_flota
+from modulos.agregados import construir_cubo, reducir_cubo
+from modulos.anomalias import detectar_anomalias
+from modulos.filtros import aplicar_filtros, construir_indice
+from modulos.graficos import (
+    grafico_barras_temporal,
+    grafico_comparativo_modelo,
+    grafico_dia_semana,
+    grafico_lineal_consumo,
+    grafico_tarta_distribucion,
+    mapa_repostajes,
+    mostrar_top_vehiculos
+)
+
+# Tamaños por defecto (número de repostajes)
+TAMANOS = [10_000, 1_000_000, 10_000_000]
+
+# Línea base por defecto, junto a este script. Depende de la máquina, por eso no está en el
+# repositorio: se genera con --guardar-linea-base en la máquina donde se va a comprobar.
+RUTA_LINEA_BASE = Path(__file__).resolve().parent / "linea_base.json"
+
+# Margen permitido sobre la línea base antes de considerarlo una regresión (0.25 = 25 %)
+TOLERANCIA_TIEMPO = 0.25
+TOLERANCIA_MEMORIA = 0.25
+
+# Diferencias por debajo de estos mínimos se consideran ruido de medida
+MINIMO_SEGUNDOS = 0.005
+MINIMO_MB = 1.0
+
+
+# Casos medidos: nombre y función que recibe los datos y el contexto preparado
+def casos_benchmark():
+    return {
+        "aplicar_filtros": lambda df, c: aplicar_filtros(
+            df, tipos_vehiculo=c["tipos_vehiculo"], tipos_combustible=c["tipos_combustible"],
+            provincia=c["provincias"], rangos={"repostado": (10, 200)}, fechas=c["fechas"]
+        ),
+        "aplicar_filtros_indice": lambda df, c: aplicar_filtros(
+            df, tipos_vehiculo=c["tipos_vehiculo"], tipos_combustible=c["tipos_combustible"],
+            provincia=c["provincias"], rangos={"repostado": (10, 200)}, fechas=c["fechas"], indice=c["indice"]
+        ),
+        "cubo_filtrado_filas": lambda df, c: construir_cubo(aplicar_filtros(df, **c["filtros_cubo"], indice=c["indice"])),
+        "cubo_filtrado_reducido": lambda df, c: reducir_cubo(c["cubo_base"], **c["filtros_cubo"]),
+        "grafico_barras_temporal": lambda df, c: grafico_barras_temporal(df, "fecha", "repostado", "M", "Repostado Mensual (l)"),
+        "grafico_tarta_distribucion": lambda df, c: grafico_tarta_distribucion(df, "tipo_combustible", "Tipos de Combustible"),
+        "grafico_dia_semana": lambda df, c: grafico_dia_semana(df, "fecha"),
+        "grafico_lineal_consumo": lambda df, c: grafico_lineal_consumo(c["datos_vehiculo"], "fecha", "consumo"),
+        "grafico_comparativo_modelo": lambda df, c: grafico_comparativo_modelo(df, c["vehiculo"], "fecha", "consumo", "tipo_vehiculo"),
+        "mostrar_top_vehiculos": lambda df, c: mostrar_top_vehiculos(df, top_n=10),
+        "mapa_repostajes": lambda df, c: mapa_repostajes(df, c["vehiculo"]),
+        "detectar_anomalias": lambda df, c: detectar_anomalias(df)
+    }
+
+
+# Prepara lo que los casos necesitan y no forma parte de la medida (vehículo elegido, índice de filtros...)
+def preparar_contexto(df):
+    vehiculo = df["vehiculo"].value_counts().index[0]
+    fechas = df["fecha"].min(), df["fecha"].max()
+    return {
+        "vehiculo": vehiculo,
+        "datos_vehiculo": df[df["vehiculo"] == vehiculo],
+        "tipos_vehiculo": list(df["tipo_vehiculo"].cat.categories[:2]),
+        "tipos_combustible": list(df["tipo_combustible"].cat.categories[:2]),
+        "provincias": list(df["provincia"].cat.categories[:5]),
+        "fechas": (fechas[0] + (fechas[1] - fechas[0]) / 4, fechas[1] - (fechas[1] - fechas[0]) / 4),
+        "indice": construir_indice(df),
+        "cubo_base": construir_cubo(df, filtrable=True),
+        "filtros_cubo": {"tipos_combustible": list(df["tipo_combustible"].cat.categories[:2]), "provincia": list(df["provincia"].cat.categories[:5])}
+    }
+
+
+# Mide un caso: el mejor tiempo de varias repeticiones y, en una ejecución aparte, el pico de memoria.
+# La memoria se mide aparte porque tracemalloc ralentiza la ejecución.
+def medir(funcion, df, contexto, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        funcion(df, contexto)
+        tiempos.append(time.perf_counter() - inicio)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        funcion(df, contexto)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"segundos": min(tiempos), "pico_mb": pico / (1024 * 1024)}
+
+
+# Compara un resultado con su línea base; devuelve la descripción de la regresión o None
+def comparar(resultado, base, tolerancia_tiempo, tolerancia_memoria):
+    if base is None:
+        return None
+    problemas = []
+    limite_tiempo = base["segundos"] * (1 + tolerancia_tiempo)
+    if resultado["segundos"] > limite_tiempo and resultado["segundos"] - base["segundos"] > MINIMO_SEGUNDOS:
+        problemas.append(f"tiempo {base['segundos']:.3f} s -> {resultado['segundos']:.3f} s")
+    limite_memoria = base["pico_mb"] * (1 + tolerancia_memoria)
+    if resultado["pico_mb"] > limite_memoria and resultado["pico_mb"] - base["pico_mb"] > MINIMO_MB:
+        problemas.append(f"memoria {base['pico_mb']:.1f} MB -> {resultado['pico_mb']:.1f} MB")
+    return ", ".join(problemas) or None
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Mide el tiempo y la memoria de los filtros y gráficos con datos sintéticos.")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS, help="Número de repostajes de cada prueba")
+    parser.add_argument("--vehiculos", type=int, default=None, help="Número de vehículos (por defecto: uno por cada 1000 repostajes, mínimo 50)")
+    parser.add_argument("--dias", type=int, default=730, help="Días que abarcan los datos")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del generador")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones de cada medida de tiempo")
+    parser.add_argument("--casos", nargs="+", default=None, help="Casos a medir (por defecto: todos)")
+    parser.add_argument("--linea-base", default=str(RUTA_LINEA_BASE), help="Archivo JSON con la línea base")
+    parser.add_argument("--guardar-linea-base", action="store_true", help="Guarda los resultados como nueva línea base")
+    parser.add_argument("--comprobar", action="store_true", help="Falla si no hay línea base o si algún caso no tiene medida de referencia")
+    parser.add_argument("--tolerancia-tiempo", type=float, default=TOLERANCIA_TIEMPO)
+    parser.add_argument("--tolerancia-memoria", type=float, default=TOLERANCIA_MEMORIA)
+    args = parser.parse_args(argumentos)
+
+    casos = casos_benchmark()
+    if args.casos:
+        desconocidos = set(args.casos) - set(casos)
+        if desconocidos:
+            parser.error(f"casos desconocidos: {', '.join(sorted(desconocidos))}")
+        casos = {nombre: casos[nombre] for nombre in args.casos}
+
+    ruta_linea_base = Path(args.linea_base)
+    if args.comprobar and not ruta_linea_base.exists():
+        parser.error(f"no existe la línea base {ruta_linea_base}; créala con --guardar-linea-base")
+    linea_base = json.loads(ruta_linea_base.read_text(encoding="utf-8")) if ruta_linea_base.exists() else {}
+    resultados = {}
+    regresiones = []
+
+    for tamano in args.tamanos:
+        num_vehiculos = args.vehiculos or max(50, tamano // 1000)
+        inicio = time.perf_counter()
+        df = generar_flota(num_vehiculos=num_vehiculos, num_repostajes=tamano, dias=args.dias, semilla=args.semilla)
+        contexto = preparar_contexto(df)
+        print(f"\n{tamano:,} repostajes, {num_vehiculos:,} vehículos (generados en {time.perf_counter() - inicio:.1f} s)")
+        print(f"{'caso':<30}{'tiempo (s)':>12}{'pico (MB)':>12}{'base (s)':>12}  estado")
+
+        clave_tamano = str(tamano)
+        resultados[clave_tamano] = {}
+        for nombre, funcion in casos.items():
+            resultado = medir(funcion, df, contexto, args.repeticiones)
+            resultados[clave_tamano][nombre] = resultado
+
+            base = linea_base.get("resultados", {}).get(clave_tamano, {}).get(nombre)
+            regresion = comparar(resultado, base, args.tolerancia_tiempo, args.tolerancia_memoria)
+            if regresion:
+                regresiones.append(f"{tamano:,} / {nombre}: {regresion}")
+            elif base is None and args.comprobar:
+                regresiones.append(f"{tamano:,} / {nombre}: sin línea base")
+            estado = "REGRESIÓN" if regresion else ("ok" if base else "sin base")
+            texto_base = f"{base['segundos']:.4f}" if base else "-"
+            print(f"{nombre:<30}{resultado['segundos']:>12.4f}{resultado['pico_mb']:>12.1f}{texto_base:>12}  {estado}")
+
+        del df, contexto
+        gc.collect()
+
+    if args.guardar_linea_base:
+        # Se conservan los tamaños y casos de la línea base anterior que no se han vuelto a medir
+        anteriores = linea_base.get("resultados", {})
+        for clave_tamano, casos_medidos in resultados.items():
+            anteriores.setdefault(clave_tamano, {}).update(casos_medidos)
+        linea_base = {
+            "python": platform.python_version(),
+            "maquina": platform.platform(),
+            "semilla": args.semilla,
+            "dias": args.dias,
+            "resultados": anteriores
+        }
+        ruta_linea_base.write_text(json.dumps(linea_base, indent=1), encoding="utf-8")
+        print(f"\nLínea base guardada en {ruta_linea_base}")
+        return 0
+
+    if regresiones:
+        print("\nRegresiones:")
+        for regresion in regresiones:
+            print(f"  {regresion}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
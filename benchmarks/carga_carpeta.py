@@ -0,0 +1,87 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Se ejecuta como módulo desde la raíz del repositorio: python -m benchmarks.carga_carpeta
+from benchmarks.generador import generar_flota
+from modulos import carga
+
+# Aceleración mínima con todos los procesos frente a uno para dar la comprobación por buena
+ACELERACION_MINIMA = 1.5
+
+
+# Escribe la flota repartida en varios archivos del formato pedido
+def escribir_archivos(df, carpeta, num_archivos, formato):
+    for i, parte in enumerate(df.groupby(df.index % num_archivos)):
+        datos = parte[1].astype({"vehiculo": str})
+        ruta = carpeta / f"parte_{i:03d}.{formato}"
+        if formato == "csv":
+            datos.to_csv(ruta, sep=";", index=False)
+        elif formato == "xlsx":
+            datos.to_excel(ruta, index=False)
+        else:
+            datos.to_parquet(ruta, index=False)
+
+
+# Mide la carga de la carpeta con un número de procesos, siempre sin caché en disco
+def medir_carga(carpeta, cache, procesos, repeticiones):
+    tiempos = []
+    informe = {}
+    for _ in range(repeticiones):
+        shutil.rmtree(cache, ignore_errors=True)
+        inicio = time.perf_counter()
+        carga.cargar_carpeta(carpeta, procesos=procesos, informe=informe)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos), informe["modo"]
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Mide cómo escala la carga de una carpeta con el número de procesos.")
+    parser.add_argument("--archivos", type=int, default=8, help="Número de archivos de la carpeta")
+    parser.add_argument("--filas", type=int, default=400_000, help="Repostajes en total entre todos los archivos")
+    parser.add_argument("--formato", choices=["csv", "xlsx", "parquet"], default="csv")
+    parser.add_argument("--procesos", type=int, nargs="+", default=None, help="Procesos de cada medida (por defecto: 1 y todos los núcleos)")
+    parser.add_argument("--repeticiones", type=int, default=2, help="Repeticiones de cada medida")
+    parser.add_argument("--comprobar", action="store_true", help=f"Falla si con todos los procesos no es al menos {ACELERACION_MINIMA}x más rápido que con uno")
+    args = parser.parse_args(argumentos)
+
+    nucleos = os.cpu_count() or 1
+    if args.comprobar and nucleos < 2:
+        parser.error("la comprobación necesita al menos dos núcleos")
+    procesos = sorted(set(args.procesos or [1, nucleos]))
+
+    with tempfile.TemporaryDirectory() as temporal:
+        carpeta = Path(temporal) / "datos"
+        cache = Path(temporal) / "cache"
+        carpeta.mkdir()
+
+        # Los procesos hijos leen la carpeta de la caché del entorno al importar modulos.carga
+        os.environ["REPOSTAJES_CACHE"] = str(cache)
+        carga.DIRECTORIO_CACHE = cache
+        carga.CARPETAS_PERMITIDAS = [carpeta.resolve()]
+
+        df = generar_flota(num_vehiculos=max(50, args.filas // 1000), num_repostajes=args.filas)
+        escribir_archivos(df, carpeta, args.archivos, args.formato)
+        print(f"{args.archivos} archivos {args.formato} con {args.filas:,} repostajes en total ({nucleos} núcleos)")
+        print(f"{'procesos':>10}{'tiempo (s)':>12}{'aceleración':>13}  modo")
+
+        tiempos = {}
+        for numero in procesos:
+            tiempos[numero], modo = medir_carga(carpeta, cache, numero, args.repeticiones)
+            print(f"{numero:>10}{tiempos[numero]:>12.2f}{tiempos[procesos[0]] / tiempos[numero]:>12.2f}x  {modo}")
+
+    if args.comprobar:
+        aceleracion = tiempos[procesos[0]] / tiempos[procesos[-1]]
+        if aceleracion < ACELERACION_MINIMA:
+            print(f"\nCon {procesos[-1]} procesos solo es {aceleracion:.2f}x más rápido (mínimo {ACELERACION_MINIMA}x)")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
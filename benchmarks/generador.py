@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from modulos.carga import preparar_datos
+
+# Centro aproximado (latitud, longitud) de las provincias usadas por defecto
+CENTROS_PROVINCIAS = {
+    "Madrid": (40.42, -3.70),
+    "Barcelona": (41.39, 2.17),
+    "Valencia": (39.47, -0.38),
+    "Sevilla": (37.39, -5.98),
+    "Zaragoza": (41.65, -0.89),
+    "Málaga": (36.72, -4.42),
+    "Murcia": (37.99, -1.13),
+    "Bizkaia": (43.26, -2.93),
+    "A Coruña": (43.36, -8.41),
+    "Valladolid": (41.65, -4.72)
+}
+
+# Reparto por defecto de repostajes entre provincias y combustibles
+PESOS_PROVINCIAS = {"Madrid": 0.3, "Barcelona": 0.2, "Valencia": 0.1, "Sevilla": 0.1, "Zaragoza": 0.05,
+                    "Málaga": 0.05, "Murcia": 0.05, "Bizkaia": 0.05, "A Coruña": 0.05, "Valladolid": 0.05}
+PESOS_COMBUSTIBLES = {"Diésel": 0.6, "Gasolina": 0.3, "Eléctrico": 0.05, "GLP": 0.05}
+
+# Modelos de vehículo con su consumo medio (l/100 km) y capacidad de depósito (l)
+MODELOS = {"Turismo": (6.0, 50.0), "Furgoneta": (9.0, 70.0), "Camión": (28.0, 300.0)}
+
+
+# Genera un conjunto de repostajes sintético y reproducible (misma semilla, mismos datos).
+# El resultado pasa por la misma normalización que los archivos reales.
+def generar_flota(num_vehiculos=500, num_repostajes=10_000, fecha_inicio="2022-01-01", dias=730,
+                  pesos_provincias=None, pesos_combustibles=None, semilla=0):
+    aleatorio = np.random.default_rng(semilla)
+    pesos_provincias = pesos_provincias or PESOS_PROVINCIAS
+    pesos_combustibles = pesos_combustibles or PESOS_COMBUSTIBLES
+
+    # Atributos fijos de cada vehículo
+    matriculas = np.array([f"{i:04d}{chr(66 + i // 10000 % 20)}{chr(66 + i // 500 % 20)}{chr(66 + i % 20)}" for i in range(num_vehiculos)])
+    nombres_modelos = list(MODELOS)
+    modelo_vehiculo = aleatorio.integers(0, len(nombres_modelos), num_vehiculos)
+    combustibles = list(pesos_combustibles)
+    probabilidades_combustible = np.array(list(pesos_combustibles.values()), dtype="float64")
+    combustible_vehiculo = aleatorio.choice(len(combustibles), num_vehiculos, p=probabilidades_combustible / probabilidades_combustible.sum())
+
+    # Repostajes
+    vehiculo = aleatorio.integers(0, num_vehiculos, num_repostajes)
+    provincias = list(pesos_provincias)
+    probabilidades_provincia = np.array(list(pesos_provincias.values()), dtype="float64")
+    provincia = aleatorio.choice(len(provincias), num_repostajes, p=probabilidades_provincia / probabilidades_provincia.sum())
+    segundos = aleatorio.integers(0, dias * 86400, num_repostajes)
+
+    consumo_base = np.array([MODELOS[m][0] for m in nombres_modelos])[modelo_vehiculo[vehiculo]]
+    deposito = np.array([MODELOS[m][1] for m in nombres_modelos])[modelo_vehiculo[vehiculo]]
+    consumo = consumo_base * aleatorio.lognormal(0.0, 0.12, num_repostajes)
+    repostado = deposito * aleatorio.uniform(0.3, 1.0, num_repostajes)
+    distancia = repostado / consumo * 100
+
+    centros = np.array([CENTROS_PROVINCIAS.get(p, (40.0, -3.7)) for p in provincias])
+    latitud = centros[provincia, 0] + aleatorio.normal(0, 0.15, num_repostajes)
+    longitud = centros[provincia, 1] + aleatorio.normal(0, 0.15, num_repostajes)
+
+    df = pd.DataFrame({
+        "Vehiculo": pd.Categorical.from_codes(vehiculo, matriculas),
+        "Fecha": pd.Timestamp(fecha_inicio) + pd.to_timedelta(segundos, unit="s"),
+        "Repostado": repostado.round(2),
+        "Distancia": distancia.round(1),
+        "Consumo": consumo.round(2),
+        "Coste": (repostado * aleatorio.uniform(1.4, 1.9, num_repostajes)).round(2),
+        "Tipo_Vehiculo": pd.Categorical.from_codes(modelo_vehiculo[vehiculo], nombres_modelos),
+        "Tipo_Combustible": pd.Categorical.from_codes(combustible_vehiculo[vehiculo], combustibles),
+        "Provincia": pd.Categorical.from_codes(provincia, provincias),
+        "Latitud": latitud,
+        "Longitud": longitud
+    })
+    return preparar_datos(df)
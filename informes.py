@@ -0,0 +1,241 @@
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from modulos.agregados import construir_cubo, totales_por_vehiculo
+from modulos.carga import cargar_excel, huella_contenido, leer_bytes
+from modulos.graficos import (
+    grafico_barras_temporal,
+    grafico_comparativo_modelo,
+    grafico_dia_semana,
+    grafico_lineal_consumo,
+    grafico_tarta_distribucion,
+    mapa_flota,
+    mapa_repostajes,
+    mostrar_top_vehiculos
+)
+from modulos.indices import construir_indice_vehiculos, construir_particiones, filas_valor
+from modulos.tendencias import calcular_tendencias, tendencias_vehiculo
+
+# Versión del formato de los informes; al cambiarla se regeneran todos
+VERSION_INFORMES = 1
+
+# Nombre del archivo que registra qué informes están al día
+NOMBRE_MANIFIESTO = "manifiesto.json"
+
+# Datos de cada proceso del pool, cargados una vez en el inicializador
+DATOS_PROCESO = {}
+
+
+# Convierte un valor (matrícula, provincia...) en un nombre de archivo seguro.
+# Se añade un resumen corto del valor original para que dos valores que se limpian igual
+# ("AB 123" y "AB_123", o "ab123" y "AB123" en sistemas que no distinguen mayúsculas) no compartan archivo.
+def nombre_archivo(valor):
+    texto = str(valor)
+    limpio = re.sub(r"[^\w.-]+", "_", texto).strip("_") or "sin_nombre"
+    return f"{limpio}-{hashlib.sha256(texto.encode('utf-8')).hexdigest()[:8]}"
+
+
+# Carga los datos y los índices una vez por proceso del pool
+def iniciar_proceso(ruta_datos):
+    df = pd.read_parquet(ruta_datos)
+    DATOS_PROCESO["df"] = df
+    DATOS_PROCESO["cubo"] = construir_cubo(df)
+    DATOS_PROCESO["vehiculos"] = construir_indice_vehiculos(df) if "vehiculo" in df.columns else None
+    DATOS_PROCESO["provincias"] = construir_particiones(df, "provincia") if "provincia" in df.columns else None
+    DATOS_PROCESO["tendencias"] = {}
+
+
+# Convierte figuras, tablas y mapas en un único HTML autónomo
+def componer_html(titulo, figuras, tablas, mapa):
+    partes = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+        f"<title>{html.escape(titulo)}</title>",
+        "<style>body{font-family:arial;background:#191e29;color:#fff;margin:2em}"
+        "table{border-collapse:collapse;margin:1em 0}td,th{border:1px solid #444;padding:4px 8px}"
+        "iframe{width:100%;height:600px;border:0}</style>",
+        "</head><body>",
+        f"<h1>{html.escape(titulo)}</h1>"
+    ]
+
+    incluir_plotly = "cdn"
+    for figura in figuras:
+        if figura is not None:
+            partes.append(figura.to_html(full_html=False, include_plotlyjs=incluir_plotly))
+            incluir_plotly = False
+
+    for nombre, tabla in tablas.items():
+        partes.append(f"<h2>{html.escape(nombre)}</h2>")
+        partes.append(tabla.to_html(index=False))
+
+    if mapa is not None:
+        partes.append("<h2>Mapa</h2>")
+        partes.append(f"<iframe srcdoc=\"{html.escape(mapa.get_root().render())}\"></iframe>")
+
+    partes.append("</body></html>")
+    return "\n".join(partes)
+
+
+# Figuras comunes de un resumen (flota completa o una provincia)
+def figuras_resumen(datos, cubo):
+    figuras = []
+    if "fecha" in datos.columns:
+        for metrica, titulo in [("repostado", "Repostado Mensual (l)"), ("distancia", "Recorrido Mensual (km)")]:
+            if metrica in datos.columns:
+                figuras.append(grafico_barras_temporal(datos, "fecha", metrica, "M", titulo, cubo=cubo))
+        figuras.append(grafico_dia_semana(datos, "fecha", cubo=cubo))
+    if "tipo_combustible" in datos.columns:
+        figuras.append(grafico_tarta_distribucion(datos, "tipo_combustible", "Tipos de Combustible"))
+    return figuras
+
+
+# Genera el informe de un vehículo, de una provincia o de la flota completa
+def generar_informe(tipo, valor, ruta_salida, top_n):
+    df = DATOS_PROCESO["df"]
+    inicio = time.perf_counter()
+
+    if tipo == "vehiculo":
+        indice = DATOS_PROCESO["vehiculos"]
+        datos = filas_valor(df, indice, valor)
+        cubo = DATOS_PROCESO["cubo"]
+        figuras = []
+        for metrica, titulo in [("repostado", "Repostado Mensual (l)"), ("distancia", "Recorrido Mensual (km)")]:
+            if metrica in datos.columns and "fecha" in datos.columns:
+                figuras.append(grafico_barras_temporal(datos, "fecha", metrica, "M", titulo, cubo=cubo, vehiculo=valor))
+
+        columna_consumo = "consumo" if "consumo" in df.columns else "repostado"
+        if columna_consumo in df.columns and "fecha" in df.columns:
+            if columna_consumo not in DATOS_PROCESO["tendencias"]:
+                DATOS_PROCESO["tendencias"][columna_consumo] = calcular_tendencias(df, "fecha", columna_consumo)
+            tendencias = tendencias_vehiculo(DATOS_PROCESO["tendencias"][columna_consumo], valor)
+            figuras.append(grafico_lineal_consumo(datos, "fecha", columna_consumo, tendencias=tendencias))
+            figuras.append(grafico_comparativo_modelo(df, valor, "fecha", columna_consumo, "tipo_vehiculo", cubo=cubo, indice_vehiculos=indice))
+
+        tablas = {}
+        mapa = None
+        if {"latitud", "longitud"}.issubset(df.columns):
+            mapa = mapa_repostajes(df, valor, indice_vehiculos=indice)
+        titulo = f"Vehículo {valor}"
+    else:
+        if tipo == "provincia":
+            datos = filas_valor(df, DATOS_PROCESO["provincias"], valor)
+            cubo = construir_cubo(datos)
+            titulo = f"Provincia {valor}"
+        else:
+            datos = df
+            cubo = DATOS_PROCESO["cubo"]
+            titulo = "Flota completa"
+
+        figuras = figuras_resumen(datos, cubo)
+        totales = totales_por_vehiculo(datos) if "vehiculo" in datos.columns else None
+        top = mostrar_top_vehiculos(datos, top_n=top_n, totales=totales) or {}
+        tablas = {f"Top {top_n} por {nombre}": tabla for nombre, tabla in top.items()}
+        mapa = mapa_flota(datos) if {"latitud", "longitud"}.issubset(datos.columns) else None
+
+    ruta_salida = Path(ruta_salida)
+    ruta_salida.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta_salida.with_suffix(".tmp")
+    temporal.write_text(componer_html(titulo, figuras, tablas, mapa), encoding="utf-8")
+    os.replace(temporal, ruta_salida)
+
+    return str(ruta_salida), time.perf_counter() - inicio
+
+
+def leer_manifiesto(directorio):
+    ruta = directorio / NOMBRE_MANIFIESTO
+    if ruta.exists():
+        try:
+            return json.loads(ruta.read_text(encoding="utf-8"))
+        except ValueError:
+            return {}
+    return {}
+
+
+def guardar_manifiesto(directorio, manifiesto):
+    ruta = directorio / NOMBRE_MANIFIESTO
+    temporal = ruta.with_suffix(".tmp")
+    temporal.write_text(json.dumps(manifiesto, indent=1, ensure_ascii=False), encoding="utf-8")
+    os.replace(temporal, ruta)
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Genera informes HTML por vehículo y por provincia a partir de un Excel de repostajes.")
+    parser.add_argument("archivo", help="Excel (.xlsx) con los repostajes")
+    parser.add_argument("--salida", default="informes", help="Carpeta de salida (por defecto: informes)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(), help="Número de procesos (por defecto: todos los núcleos)")
+    parser.add_argument("--top", type=int, default=10, help="Número de vehículos en las tablas de top")
+    parser.add_argument("--streaming", action="store_true", help="Lee el Excel por bloques (archivos muy grandes)")
+    parser.add_argument("--forzar", action="store_true", help="Regenera también los informes que ya están al día")
+    args = parser.parse_args(argumentos)
+
+    directorio = Path(args.salida)
+    directorio.mkdir(parents=True, exist_ok=True)
+
+    inicio = time.perf_counter()
+    huella = huella_contenido(leer_bytes(args.archivo))
+    df = cargar_excel(args.archivo, huella, streaming=args.streaming)
+    print(f"Datos cargados: {len(df):,} filas en {time.perf_counter() - inicio:.1f} s")
+
+    # Restos de versiones anteriores, que dejaban los datos de los procesos en la carpeta de salida
+    for resto in directorio.glob(".datos-*.parquet"):
+        resto.unlink(missing_ok=True)
+
+    # Un informe está al día si se generó con los mismos datos y parámetros
+    firma = hashlib.sha256(f"{huella}|{args.top}|{VERSION_INFORMES}".encode("utf-8")).hexdigest()
+    manifiesto = leer_manifiesto(directorio)
+
+    tareas = [("flota", None, directorio / "flota.html")]
+    if "vehiculo" in df.columns:
+        tareas += [("vehiculo", v, directorio / "vehiculos" / f"{nombre_archivo(v)}.html") for v in df["vehiculo"].dropna().unique()]
+    if "provincia" in df.columns:
+        tareas += [("provincia", p, directorio / "provincias" / f"{nombre_archivo(p)}.html") for p in df["provincia"].dropna().unique()]
+
+    pendientes = [
+        tarea for tarea in tareas
+        if args.forzar or manifiesto.get(str(tarea[2].relative_to(directorio))) != firma or not tarea[2].exists()
+    ]
+    print(f"{len(tareas) - len(pendientes)} informes al día, {len(pendientes)} por generar")
+
+    if pendientes:
+        # Los procesos leen el dataframe ya normalizado desde un Parquet temporal, que se borra al terminar
+        # (para reanudar basta el manifiesto y la caché de datos de modulos.carga)
+        with tempfile.TemporaryDirectory(prefix="informes-") as temporal:
+            ruta_datos = Path(temporal) / "datos.parquet"
+            df.to_parquet(ruta_datos, index=False)
+
+            ultimo_guardado = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=args.procesos, initializer=iniciar_proceso, initargs=(str(ruta_datos),)) as pool:
+                futuros = {pool.submit(generar_informe, tipo, valor, str(ruta), args.top): ruta for tipo, valor, ruta in pendientes}
+                try:
+                    for hechos, futuro in enumerate(as_completed(futuros), start=1):
+                        ruta = futuros[futuro]
+                        try:
+                            _, segundos = futuro.result()
+                        except Exception as error:
+                            print(f"[{hechos}/{len(pendientes)}] ERROR {ruta}: {error}", file=sys.stderr)
+                            continue
+                        manifiesto[str(ruta.relative_to(directorio))] = firma
+                        print(f"[{hechos}/{len(pendientes)}] {ruta} ({segundos:.1f} s)")
+
+                        # El manifiesto se guarda cada pocos segundos para poder reanudar si se interrumpe
+                        if time.perf_counter() - ultimo_guardado > 2:
+                            guardar_manifiesto(directorio, manifiesto)
+                            ultimo_guardado = time.perf_counter()
+                finally:
+                    guardar_manifiesto(directorio, manifiesto)
+
+    print(f"Terminado en {time.perf_counter() - inicio:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
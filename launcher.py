@@ -1,9 +1,22 @@
+import json
+import multiprocessing
 import sys
 import os
 import threading
 import time
+import urllib.request
 import webbrowser
-from streamlit.web import cli as stcli
+
+# Instant the launcher starts, used by the app to report time to first paint
+START_TIME = time.time()
+
+PORT = 8501
+URL = f"http://localhost:{PORT}"
+HEALTH_URL = f"{URL}/_stcore/health"
+
+# How long to keep polling the health endpoint before giving up (seconds)
+HEALTH_TIMEOUT = 120
+HEALTH_INTERVAL = 0.1
 
 def resource_path(rel_path):
     """Get absolute path to resource, works for dev and for PyInstaller"""
@@ -14,15 +27,49 @@ def resource_path(rel_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, rel_path)
 
+def update_startup_report(**values):
+    """Share startup timings with the app through the environment (same process)"""
+    report = json.loads(os.environ.get("REPOSTAJES_ARRANQUE", "{}"))
+    report.update(values)
+    os.environ["REPOSTAJES_ARRANQUE"] = json.dumps(report)
+
+def wait_for_server(timeout=HEALTH_TIMEOUT):
+    """Poll the server's health endpoint until it answers 'ok'"""
+    limit = time.monotonic() + timeout
+    while time.monotonic() < limit:
+        try:
+            with urllib.request.urlopen(HEALTH_URL, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(HEALTH_INTERVAL)
+    return False
+
 def open_browser():
-    """Wait for the server to start and then open the browser"""
-    time.sleep(3)
-    webbrowser.open("http://localhost:8501")
+    """Wait until the server is ready and then open the browser"""
+    if wait_for_server():
+        elapsed = time.time() - START_TIME
+        update_startup_report(servidor_listo=elapsed)
+        print(f"Servidor listo en {elapsed:.2f} s")
+    else:
+        print(f"El servidor no respondió en {HEALTH_TIMEOUT} s; se abre el navegador igualmente")
+    webbrowser.open(URL)
 
 if __name__ == "__main__":
+    # Needed by the process pools (folder loading) in the PyInstaller build
+    multiprocessing.freeze_support()
+
+    update_startup_report(inicio=START_TIME)
+
+    # Importing Streamlit is the bulk of the launcher's own start-up time
+    start = time.perf_counter()
+    from streamlit.web import cli as stcli
+    update_startup_report(importaciones={"streamlit": time.perf_counter() - start})
+
     # Point to the internal app.py
     app_path = resource_path("app.py")
-    
+
     # Configure Streamlit arguments
     # We simulate 'streamlit run app.py ...'
     sys.argv = [
@@ -31,14 +78,14 @@ if __name__ == "__main__":
         app_path,
         "--global.developmentMode=false",
         "--server.headless=true",
-        "--server.port=8501",
+        f"--server.port={PORT}",
     ]
-    
+
     print("Iniciando servidor Streamlit...")
-    
+
     # Start the browser opener in a separate thread
     threading.Thread(target=open_browser, daemon=True).start()
-    
+
     # Run Streamlit (this blocks until the server method returns, which is usually never)
     try:
         sys.exit(stcli.main())
@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+
+from modulos.perfilado import perfilar
+
+# Métricas que se acumulan en el cubo temporal
+METRICAS_CUBO = ["repostado", "distancia", "consumo"]
+
+# Frecuencias de pandas para cada periodo de los gráficos
+FRECUENCIAS = {"W": "W-MON", "M": "MS", "Y": "YS"}
+
+# Columnas de los filtros laterales que se añaden como dimensiones al cubo filtrable
+# (el modelo, tipo_vehiculo, ya es una dimensión del cubo)
+DIMENSIONES_FILTRO = ["tipo_combustible", "provincia"]
+
+# Dimensión del cubo filtrable con las métricas vacías de cada fila (un bit por métrica de METRICAS_CUBO)
+NIVEL_VACIAS = "metricas_vacias"
+
+
+# Construye el cubo temporal de un dataframe ya tipado.
+# Guarda sumas y conteos de cada métrica por vehículo (y modelo) y día, sus acumulados
+# semanal, mensual y anual, y los totales de toda la flota para cada periodo.
+# Con filtrable=True el cubo diario se guarda además desglosado por las columnas de los filtros
+# laterales y por las métricas vacías de cada fila: así cualquier combinación de filtros se obtiene
+# reduciéndolo (reducir_cubo) sin volver a agrupar las filas.
+@perfilar()
+def construir_cubo(df, filtrable=False):
+    if df is None or "fecha" not in df.columns or "vehiculo" not in df.columns:
+        return None
+
+    metricas = [metrica for metrica in METRICAS_CUBO if metrica in df.columns]
+    columna_modelo = "tipo_vehiculo" if "tipo_vehiculo" in df.columns else None
+
+    # Solo cuentan las filas con fecha, igual que en los gráficos sobre los datos en bruto
+    validas = df["fecha"].notna().to_numpy()
+    claves = [df.loc[validas, "vehiculo"]]
+    if columna_modelo:
+        claves.append(df.loc[validas, columna_modelo])
+    claves.append(df.loc[validas, "fecha"].dt.floor("D"))
+
+    dimensiones = []
+    if filtrable:
+        dimensiones = [columna for columna in DIMENSIONES_FILTRO if columna in df.columns]
+        claves[-1:-1] = [df.loc[validas, columna] for columna in dimensiones]
+        vacias = np.zeros(int(validas.sum()), dtype=np.int8)
+        for bit, metrica in enumerate(metricas):
+            vacias |= df.loc[validas, metrica].isna().to_numpy().astype(np.int8) << bit
+        claves.insert(-1, pd.Series(vacias, index=claves[0].index, name=NIVEL_VACIAS))
+
+    grupos = df.loc[validas, metricas].groupby(claves, observed=True, dropna=False)
+    diario = pd.concat([grupos.sum().add_suffix("_suma"), grupos.count().add_suffix("_n")], axis=1)
+    diario["repostajes"] = grupos.size()
+
+    # Modelo de cada vehículo según su primera fila
+    modelos = {}
+    if columna_modelo:
+        primeras = df[["vehiculo", columna_modelo]].drop_duplicates("vehiculo")
+        modelos = dict(zip(primeras["vehiculo"], primeras[columna_modelo]))
+
+    if not filtrable:
+        return cubo_desde_diario(diario, metricas, columna_modelo, modelos)
+
+    # El cubo filtrable solo guarda el desglose diario y los extremos de cada métrica;
+    # los acumulados se calculan al reducirlo
+    return {
+        "metricas": metricas,
+        "columna_modelo": columna_modelo,
+        "dimensiones": dimensiones,
+        "diario": diario,
+        "modelos": modelos,
+        "extremos": {metrica: (df[metrica].min(), df[metrica].max()) for metrica in metricas}
+    }
+
+
+# Reduce un cubo filtrable a los repostajes que cumplen los filtros laterales y devuelve un cubo
+# igual al que daría construir_cubo con las filas filtradas (ver filtros.calcular_mascara).
+# Los filtros de rango solo se pueden resolver con el cubo si abarcan todos los valores de la
+# métrica (entonces solo quitan las filas sin valor); si recortan valores devuelve None y hay
+# que construir el cubo con las filas.
+@perfilar()
+def reducir_cubo(cubo, tipos_vehiculo=None, tipos_combustible=None, provincia=None, rangos=None, fechas=None):
+    diario = cubo["diario"]
+    mascara = np.ones(len(diario), dtype=bool)
+
+    criterios = {cubo["columna_modelo"]: tipos_vehiculo, "tipo_combustible": tipos_combustible, "provincia": provincia}
+    for columna, valores in criterios.items():
+        if not valores or columna not in diario.index.names:
+            continue
+        mascara &= diario.index.get_level_values(columna).isin(valores)
+
+    vacias_excluidas = 0
+    for columna, (min_valor, max_valor) in (rangos or {}).items():
+        columna = columna.lower()
+        if columna not in cubo["extremos"]:
+            return None
+        minimo, maximo = cubo["extremos"][columna]
+        if not (min_valor <= minimo and max_valor >= maximo):
+            return None
+        vacias_excluidas |= 1 << cubo["metricas"].index(columna)
+    if vacias_excluidas:
+        mascara &= (diario.index.get_level_values(NIVEL_VACIAS).to_numpy() & vacias_excluidas) == 0
+
+    if fechas:
+        dias = diario.index.get_level_values("fecha").to_numpy().astype("datetime64[D]")
+        if len(fechas) == 2:
+            mascara &= (dias >= np.datetime64(fechas[0], "D")) & (dias <= np.datetime64(fechas[1], "D"))
+        elif len(fechas) == 1:
+            mascara &= dias == np.datetime64(fechas[0], "D")
+
+    # Se suman los desgloses de los filtros para volver a las dimensiones del cubo normal
+    niveles = ["vehiculo"] + ([cubo["columna_modelo"]] if cubo["columna_modelo"] else []) + ["fecha"]
+    reducido = diario[mascara].groupby(level=niveles, observed=True, dropna=False).sum()
+
+    # Modelo de cada vehículo: el de su primera fila si sigue en los datos filtrados, si no el primero que quede
+    modelos = {}
+    if cubo["columna_modelo"]:
+        pares = reducido.index.droplevel("fecha").unique()
+        restantes = set(pares)
+        for vehiculo, modelo in pares:
+            original = cubo["modelos"].get(vehiculo)
+            if (vehiculo, original) in restantes:
+                modelos[vehiculo] = original
+            else:
+                modelos.setdefault(vehiculo, modelo)
+
+    return cubo_desde_diario(reducido, cubo["metricas"], cubo["columna_modelo"], modelos)
+
+
+# Completa el cubo a partir de los totales diarios por vehículo (y modelo).
+# Lo usan construir_cubo y los motores que agregan fuera de pandas (modulos.motor_sql).
+def cubo_desde_diario(diario, metricas, columna_modelo, modelos):
+    # Acumulados por vehículo para cada periodo (solo los periodos con datos)
+    niveles = list(diario.index.names)
+    diario_plano = diario.reset_index()
+    periodos = {"D": diario}
+    for periodo, frecuencia in FRECUENCIAS.items():
+        periodos[periodo] = diario_plano.groupby(
+            niveles[:-1] + [pd.Grouper(key="fecha", freq=frecuencia)],
+            observed=True,
+            dropna=False
+        ).sum()
+
+    # Totales de la flota, con los periodos vacíos a cero como hace pd.Grouper
+    flota_diaria = diario.groupby(level="fecha").sum()
+    flota = {"D": flota_diaria}
+    for periodo, frecuencia in FRECUENCIAS.items():
+        flota[periodo] = flota_diaria.resample(frecuencia).sum()
+
+    return {
+        "metricas": metricas,
+        "columna_modelo": columna_modelo,
+        "periodos": periodos,
+        "flota": flota,
+        "modelos": modelos
+    }
+
+
+# Serie de la suma de una métrica por periodo, para toda la flota o para un vehículo
+def serie_temporal(cubo, metrica, periodo="M", vehiculo=None):
+    columna = f"{metrica}_suma"
+
+    if vehiculo is None:
+        return cubo["flota"][periodo][columna]
+
+    acumulado = cubo["periodos"][periodo]
+    if vehiculo not in acumulado.index.get_level_values("vehiculo"):
+        return pd.Series(dtype="float64", name=columna, index=pd.DatetimeIndex([], name="fecha"))
+
+    serie = acumulado.xs(vehiculo, level="vehiculo")[columna].groupby(level="fecha").sum()
+    return serie.resample(FRECUENCIAS[periodo]).sum()
+
+
+# Totales por día de la semana (0=lunes); sin métrica se cuenta el número de repostajes
+def totales_dia_semana(cubo, metrica=None):
+    diario = cubo["flota"]["D"]
+    columna = f"{metrica}_suma" if metrica else "repostajes"
+    return diario[columna].groupby(diario.index.dayofweek.rename("dia_index")).sum()
+
+
+# Media mensual de una métrica entre los vehículos de un modelo
+def media_mensual_modelo(cubo, modelo, metrica):
+    columna_modelo = cubo["columna_modelo"]
+    mensual = cubo["periodos"]["M"]
+
+    if columna_modelo is None or pd.isna(modelo) or modelo not in mensual.index.get_level_values(columna_modelo):
+        return pd.Series(dtype="float64", name=f"{metrica}_suma", index=pd.DatetimeIndex([], name="fecha"))
+
+    del_modelo = mensual.xs(modelo, level=columna_modelo)[f"{metrica}_suma"]
+    return del_modelo.groupby(level="fecha").mean()
+
+
+# Totales por vehículo de todas las métricas en una sola agrupación
+@perfilar()
+def totales_por_vehiculo(df):
+    metricas = [metrica for metrica in METRICAS_CUBO if metrica in df.columns]
+    return df.groupby("vehiculo", observed=True)[metricas].sum()
+
+
+# Posiciones de los n mayores valores, con el mismo orden y desempate que Series.nlargest.
+# Se usa una ordenación parcial (argpartition) y solo se ordenan los candidatos.
+# Los NaN quedan fuera de la ordenación y, como en nlargest, solo completan el resultado al final.
+def posiciones_top(valores, n):
+    valores = np.asarray(valores, dtype="float64")
+    n = min(n, len(valores))
+    if n <= 0:
+        return np.array([], dtype=np.intp)
+
+    nulos = np.isnan(valores)
+    validas = np.flatnonzero(~nulos)
+    total = len(validas)
+
+    if n < total:
+        umbral = valores[validas[np.argpartition(valores[validas], total - n)[total - n]]]
+        candidatos = validas[valores[validas] >= umbral]
+    else:
+        candidatos = validas
+
+    # Orden estable: ante empates gana el que aparece antes, como en nlargest(keep="first")
+    orden = np.argsort(-valores[candidatos], kind="stable")
+    resultado = candidatos[orden][:n]
+    if len(resultado) < n:
+        resultado = np.concatenate([resultado, np.flatnonzero(nulos)[:n - len(resultado)]])
+    return resultado
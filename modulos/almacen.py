@@ -0,0 +1,88 @@
+import os
+import threading
+from collections import OrderedDict
+
+from modulos.cache_figuras import estimar_tamano
+
+# Memoria máxima para los conjuntos de datos en memoria, en MB (se puede cambiar con REPOSTAJES_MEMORIA_DATOS_MB)
+PRESUPUESTO_DATOS_BYTES = int(os.environ.get("REPOSTAJES_MEMORIA_DATOS_MB", "2048")) * 1024 * 1024
+
+
+# Registro de conjuntos de datos compartido por todas las sesiones del proceso.
+# Cada conjunto se identifica por la huella de su contenido, se carga una sola vez y se trata
+# como inmutable: nadie debe modificar los dataframes que devuelve.
+# Se expulsan los menos usados cuando se supera el presupuesto de memoria. Lo que se haya calculado
+# a partir de un conjunto (índices, cubos, figuras) lo mantiene en memoria, así que quien lo guarde en
+# otras cachés debe registrar en 'al_expulsar' una función que lo libere; recibe la huella expulsada.
+class RegistroDatos:
+
+    def __init__(self, presupuesto_bytes=PRESUPUESTO_DATOS_BYTES):
+        self.presupuesto_bytes = presupuesto_bytes
+        self.entradas = OrderedDict()
+        self.bytes_residentes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.bloqueo = threading.Lock()
+        self.cargando = {}
+        self.al_expulsar = []
+
+    # Devuelve el conjunto de datos de una huella; si no está se carga con 'cargador'.
+    # Si otra sesión ya lo está cargando se espera a que termine en vez de cargarlo otra vez.
+    def obtener(self, huella, cargador):
+        with self.bloqueo:
+            if huella in self.entradas:
+                self.entradas.move_to_end(huella)
+                self.aciertos += 1
+                return self.entradas[huella][0]
+            bloqueo_carga = self.cargando.setdefault(huella, threading.Lock())
+
+        with bloqueo_carga:
+            with self.bloqueo:
+                if huella in self.entradas:
+                    self.entradas.move_to_end(huella)
+                    self.aciertos += 1
+                    return self.entradas[huella][0]
+                self.fallos += 1
+
+            try:
+                df = cargador()
+                self.guardar(huella, df)
+            finally:
+                with self.bloqueo:
+                    self.cargando.pop(huella, None)
+
+            return df
+
+    # Guarda un conjunto de datos y expulsa los menos usados hasta volver al presupuesto.
+    # El último guardado se conserva siempre, aunque por sí solo supere el presupuesto.
+    def guardar(self, huella, df):
+        tamano = estimar_tamano(df)
+        expulsadas = []
+        with self.bloqueo:
+            if huella in self.entradas:
+                self.bytes_residentes -= self.entradas.pop(huella)[1]
+            self.entradas[huella] = (df, tamano)
+            self.bytes_residentes += tamano
+
+            while self.bytes_residentes > self.presupuesto_bytes and len(self.entradas) > 1:
+                huella_expulsada, (_, tamano_expulsado) = self.entradas.popitem(last=False)
+                self.bytes_residentes -= tamano_expulsado
+                self.expulsiones += 1
+                expulsadas.append(huella_expulsada)
+
+        # Fuera del bloqueo: las funciones pueden tardar y no deben frenar a las demás sesiones
+        for huella_expulsada in expulsadas:
+            for funcion in self.al_expulsar:
+                funcion(huella_expulsada)
+
+    def estadisticas(self):
+        with self.bloqueo:
+            return {
+                "conjuntos": len(self.entradas),
+                "bytes_residentes": self.bytes_residentes,
+                "presupuesto_bytes": self.presupuesto_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "expulsiones": self.expulsiones
+            }
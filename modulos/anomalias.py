@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+
+from modulos.perfilado import perfilar
+
+# Número de repostajes de la ventana móvil de cada vehículo (centrada en el repostaje)
+VENTANA_ANOMALIAS = 15
+
+# Mínimo de repostajes en la ventana (o en el modelo) para puntuar un repostaje
+MIN_PUNTOS_ANOMALIA = 5
+
+# Puntuación robusta a partir de la cual un repostaje se marca como anómalo (criterio de Iglewicz y Hoaglin)
+UMBRAL_ANOMALIA = 3.5
+
+# Filas de la tabla de anomalías que se envían al navegador (las de mayor puntuación)
+MAX_FILAS_ANOMALIAS = 1000
+
+# Filas que se ordenan a la vez en el cálculo de la ventana móvil (acota la memoria en flotas grandes)
+BLOQUE_ANOMALIAS = 200_000
+
+# Constantes que convierten la MAD y la desviación media absoluta en desviaciones típicas de una normal
+ESCALA_MAD = 1.4826
+ESCALA_DESVIACION_MEDIA = 1.2533
+
+# Puntuaciones calculadas y su descripción en la tabla
+MOTIVOS = {
+    "z_consumo": "Consumo atípico para el vehículo",
+    "z_litros": "Litros atípicos para la distancia",
+    "z_modelo": "Litros/100 km atípicos para el modelo"
+}
+
+
+# Mediana de cada fila de una matriz ya ordenada, con 'validos' valores al principio de cada fila
+def mediana_ordenada(ordenados, validos):
+    filas = np.arange(len(ordenados))
+    bajo = np.maximum(validos - 1, 0) // 2
+    alto = validos // 2
+    with np.errstate(invalid="ignore"):
+        return np.where(validos > 0, (ordenados[filas, bajo] + ordenados[filas, alto]) / 2, np.nan)
+
+
+# Puntuación z robusta: (x - mediana) / (1.4826 · MAD). Si la MAD es cero (más de la mitad de los
+# valores iguales) se usa la desviación media absoluta; si también es cero la puntuación es 0.
+def puntuacion_robusta(valores, mediana, mad, desviacion_media):
+    escala = ESCALA_MAD * mad
+    escala = np.where(escala > 0, escala, ESCALA_DESVIACION_MEDIA * desviacion_media)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(escala > 0, (valores - mediana) / escala, np.where(np.isnan(mediana), np.nan, 0.0))
+
+
+# Puntuación z robusta móvil de cada valor frente a su vecindario dentro del mismo vehículo.
+# Los valores llegan ordenados por vehículo y fecha; cada ventana es una fila de una matriz
+# (n x ventana) en la que las posiciones de otro vehículo o sin valor quedan como NaN, de modo
+# que mediana y MAD de todas las ventanas salen de dos ordenaciones por filas, sin recorrer vehículos.
+def z_movil(valores, grupo, ventana=VENTANA_ANOMALIAS, min_puntos=MIN_PUNTOS_ANOMALIA):
+    n = len(valores)
+    mitad = ventana // 2
+    ancho = 2 * mitad + 1
+    resultado = np.full(n, np.nan)
+    if n == 0:
+        return resultado
+
+    valores_relleno = np.concatenate([np.full(mitad, np.nan), valores, np.full(mitad, np.nan)])
+    grupo_relleno = np.concatenate([np.full(mitad, -1), grupo, np.full(mitad, -1)])
+    ventanas_valores = np.lib.stride_tricks.sliding_window_view(valores_relleno, ancho)
+    ventanas_grupo = np.lib.stride_tricks.sliding_window_view(grupo_relleno, ancho)
+
+    for inicio in range(0, n, BLOQUE_ANOMALIAS):
+        fin = min(inicio + BLOQUE_ANOMALIAS, n)
+        bloque = np.where(ventanas_grupo[inicio:fin] == grupo[inicio:fin, None], ventanas_valores[inicio:fin], np.nan)
+        validos = np.count_nonzero(~np.isnan(bloque), axis=1)
+
+        # np.sort deja los NaN al final de cada fila
+        mediana = mediana_ordenada(np.sort(bloque, axis=1), validos)
+        desviaciones = np.abs(bloque - mediana[:, None])
+        mad = mediana_ordenada(np.sort(desviaciones, axis=1), validos)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            desviacion_media = np.nansum(desviaciones, axis=1) / validos
+
+        z = puntuacion_robusta(valores[inicio:fin], mediana, mad, desviacion_media)
+        resultado[inicio:fin] = np.where(validos >= min_puntos, z, np.nan)
+
+    return resultado
+
+
+# Puntuación z robusta de cada valor frente a todos los repostajes de su modelo
+def z_modelo(valores, modelos, min_puntos=MIN_PUNTOS_ANOMALIA):
+    serie = pd.Series(valores)
+    por_modelo = serie.groupby(modelos, observed=True, dropna=False)
+    mediana = por_modelo.transform("median").to_numpy()
+    desviaciones = (serie - mediana).abs()
+    por_modelo_desviacion = desviaciones.groupby(modelos, observed=True, dropna=False)
+    mad = por_modelo_desviacion.transform("median").to_numpy()
+    desviacion_media = por_modelo_desviacion.transform("mean").to_numpy()
+    puntos = por_modelo.transform("count").to_numpy()
+
+    z = puntuacion_robusta(valores, mediana, mad, desviacion_media)
+    return np.where(puntos >= min_puntos, z, np.nan)
+
+
+# Puntúa todos los repostajes de la flota en una sola pasada vectorizada.
+# Para cada repostaje calcula la puntuación z robusta (mediana y MAD) de:
+#   - z_consumo: su consumo frente a los repostajes vecinos del mismo vehículo,
+#   - z_litros: los litros repostados por cada 100 km recorridos, también frente al vehículo,
+#   - z_modelo: esos litros/100 km frente a todos los vehículos de su modelo (tipo_vehiculo).
+# La puntuación final es la mayor en valor absoluto y el motivo, la métrica que la produce.
+# Devuelve una fila por repostaje puntuable, ordenada por vehículo y fecha, con la posición
+# de la fila en df en la columna 'fila'. El umbral se aplica después (ranking_anomalias), así
+# cambiarlo no obliga a volver a puntuar.
+@perfilar()
+def detectar_anomalias(df, ventana=VENTANA_ANOMALIAS):
+    if df is None or df.empty or "vehiculo" not in df.columns or "fecha" not in df.columns:
+        return None
+
+    # Orden por vehículo y fecha con los códigos de la categoría, sin ordenar textos
+    vehiculos = df["vehiculo"]
+    if not isinstance(vehiculos.dtype, pd.CategoricalDtype):
+        vehiculos = vehiculos.astype("category")
+    codigos = vehiculos.cat.codes.to_numpy()
+    fechas = df["fecha"].to_numpy().astype("datetime64[s]").astype(np.int64)
+    orden = np.lexsort((fechas, codigos))
+    orden = orden[(codigos[orden] >= 0) & ~np.isnat(df["fecha"].to_numpy()[orden])]
+    grupo = codigos[orden]
+
+    columnas = [columna for columna in ["vehiculo", "fecha", "tipo_vehiculo", "tipo_combustible", "provincia", "repostado", "distancia", "consumo"] if columna in df.columns]
+    resultado = df[columnas].iloc[orden].reset_index(drop=True)
+    resultado.insert(0, "fila", orden)
+
+    puntuaciones = []
+    if "consumo" in df.columns:
+        resultado["z_consumo"] = z_movil(resultado["consumo"].to_numpy(dtype="float64"), grupo, ventana)
+        puntuaciones.append("z_consumo")
+
+    if "repostado" in df.columns and "distancia" in df.columns:
+        distancia = resultado["distancia"].to_numpy(dtype="float64")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            litros_100km = np.where(distancia > 0, resultado["repostado"].to_numpy(dtype="float64") / distancia * 100, np.nan)
+        resultado["litros_100km"] = litros_100km
+        resultado["z_litros"] = z_movil(litros_100km, grupo, ventana)
+        puntuaciones.append("z_litros")
+
+        if "tipo_vehiculo" in df.columns:
+            resultado["z_modelo"] = z_modelo(litros_100km, resultado["tipo_vehiculo"])
+            puntuaciones.append("z_modelo")
+
+    if not puntuaciones:
+        return None
+
+    # Puntuación final: la mayor desviación (en valor absoluto) de las calculadas
+    matriz = np.abs(resultado[puntuaciones].to_numpy(dtype="float64"))
+    puntuables = ~np.isnan(matriz).all(axis=1)
+    resultado = resultado[puntuables].reset_index(drop=True)
+    matriz = np.nan_to_num(matriz[puntuables], nan=-1.0)
+    mayor = np.argmax(matriz, axis=1)
+
+    resultado["puntuacion"] = matriz[np.arange(len(matriz)), mayor]
+    resultado["motivo"] = pd.Categorical.from_codes(mayor, categories=[MOTIVOS[p] for p in puntuaciones])
+    return resultado
+
+
+# Repostajes anómalos ordenados de mayor a menor puntuación, con filtros opcionales
+def ranking_anomalias(anomalias, umbral=UMBRAL_ANOMALIA, vehiculos=None, motivos=None, modelos=None):
+    if anomalias is None:
+        return None
+
+    mascara = anomalias["puntuacion"].to_numpy() >= umbral
+    if vehiculos:
+        mascara &= anomalias["vehiculo"].isin(vehiculos).to_numpy()
+    if motivos:
+        mascara &= anomalias["motivo"].isin(motivos).to_numpy()
+    if modelos and "tipo_vehiculo" in anomalias.columns:
+        mascara &= anomalias["tipo_vehiculo"].isin(modelos).to_numpy()
+
+    return anomalias[mascara].sort_values("puntuacion", ascending=False, kind="stable")
+
+
+# Repostajes anómalos de un vehículo, en orden de fecha, para resaltarlos en sus gráficos
+def anomalias_vehiculo(anomalias, vehiculo, umbral=UMBRAL_ANOMALIA):
+    if anomalias is None:
+        return None
+    return anomalias[(anomalias["vehiculo"] == vehiculo).to_numpy() & (anomalias["puntuacion"].to_numpy() >= umbral)]
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Memoria máxima que pueden ocupar las figuras guardadas, en MB (se puede cambiar con REPOSTAJES_CACHE_FIGURAS_MB)
+PRESUPUESTO_FIGURAS_BYTES = int(os.environ.get("REPOSTAJES_CACHE_FIGURAS_MB", "256")) * 1024 * 1024
+
+# Atributos de las trazas de Plotly que contienen los datos
+ATRIBUTOS_DATOS = ("x", "y", "z", "values", "labels", "text", "customdata", "lat", "lon")
+
+
+# Huella barata de un dataframe: forma, columnas, filas seleccionadas y suma de cada columna numérica.
+# Sirve para identificar un corte de datos cuando no se dispone de una clave propia.
+def huella_datos(df):
+    huella = hashlib.blake2b(digest_size=16)
+    huella.update(repr((df.shape, list(df.columns))).encode("utf-8"))
+    huella.update(pd.util.hash_pandas_object(df.index, index=False).to_numpy().tobytes())
+    for columna in df.columns:
+        serie = df[columna]
+        if pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_datetime64_any_dtype(serie):
+            huella.update(np.float64(np.nansum(serie.to_numpy().astype("float64"))).tobytes())
+    return huella.hexdigest()
+
+
+# Estima la memoria que ocupa un objeto guardado (figura de Plotly, dataframe, array o diccionario de ellos)
+def estimar_tamano(objeto):
+    if objeto is None:
+        return 0
+    if isinstance(objeto, np.ndarray):
+        return int(objeto.nbytes)
+    if isinstance(objeto, pd.DataFrame):
+        return int(objeto.memory_usage(deep=True).sum())
+    if isinstance(objeto, dict):
+        return sum(estimar_tamano(valor) for valor in objeto.values())
+    if hasattr(objeto, "data") and hasattr(objeto, "layout"):
+        tamano = 4096
+        for traza in objeto.data:
+            for atributo in ATRIBUTOS_DATOS:
+                valor = traza[atributo] if atributo in traza else None
+                if valor is not None and not isinstance(valor, str):
+                    array = np.asarray(valor)
+                    tamano += array.nbytes if array.dtype != object else array.size * 64
+        return tamano
+    return sys.getsizeof(objeto)
+
+
+# Caché LRU de figuras con un presupuesto de memoria.
+# Se comparte entre sesiones y ejecuciones: la clave debe identificar los datos y los parámetros del gráfico.
+class CacheFiguras:
+
+    def __init__(self, presupuesto_bytes=PRESUPUESTO_FIGURAS_BYTES):
+        self.presupuesto_bytes = presupuesto_bytes
+        self.entradas = OrderedDict()
+        self.bytes_usados = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.bloqueo = threading.Lock()
+
+    # Devuelve el objeto guardado para la clave o lo construye con 'constructor' y lo guarda
+    def obtener(self, clave, constructor):
+        with self.bloqueo:
+            if clave in self.entradas:
+                self.entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self.entradas[clave][0]
+            self.fallos += 1
+
+        objeto = constructor()
+        tamano = estimar_tamano(objeto)
+
+        with self.bloqueo:
+            if clave in self.entradas:
+                self.bytes_usados -= self.entradas.pop(clave)[1]
+            # Un objeto que no cabe en el presupuesto no se guarda
+            if tamano <= self.presupuesto_bytes:
+                self.entradas[clave] = (objeto, tamano)
+                self.bytes_usados += tamano
+                while self.bytes_usados > self.presupuesto_bytes:
+                    _, (_, tamano_expulsado) = self.entradas.popitem(last=False)
+                    self.bytes_usados -= tamano_expulsado
+
+        return objeto
+
+    # Descarta las entradas cuya clave cumple la condición (por ejemplo, las de un conjunto de datos expulsado)
+    def descartar(self, condicion):
+        with self.bloqueo:
+            for clave in [clave for clave in self.entradas if condicion(clave)]:
+                self.bytes_usados -= self.entradas.pop(clave)[1]
+
+    def estadisticas(self):
+        with self.bloqueo:
+            return {
+                "entradas": len(self.entradas),
+                "bytes": self.bytes_usados,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos
+            }
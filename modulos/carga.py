@@ -0,0 +1,392 @@
+import csv
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from modulos.perfilado import perfilar
+from modulos.provincias import extraer_provincia, normalizar_serie_provincias
+
+# Carpeta donde se guardan los datos ya procesados (se puede cambiar con REPOSTAJES_CACHE)
+DIRECTORIO_CACHE = Path(os.environ.get("REPOSTAJES_CACHE", Path.home() / ".cache" / "repostajes"))
+
+# Tamaño máximo de la caché en disco en MB (se puede cambiar con REPOSTAJES_CACHE_MB)
+LIMITE_CACHE_BYTES = int(os.environ.get("REPOSTAJES_CACHE_MB", "1024")) * 1024 * 1024
+
+# Tamaño a partir del cual se recomienda la lectura por bloques (20 MB)
+UMBRAL_STREAMING_BYTES = 20 * 1024 * 1024
+
+# Número de filas que se procesan en cada bloque de la lectura por bloques
+FILAS_POR_BLOQUE = 50_000
+
+# Versión del preparado de datos; al cambiarla se invalidan las entradas antiguas de la caché
+VERSION_CACHE = 3
+
+
+# Calcula la huella (hash) del contenido de un archivo
+def huella_contenido(contenido):
+    return hashlib.sha256(contenido).hexdigest()
+
+
+# Devuelve los bytes de un archivo subido o de una ruta local
+def leer_bytes(archivo):
+    if hasattr(archivo, "getvalue"):
+        return archivo.getvalue()
+    return Path(archivo).read_bytes()
+
+
+# Renombra las cabeceras repetidas como pd.read_excel: la segunda "a" pasa a "a.1", la tercera a "a.2"...
+# saltando los nombres que ya existen en la cabecera. Así la lectura por bloques da las mismas
+# columnas que la normal y ambas pueden compartir la entrada de la caché.
+def nombres_unicos(nombres):
+    originales = set(nombres)
+    vistos = {}
+    unicos = []
+    for nombre in nombres:
+        repeticiones = vistos.get(nombre, 0)
+        base = nombre
+        while repeticiones > 0:
+            vistos[base] = repeticiones + 1
+            nombre = f"{base}.{repeticiones}"
+            repeticiones = repeticiones + 1 if nombre in originales else vistos.get(nombre, 0)
+        vistos[nombre] = repeticiones + 1
+        unicos.append(nombre)
+    return unicos
+
+
+# Lee un Excel fila a fila con el iterador de solo lectura de openpyxl.
+# Cada bloque de filas se convierte en columnas tipadas y las filas en bruto se descartan,
+# así el pico de memoria se mantiene cerca del tamaño del dataframe final.
+def leer_excel_streaming(contenido, filas_por_bloque=FILAS_POR_BLOQUE, progreso=None):
+    from openpyxl import load_workbook
+
+    libro = load_workbook(io.BytesIO(contenido), read_only=True, data_only=True)
+    try:
+        hoja = libro.active
+        filas = hoja.iter_rows(values_only=True)
+
+        cabecera = next(filas, None)
+        if cabecera is None:
+            return pd.DataFrame()
+
+        nombres = nombres_unicos([str(nombre) if nombre is not None else f"Unnamed: {i}" for i, nombre in enumerate(cabecera)])
+        num_columnas = len(nombres)
+
+        # max_row viene de las dimensiones guardadas en el archivo y puede faltar
+        total_estimado = (hoja.max_row or 0) - 1
+
+        columnas = {nombre: [] for nombre in nombres}
+        bloque = []
+        leidas = 0
+
+        def volcar_bloque():
+            datos = pd.DataFrame.from_records(bloque, columns=nombres)
+            for nombre in nombres:
+                columnas[nombre].append(datos[nombre])
+            bloque.clear()
+
+        for fila in filas:
+            # Las filas totalmente vacías (habituales al final de la hoja) se ignoran
+            if all(valor is None for valor in fila):
+                continue
+
+            fila = tuple(fila[:num_columnas])
+            if len(fila) < num_columnas:
+                fila = fila + (None,) * (num_columnas - len(fila))
+            bloque.append(fila)
+            leidas += 1
+
+            if len(bloque) >= filas_por_bloque:
+                volcar_bloque()
+                if progreso is not None:
+                    fraccion = min(leidas / total_estimado, 1.0) if total_estimado > 0 else 0.0
+                    progreso(fraccion, f"{leidas:,} filas leídas")
+
+        if bloque:
+            volcar_bloque()
+    finally:
+        libro.close()
+
+    # Se une cada columna por separado y se liberan sus bloques antes de pasar a la siguiente
+    resultado = {}
+    for nombre in nombres:
+        partes = columnas.pop(nombre)
+        resultado[nombre] = pd.concat(partes, ignore_index=True) if partes else pd.Series(dtype=object)
+        del partes
+
+    if progreso is not None:
+        progreso(1.0, f"{leidas:,} filas leídas")
+
+    return pd.DataFrame(resultado)
+
+
+# Columnas con tipo fijo tras la normalización
+COLUMNAS_FECHA = ["fecha"]
+COLUMNAS_NUMERICAS = ["repostado", "distancia", "consumo", "coste", "latitud", "longitud"]
+COLUMNAS_CATEGORICAS = ["vehiculo", "tipo_vehiculo", "tipo_combustible", "provincia"]
+
+
+# Convierte cada columna conocida a su tipo definitivo.
+# Los filtros y gráficos trabajan directamente sobre estos tipos sin volver a convertir.
+def tipar_columnas(df):
+    for columna in COLUMNAS_FECHA:
+        if columna in df.columns:
+            df[columna] = pd.to_datetime(df[columna], errors="coerce")
+
+    for columna in COLUMNAS_NUMERICAS:
+        if columna in df.columns:
+            df[columna] = pd.to_numeric(df[columna], errors="coerce").astype("float64")
+
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df.columns:
+            serie = df[columna]
+            # Las matrículas numéricas y de texto se tratan igual, como texto
+            texto = serie.astype(str).where(serie.notna())
+            df[columna] = texto.astype("category")
+
+    return df
+
+
+# Normaliza los nombres de columna, la provincia (extraída de la dirección si no existe) y los tipos
+@perfilar()
+def preparar_datos(df):
+    df.columns = df.columns.str.lower().str.strip()
+
+    if "provincia" in df.columns:
+        df["provincia"] = normalizar_serie_provincias(df["provincia"])
+    elif "direccion" in df.columns:
+        df["provincia"] = extraer_provincia(df["direccion"])
+
+    return tipar_columnas(df)
+
+
+# Ruta del archivo de caché para una huella
+def ruta_cache(huella):
+    return DIRECTORIO_CACHE / f"{huella}-v{VERSION_CACHE}.parquet"
+
+
+# Lee un dataframe de la caché en disco, o None si no existe
+def leer_cache(huella):
+    ruta = ruta_cache(huella)
+    if not ruta.exists():
+        return None
+
+    try:
+        df = pd.read_parquet(ruta)
+    except (OSError, ValueError):
+        # Entrada corrupta o incompleta: se descarta y se vuelve a generar
+        ruta.unlink(missing_ok=True)
+        return None
+
+    # Marca la entrada como usada recientemente para la política de expulsión
+    os.utime(ruta)
+    return df
+
+
+# Guarda un dataframe en la caché en disco y aplica el límite de tamaño
+def guardar_cache(huella, df):
+    DIRECTORIO_CACHE.mkdir(parents=True, exist_ok=True)
+    ruta = ruta_cache(huella)
+    temporal = ruta.with_suffix(".tmp")
+
+    try:
+        df.to_parquet(temporal, index=False)
+    except (ImportError, TypeError, ValueError, OSError):
+        # Columnas con tipos mezclados u otro problema: se trabaja sin caché
+        temporal.unlink(missing_ok=True)
+        return False
+
+    # Se renombra al final para que nunca se lea un archivo a medio escribir
+    os.replace(temporal, ruta)
+    limpiar_cache()
+    return True
+
+
+# Elimina las entradas usadas hace más tiempo hasta quedar dentro del límite
+def limpiar_cache(limite_bytes=None):
+    limite = LIMITE_CACHE_BYTES if limite_bytes is None else limite_bytes
+    if not DIRECTORIO_CACHE.exists():
+        return
+
+    entradas = sorted(DIRECTORIO_CACHE.glob("*.parquet"), key=lambda ruta: ruta.stat().st_mtime)
+    total = sum(ruta.stat().st_size for ruta in entradas)
+
+    # Siempre se conserva la entrada más reciente aunque supere el límite por sí sola
+    for ruta in entradas[:-1]:
+        if total <= limite:
+            break
+        total -= ruta.stat().st_size
+        ruta.unlink(missing_ok=True)
+
+
+# Carga un Excel: lo lee de la caché si ya se procesó antes, si no lo procesa y lo guarda.
+# Con streaming=True se usa la lectura por bloques de memoria acotada.
+@perfilar()
+def cargar_excel(archivo, huella=None, streaming=False, progreso=None):
+    contenido = leer_bytes(archivo)
+    if huella is None:
+        huella = huella_contenido(contenido)
+
+    df = leer_cache(huella)
+    if df is not None:
+        return df
+
+    if streaming:
+        df = leer_excel_streaming(contenido, progreso=progreso)
+    else:
+        df = pd.read_excel(io.BytesIO(contenido))
+    df = preparar_datos(df)
+    guardar_cache(huella, df)
+    return df
+
+
+# Formatos que se leen de una carpeta local
+EXTENSIONES_CARPETA = (".xlsx", ".csv", ".parquet")
+
+# Formatos cuya lectura y conversión de tipos no liberan el GIL: con varios se leen en procesos
+EXTENSIONES_PROCESOS = (".xlsx", ".csv")
+
+# Separadores de CSV admitidos (coma, punto y coma habitual en las exportaciones en español, tabulador y barra)
+SEPARADORES_CSV = ",;\t|"
+
+# Bytes del principio del CSV que se miran para detectar el separador
+MUESTRA_SEPARADOR_BYTES = 64 * 1024
+
+# Carpetas del servidor desde las que se permite cargar datos (REPOSTAJES_CARPETAS, separadas por
+# el separador de rutas del sistema). Sin configurar, la carga desde carpeta queda desactivada.
+CARPETAS_PERMITIDAS = [Path(ruta).resolve() for ruta in os.environ.get("REPOSTAJES_CARPETAS", "").split(os.pathsep) if ruta]
+
+
+# Detecta el separador de un CSV con las primeras líneas completas del archivo; si no se puede
+# decidir se usa la coma, como read_csv. Así la lectura usa el motor en C y no el de Python.
+def detectar_separador(contenido):
+    muestra = contenido[:MUESTRA_SEPARADOR_BYTES]
+    if len(contenido) > MUESTRA_SEPARADOR_BYTES and b"\n" in muestra:
+        muestra = muestra[:muestra.rindex(b"\n")]
+    try:
+        return csv.Sniffer().sniff(muestra.decode("utf-8", errors="ignore"), delimiters=SEPARADORES_CSV).delimiter
+    except csv.Error:
+        return ","
+
+
+# Lee un archivo local de cualquier formato admitido y lo normaliza (nombres, provincia y tipos).
+# Se usa la misma caché en disco que con los Excel subidos. Se ejecuta en los procesos del pool,
+# por eso devuelve también su propio tiempo y si venía de la caché.
+def leer_archivo_local(ruta):
+    inicio = time.perf_counter()
+    ruta = Path(ruta)
+    contenido = ruta.read_bytes()
+    huella = huella_contenido(contenido)
+
+    df = leer_cache(huella)
+    en_cache = df is not None
+    if df is None:
+        extension = ruta.suffix.lower()
+        if extension == ".xlsx":
+            df = pd.read_excel(io.BytesIO(contenido))
+        elif extension == ".csv":
+            df = pd.read_csv(io.BytesIO(contenido), sep=detectar_separador(contenido))
+        else:
+            df = pd.read_parquet(io.BytesIO(contenido))
+        df = preparar_datos(df)
+        guardar_cache(huella, df)
+
+    return df, {"archivo": ruta.name, "filas": len(df), "segundos": time.perf_counter() - inicio, "cache": en_cache}
+
+
+# Huella barata de una carpeta: nombre, tamaño y fecha de modificación de cada archivo admitido.
+# Cambia en cuanto se añade, quita o modifica un archivo, sin leer su contenido.
+def huella_carpeta(carpeta):
+    huella = hashlib.sha256(str(Path(carpeta).resolve()).encode("utf-8"))
+    for ruta in archivos_carpeta(carpeta):
+        estado = ruta.stat()
+        huella.update(f"|{ruta.name}|{estado.st_size}|{estado.st_mtime_ns}".encode("utf-8"))
+    return huella.hexdigest()
+
+
+# Indica si una carpeta está dentro de alguna de las carpetas permitidas (tras resolver enlaces y '..')
+def carpeta_permitida(carpeta, permitidas=None):
+    permitidas = CARPETAS_PERMITIDAS if permitidas is None else permitidas
+    ruta = Path(carpeta).resolve()
+    return any(ruta.is_relative_to(raiz) for raiz in permitidas)
+
+
+def archivos_carpeta(carpeta):
+    if not carpeta_permitida(carpeta):
+        raise ValueError(f"La carpeta {carpeta} no está dentro de las carpetas permitidas (REPOSTAJES_CARPETAS)")
+    return sorted(
+        ruta for ruta in Path(carpeta).iterdir()
+        if ruta.is_file() and ruta.suffix.lower() in EXTENSIONES_CARPETA and not ruta.name.startswith(("~$", "."))
+    )
+
+
+# Une dataframes ya normalizados con columnas que pueden no coincidir.
+# Las categorías de cada columna categórica se unifican antes de concatenar para no perder el tipo.
+def unir_tablas(tablas):
+    tablas = [tabla for tabla in tablas if not tabla.empty]
+    if not tablas:
+        return pd.DataFrame()
+    if len(tablas) == 1:
+        return tablas[0]
+
+    for columna in COLUMNAS_CATEGORICAS:
+        series = [tabla[columna] for tabla in tablas if columna in tabla.columns]
+        if not series:
+            continue
+        categorias = pd.api.types.union_categoricals(series, ignore_order=True).categories
+        tipo = pd.CategoricalDtype(categorias)
+        tablas = [
+            tabla.assign(**{columna: tabla[columna].cat.set_categories(categorias)}) if columna in tabla.columns
+            else tabla.assign(**{columna: pd.Series(index=tabla.index, dtype=tipo)})
+            for tabla in tablas
+        ]
+
+    return pd.concat(tablas, ignore_index=True)
+
+
+# Carga todos los archivos admitidos de una carpeta en paralelo y los une en un solo dataframe.
+# Los Excel y los CSV se leen en procesos: openpyxl y la conversión de fechas y textos de
+# preparar_datos no liberan el GIL, así que con hilos se leerían de uno en uno. Si solo hay Parquet
+# (pyarrow sí libera el GIL) bastan hilos. Los procesos se arrancan con 'spawn' y no con 'fork': el
+# servidor de Streamlit tiene varios hilos y copiarlo con fork puede dejar bloqueos tomados en el hijo.
+# Si se pasa un diccionario en 'informe' se rellena con el tiempo de cada archivo.
+@perfilar()
+def cargar_carpeta(carpeta, procesos=None, progreso=None, informe=None):
+    inicio = time.perf_counter()
+    rutas = archivos_carpeta(carpeta)
+    procesos = max(1, min(procesos or os.cpu_count() or 1, len(rutas) or 1))
+    usar_procesos = procesos > 1 and any(ruta.suffix.lower() in EXTENSIONES_PROCESOS for ruta in rutas)
+    if usar_procesos:
+        ejecutor = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+    else:
+        ejecutor = ThreadPoolExecutor(max_workers=procesos)
+
+    tablas, archivos = {}, []
+    with ejecutor as pool:
+        futuros = {pool.submit(leer_archivo_local, ruta): ruta for ruta in rutas}
+        for hechos, futuro in enumerate(as_completed(futuros), start=1):
+            ruta = futuros[futuro]
+            try:
+                tablas[ruta], datos_archivo = futuro.result()
+            except Exception as error:
+                # Un archivo dañado no impide cargar el resto; queda anotado en el informe
+                datos_archivo = {"archivo": ruta.name, "filas": 0, "segundos": None, "cache": False, "error": str(error)}
+            archivos.append(datos_archivo)
+            if progreso is not None:
+                progreso(hechos / len(rutas), f"{hechos}/{len(rutas)} archivos leídos")
+
+    # Se concatenan en el orden de los nombres, no en el de llegada, para que el resultado sea estable
+    df = unir_tablas([tablas[ruta] for ruta in rutas if ruta in tablas])
+
+    if informe is not None:
+        informe["archivos"] = sorted(archivos, key=lambda datos_archivo: datos_archivo["archivo"])
+        informe["procesos"] = procesos
+        informe["modo"] = "procesos" if usar_procesos else "hilos"
+        informe["segundos"] = time.perf_counter() - inicio
+
+    return df
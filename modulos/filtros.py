@@ -1,5 +1,8 @@
+import numpy as np
 import pandas as pd
 
+from modulos.perfilado import perfilar
+
 # Filtra el dataframe por un rango de valores numéricos
 def filtro_rango(df, columna, rango):
     if df is None or not columna or columna not in df.columns:
@@ -7,8 +10,8 @@ def filtro_rango(df, columna, rango):
     
     min_valor, max_valor = rango
     
-    # Convierte el valor a numérico sin modificar el dataframe original
-    serie_numerica = pd.to_numeric(df[columna], errors="coerce")
+    # La columna ya es numérica desde la carga
+    serie_numerica = df[columna]
     
     return df[(serie_numerica >= min_valor) & (serie_numerica <= max_valor)]
 
@@ -45,37 +48,201 @@ def filtro_fechas(df, fechas):
     if df is None or not fechas or "fecha" not in df.columns:
         return df
     
-    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+    # La columna ya es de tipo fecha desde la carga
+    dias = df["fecha"].dt.date
     
     if len(fechas) == 2:
         fecha_inicio, fecha_fin = fechas
-        return df[(df["fecha"].dt.date >= fecha_inicio) & (df["fecha"].dt.date <= fecha_fin)]
+        return df[(dias >= fecha_inicio) & (dias <= fecha_fin)]
     elif len(fechas) == 1:
         fecha_unica = fechas[0]
-        return df[df["fecha"].dt.date == fecha_unica]
+        return df[dias == fecha_unica]
     
     return df
 
 
-# Aplica todos los filtros al dataframe
-def aplicar_filtros(df, tipos_vehiculo=None, tipos_combustible=None, provincia=None, rangos=None, fechas=None):
-    if df is None:
-        return None
-    
-    datos_filtrados = df.copy()
-    
-    # Aplica los filtros individuales
-    datos_filtrados = filtro_tipo_vehiculo(datos_filtrados, tipos_vehiculo)
-    datos_filtrados = filtro_tipo_combustible(datos_filtrados, tipos_combustible)
-    datos_filtrados = filtro_provincia(datos_filtrados, provincia)
-    
-    # Aplica los filtros dinámicos
+# Columnas categóricas sobre las que se construye un índice de bits por valor
+COLUMNAS_INDEXADAS = ["tipo_vehiculo", "tipo_combustible", "provincia"]
+
+
+# Construye el índice de filtrado de un dataframe.
+# Guarda las columnas como arrays de NumPy y, por cada valor de las columnas categóricas,
+# un bitmap empaquetado (1 bit por fila) que se calcula la primera vez que se usa.
+# Las columnas sin tipar (texto en lugar de categoría o de número) se guardan tal cual en
+# 'otras' y se filtran con isin o convirtiéndolas a número: el resultado es el mismo, solo más lento.
+@perfilar()
+def construir_indice(df):
+    indice = {
+        "num_filas": len(df),
+        "categoricas": {},
+        "bitmaps": {},
+        "numericas": {},
+        "otras": {},
+        "dias": None
+    }
+
+    for columna in df.columns:
+        serie = df[columna]
+        if isinstance(serie.dtype, pd.CategoricalDtype) and columna in COLUMNAS_INDEXADAS:
+            indice["categoricas"][columna] = serie
+            indice["bitmaps"][columna] = {}
+        elif pd.api.types.is_numeric_dtype(serie) and not isinstance(serie.dtype, pd.CategoricalDtype):
+            indice["numericas"][columna] = serie.to_numpy()
+        else:
+            indice["otras"][columna] = serie
+
+    if "fecha" in df.columns:
+        fechas = df["fecha"]
+        if not pd.api.types.is_datetime64_any_dtype(fechas):
+            fechas = pd.to_datetime(fechas, errors="coerce")
+        indice["dias"] = fechas.to_numpy().astype("datetime64[D]")
+
+    return indice
+
+
+# Devuelve el bitmap de un valor de una columna categórica, calculándolo si hace falta
+def bitmap_valor(indice, columna, valor):
+    bitmaps = indice["bitmaps"][columna]
+    if valor not in bitmaps:
+        serie = indice["categoricas"][columna]
+        if valor in serie.cat.categories:
+            codigo = serie.cat.categories.get_loc(valor)
+            bitmaps[valor] = np.packbits(serie.cat.codes.to_numpy() == codigo)
+        else:
+            bitmaps[valor] = np.zeros((indice["num_filas"] + 7) // 8, dtype=np.uint8)
+    return bitmaps[valor]
+
+
+# Calcula la máscara booleana de filas que cumplen todos los filtros en una sola pasada
+@perfilar()
+def calcular_mascara(indice, tipos_vehiculo=None, tipos_combustible=None, provincia=None, rangos=None, fechas=None):
+    num_filas = indice["num_filas"]
+    bits = None
+
+    # Filtros categóricos: OR de los bitmaps de los valores elegidos y AND entre columnas
+    criterios = {"tipo_vehiculo": tipos_vehiculo, "tipo_combustible": tipos_combustible, "provincia": provincia}
+    sin_indice = {}
+    for columna, valores in criterios.items():
+        if not valores:
+            continue
+        if columna not in indice["categoricas"]:
+            sin_indice[columna] = valores
+            continue
+        seleccion = np.zeros((num_filas + 7) // 8, dtype=np.uint8)
+        for valor in valores:
+            np.bitwise_or(seleccion, bitmap_valor(indice, columna, valor), out=seleccion)
+        bits = seleccion if bits is None else np.bitwise_and(bits, seleccion, out=bits)
+
+    if bits is None:
+        mascara = np.ones(num_filas, dtype=bool)
+    else:
+        mascara = np.unpackbits(bits, count=num_filas).view(bool)
+
+    # Columnas categóricas sin tipar: se comparan los valores directamente
+    for columna, valores in sin_indice.items():
+        if columna in indice["otras"]:
+            mascara &= indice["otras"][columna].isin(valores).to_numpy()
+
+    # Filtros de rango sobre las columnas numéricas (los valores vacíos quedan fuera)
     if rangos:
         for columna, (min_valor, max_valor) in rangos.items():
-            if columna.lower() in datos_filtrados.columns:
-                datos_filtrados = filtro_rango(datos_filtrados, columna.lower(), (min_valor, max_valor))
-    
-    # Aplica el filtro por fechas
-    datos_filtrados = filtro_fechas(datos_filtrados, fechas)
+            valores = indice["numericas"].get(columna.lower())
+            if valores is None and columna.lower() in indice["otras"]:
+                valores = pd.to_numeric(indice["otras"][columna.lower()], errors="coerce").to_numpy(dtype="float64")
+            if valores is None:
+                continue
+            with np.errstate(invalid="ignore"):
+                mascara &= valores >= min_valor
+                mascara &= valores <= max_valor
+
+    # Filtro de fechas por día (las fechas vacías quedan fuera)
+    dias = indice["dias"]
+    if fechas and dias is not None:
+        if len(fechas) == 2:
+            fecha_inicio, fecha_fin = fechas
+            mascara &= dias >= np.datetime64(fecha_inicio, "D")
+            mascara &= dias <= np.datetime64(fecha_fin, "D")
+        elif len(fechas) == 1:
+            mascara &= dias == np.datetime64(fechas[0], "D")
+
+    return mascara
+
+
+# Columnas de los desplegables del panel lateral
+COLUMNAS_FACETAS = ["tipo_vehiculo", "tipo_combustible", "provincia"]
+
+
+# Construye la tabla de co-ocurrencia de las facetas con el número de filas de cada combinación.
+# Es pequeña (una fila por combinación existente) y no crece con el número de repostajes.
+@perfilar()
+def construir_facetas(df):
+    columnas = [columna for columna in COLUMNAS_FACETAS if columna in df.columns]
+    if not columnas:
+        return pd.DataFrame(columns=["filas"])
+
+    return df.groupby(columnas, observed=True, dropna=False).size().reset_index(name="filas")
+
+
+# Devuelve las opciones válidas de una faceta según lo seleccionado en las demás
+def opciones_validas(facetas, col_objetivo, filtros_dict):
+    if facetas is None or col_objetivo not in facetas.columns:
+        return []
+
+    mascara = np.ones(len(facetas), dtype=bool)
+    for columna, valores in filtros_dict.items():
+        if valores and columna in facetas.columns:
+            mascara &= facetas[columna].isin(valores).to_numpy()
+
+    return sorted(facetas.loc[mascara, col_objetivo].dropna().unique())
+
+
+# Aplica todos los filtros al dataframe.
+# Solo se materializa la selección final; el índice puede reutilizarse entre llamadas.
+@perfilar()
+def aplicar_filtros(df, tipos_vehiculo=None, tipos_combustible=None, provincia=None, rangos=None, fechas=None, indice=None):
+    if df is None:
+        return None
     
-    return datos_filtrados
\ No newline at end of file
+    if indice is None or indice["num_filas"] != len(df):
+        indice = construir_indice(df)
+
+    mascara = calcular_mascara(
+        indice,
+        tipos_vehiculo=tipos_vehiculo,
+        tipos_combustible=tipos_combustible,
+        provincia=provincia,
+        rangos=rangos,
+        fechas=fechas
+    )
+
+    if mascara.all():
+        return df
+    return df[mascara]
+
+
+# Guarda una selección de filas de la forma más compacta: bitmap (1 bit por fila) o
+# posiciones int32, según cuál ocupe menos. None significa "todas las filas".
+def comprimir_seleccion(mascara):
+    num_filas = len(mascara)
+    seleccionadas = int(np.count_nonzero(mascara))
+    if seleccionadas == num_filas:
+        return None
+
+    if seleccionadas * 4 < (num_filas + 7) // 8:
+        return {"tipo": "posiciones", "num_filas": num_filas, "datos": np.flatnonzero(mascara).astype(np.int32)}
+    return {"tipo": "bitmap", "num_filas": num_filas, "datos": np.packbits(mascara)}
+
+
+# Posiciones de las filas de una selección comprimida
+def posiciones_seleccion(seleccion):
+    if seleccion["tipo"] == "posiciones":
+        return seleccion["datos"]
+    return np.flatnonzero(np.unpackbits(seleccion["datos"], count=seleccion["num_filas"]))
+
+
+# Materializa una selección sobre el dataframe compartido
+@perfilar()
+def materializar_seleccion(df, seleccion):
+    if seleccion is None:
+        return df
+    return df.iloc[posiciones_seleccion(seleccion)]
@@ -1,12 +1,87 @@
-import folium
-from folium.plugins import MarkerCluster
+import time
+
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 
+from modulos.agregados import (
+    media_mensual_modelo,
+    posiciones_top,
+    serie_temporal,
+    totales_dia_semana,
+    totales_por_vehiculo
+)
+from modulos.indices import filas_valor
+from modulos.muestreo import MAX_PUNTOS_LINEA, UMBRAL_WEBGL, reducir_serie
+from modulos.perfilado import perfilar
+from modulos.tendencias import calcular_tendencias
+
+
+# Número de puntos a partir del cual se agrupan las ubicaciones repetidas y se reduce la muestra
+MAX_PUNTOS_MAPA = 2000
+
+# Decimales de redondeo para considerar que dos repostajes están en la misma ubicación (~10 m)
+DECIMALES_UBICACION = 4
+
+# Crea cada marcador en el navegador a partir de [latitud, longitud, popup]
+CALLBACK_MARCADOR = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'gas-pump', prefix: 'fa', markerColor: 'red'});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindPopup(row[2], {maxWidth: 300});
+    marker.bindTooltip('Ver detalles');
+    return marker;
+};
+"""
+
+
+# Construye el texto del popup de cada repostaje con operaciones de texto vectorizadas
+def textos_popup(df):
+    if "fecha" in df.columns:
+        texto = "<b>Fecha:</b> " + df["fecha"].astype(str) + "<br>"
+    else:
+        texto = pd.Series("<b>Fecha:</b> N/A<br>", index=df.index)
+    if "repostado" in df.columns:
+        texto = texto + "<b>Litros:</b> " + df["repostado"].astype(str) + "<br>"
+    if "coste" in df.columns:
+        texto = texto + "<b>Coste:</b> " + df["coste"].astype(str) + "€"
+    return texto
+
+
+# Agrupa los repostajes hechos en la misma ubicación en un único punto con sus totales
+def agrupar_ubicaciones(df):
+    claves = [df["latitud"].round(DECIMALES_UBICACION), df["longitud"].round(DECIMALES_UBICACION)]
+    agregaciones = {"latitud": ("latitud", "first"), "longitud": ("longitud", "first"), "repostajes": ("latitud", "size")}
+    if "fecha" in df.columns:
+        agregaciones["fecha"] = ("fecha", "max")
+    if "repostado" in df.columns:
+        agregaciones["repostado"] = ("repostado", "sum")
+    if "coste" in df.columns:
+        agregaciones["coste"] = ("coste", "sum")
+
+    puntos = df.groupby(claves, sort=False).agg(**agregaciones).reset_index(drop=True)
+
+    texto = "<b>Repostajes:</b> " + puntos["repostajes"].astype(str) + "<br>"
+    if "fecha" in puntos.columns:
+        texto = texto + "<b>Último:</b> " + puntos["fecha"].astype(str) + "<br>"
+    if "repostado" in puntos.columns:
+        texto = texto + "<b>Litros:</b> " + puntos["repostado"].round(2).astype(str) + "<br>"
+    if "coste" in puntos.columns:
+        texto = texto + "<b>Coste:</b> " + puntos["coste"].round(2).astype(str) + "€"
+    puntos["popup"] = texto
+    return puntos
+
 
 #Mapa interactivo
-def mapa_repostajes(df, vehiculo, estilo="Claro"):
+#Los marcadores se envían como una sola capa (FastMarkerCluster) en lugar de un objeto por repostaje.
+#Si se pasa un diccionario en 'informe' se rellena con los puntos y el tiempo de construcción.
+#El tamaño del HTML no se mide aquí (habría que renderizar el mapa dos veces); lo mide mostrar_mapa al enviarlo.
+#Con el índice de vehículos (modulos.indices) las filas del vehículo se obtienen sin recorrer la columna.
+@perfilar()
+def mapa_repostajes(df, vehiculo, estilo="Claro", max_puntos=MAX_PUNTOS_MAPA, informe=None, indice_vehiculos=None):
+
+    inicio = time.perf_counter()
 
     if df is None or df.empty:
         return None
@@ -17,7 +92,10 @@ def mapa_repostajes(df, vehiculo, estilo="Claro"):
     if not columnas_necesarias.issubset(set(df.columns)):
         return None
     
-    df_vehiculo = df[df["vehiculo"].astype(str) == str(vehiculo)].copy()
+    if indice_vehiculos is not None:
+        df_vehiculo = filas_valor(df, indice_vehiculos, str(vehiculo))
+    else:
+        df_vehiculo = df[df["vehiculo"] == str(vehiculo)]
     if df_vehiculo.empty:
         return None
     
@@ -29,61 +107,200 @@ def mapa_repostajes(df, vehiculo, estilo="Claro"):
     lat_center = df_vehiculo["latitud"].mean()
     lon_center = df_vehiculo["longitud"].mean()
 
+    # Folium se importa al dibujar el primer mapa, no al arrancar la aplicación
+    import folium
+    from folium.plugins import FastMarkerCluster
+
     # Crea el mapa con Folium
     m = folium.Map(location=[lat_center, lon_center], zoom_start=6)
 
+    # Por encima del límite se agrupan las ubicaciones repetidas y, si aún sobran, se toma una muestra uniforme
+    if len(df_vehiculo) > max_puntos:
+        puntos = agrupar_ubicaciones(df_vehiculo)
+        if len(puntos) > max_puntos:
+            puntos = puntos.iloc[np.linspace(0, len(puntos) - 1, max_puntos).astype(int)]
+    else:
+        puntos = df_vehiculo[["latitud", "longitud"]].assign(popup=textos_popup(df_vehiculo))
+
     # Agrupar marcadores
-    marker_cluster = MarkerCluster().add_to(m)
-
-    # VARIABLES DE CONFIGURACIÓN
-    color_marcador = "red" 
-    
-    for idx, row in df_vehiculo.iterrows():
-        # Construir tooltip con info
-        tooltip_text = f"<b>Fecha:</b> {row.get('fecha', 'N/A')}<br>"
-        if 'repostado' in row:
-            tooltip_text += f"<b>Litros:</b> {row['repostado']}<br>"
-        if 'coste' in row:
-            tooltip_text += f"<b>Coste:</b> {row['coste']}€"
-
-        folium.Marker(
-            location=[row['latitud'], row['longitud']],
-            tooltip="Ver detalles",
-            popup=folium.Popup(tooltip_text, max_width=300),
-            icon=folium.Icon(color=color_marcador, icon="gas-pump", prefix="fa")
-        ).add_to(marker_cluster)
+    datos_marcadores = puntos[["latitud", "longitud", "popup"]].values.tolist()
+    FastMarkerCluster(datos_marcadores, callback=CALLBACK_MARCADOR).add_to(m)
 
     # Ajustar el zoom automáticamente
     sw = df_vehiculo[['latitud', 'longitud']].min().values.tolist()
     ne = df_vehiculo[['latitud', 'longitud']].max().values.tolist()
     m.fit_bounds([sw, ne]) 
+
+    if informe is not None:
+        informe["repostajes"] = len(df_vehiculo)
+        informe["puntos"] = len(puntos)
+        informe["tiempo_ms"] = (time.perf_counter() - inicio) * 1000
         
     return m
 
+# Tamaño de celda por defecto de la rejilla del mapa de flota, en grados (~5 km)
+TAMANO_CELDA = 0.05
+
+# Número máximo de celdas que se dibujan como rectángulos (las de más litros)
+MAX_CELDAS_MAPA = 3000
+
+
+# Agrupa las coordenadas de los repostajes en una rejilla regular.
+# Cada celda acumula litros, coste y número de visitas; todo se hace con NumPy sin recorrer filas.
+def agregar_rejilla(df, tamano_celda=TAMANO_CELDA):
+    latitud = df["latitud"].to_numpy(dtype="float64")
+    longitud = df["longitud"].to_numpy(dtype="float64")
+    validas = ~(np.isnan(latitud) | np.isnan(longitud))
+
+    fila = np.floor(latitud[validas] / tamano_celda).astype(np.int64)
+    columna = np.floor(longitud[validas] / tamano_celda).astype(np.int64)
+
+    # Una clave entera por celda: se desplaza la columna para que siempre sea positiva
+    ancho = int(np.ceil(360 / tamano_celda)) + 2
+    claves = fila * ancho + (columna + ancho // 2)
+    celdas, inverso = np.unique(claves, return_inverse=True)
+
+    def sumar(nombre):
+        if nombre not in df.columns:
+            return np.zeros(len(celdas))
+        valores = np.nan_to_num(df[nombre].to_numpy(dtype="float64")[validas])
+        return np.bincount(inverso, weights=valores, minlength=len(celdas))
+
+    fila_celda = np.floor_divide(celdas, ancho)
+    columna_celda = celdas - fila_celda * ancho - ancho // 2
+
+    return pd.DataFrame({
+        "lat_min": fila_celda * tamano_celda,
+        "lon_min": columna_celda * tamano_celda,
+        "visitas": np.bincount(inverso, minlength=len(celdas)),
+        "litros": sumar("repostado"),
+        "coste": sumar("coste")
+    })
+
+
+#Mapa de la flota: mapa de calor y rejilla coloreada con los repostajes de todos los vehículos
+#Las celdas pueden llegar ya agregadas (con las columnas de agregar_rejilla); entonces df puede ser None.
+@perfilar()
+def mapa_flota(df, tamano_celda=TAMANO_CELDA, metrica="litros", informe=None, celdas=None):
+
+    inicio = time.perf_counter()
+
+    if celdas is None:
+        if df is None or df.empty or not {"latitud", "longitud"}.issubset(df.columns):
+            return None
+        celdas = agregar_rejilla(df, tamano_celda)
+    if celdas.empty:
+        return None
+
+    # Sin litros en los datos se usa el número de visitas
+    if metrica not in celdas.columns or not celdas[metrica].any():
+        metrica = "visitas"
+
+    centro_lat = celdas["lat_min"].to_numpy() + tamano_celda / 2
+    centro_lon = celdas["lon_min"].to_numpy() + tamano_celda / 2
+    pesos = celdas[metrica].to_numpy(dtype="float64")
+
+    import folium
+    from branca.colormap import linear
+    from folium.plugins import HeatMap
+
+    m = folium.Map(location=[float(np.average(centro_lat, weights=celdas["visitas"])),
+                             float(np.average(centro_lon, weights=celdas["visitas"]))], zoom_start=6)
+
+    # Mapa de calor con una entrada por celda
+    maximo = pesos.max() if pesos.max() > 0 else 1.0
+    HeatMap(np.column_stack([centro_lat, centro_lon, pesos / maximo]).tolist(), name="Mapa de calor", radius=18).add_to(m)
+
+    # Rejilla coloreada con las celdas más relevantes
+    principales = celdas.iloc[posiciones_top(pesos, MAX_CELDAS_MAPA)]
+    escala = linear.YlOrRd_09.scale(0, float(maximo))
+    escala.caption = metrica.capitalize()
+
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[
+                    [lon, lat], [lon + tamano_celda, lat], [lon + tamano_celda, lat + tamano_celda],
+                    [lon, lat + tamano_celda], [lon, lat]
+                ]]
+            },
+            "properties": {
+                "color": escala(valor),
+                "visitas": int(visitas),
+                "litros": round(float(litros), 1),
+                "coste": round(float(coste), 2)
+            }
+        }
+        for lat, lon, valor, visitas, litros, coste in zip(
+            principales["lat_min"], principales["lon_min"], principales[metrica],
+            principales["visitas"], principales["litros"], principales["coste"]
+        )
+    ]
+
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        name="Rejilla",
+        style_function=lambda feature: {
+            "fillColor": feature["properties"]["color"],
+            "color": feature["properties"]["color"],
+            "weight": 0.5,
+            "fillOpacity": 0.55
+        },
+        tooltip=folium.GeoJsonTooltip(
+            fields=["visitas", "litros", "coste"],
+            aliases=["Visitas", "Litros", "Coste (€)"]
+        )
+    ).add_to(m)
+
+    escala.add_to(m)
+    folium.LayerControl().add_to(m)
+
+    m.fit_bounds([
+        [float(celdas["lat_min"].min()), float(celdas["lon_min"].min())],
+        [float(celdas["lat_min"].max()) + tamano_celda, float(celdas["lon_min"].max()) + tamano_celda]
+    ])
+
+    if informe is not None:
+        informe["repostajes"] = int(celdas["visitas"].sum())
+        informe["celdas"] = len(celdas)
+        informe["tiempo_ms"] = (time.perf_counter() - inicio) * 1000
+
+    return m
+
 """
 Genera un grafico de barras agrupado por tiempo.
+Si se pasa el cubo temporal de los datos se leen de él los totales ya acumulados
+(de toda la flota o del vehículo indicado) en lugar de agrupar las filas.
+Con el cubo, df puede ser None (datos que solo están agregados, ver modulos.motor_sql).
 """
-def grafico_barras_temporal(df, col_fecha, col_metrica, periodo='M', titulo="Evolución Temporal"):
+@perfilar()
+def grafico_barras_temporal(df, col_fecha, col_metrica, periodo='M', titulo="Evolución Temporal", cubo=None, vehiculo=None):
 
-    if df is None or df.empty:
-        return None
-    
-    if col_fecha not in df.columns or col_metrica not in df.columns:
+    if df is None and cubo is None:
         return None
 
-    # Aseguramos formato fecha
-    df = df.copy()
-    df[col_fecha] = pd.to_datetime(df[col_fecha], errors='coerce')
-    df = df.dropna(subset=[col_fecha])
+    if df is not None and (df.empty or col_fecha not in df.columns or col_metrica not in df.columns):
+        return None
 
-    if periodo == 'W':
-        frecuencia = 'W-MON'
-    elif periodo == 'M':
-        frecuencia = 'MS'
+    if cubo is not None and col_fecha == "fecha" and col_metrica in cubo["metricas"]:
+        serie = serie_temporal(cubo, col_metrica, periodo, vehiculo)
+        datos_agrupados = serie.rename(col_metrica).rename_axis(col_fecha).reset_index()
+    elif df is None:
+        return None
     else:
-        frecuencia = 'Y' 
-    
-    datos_agrupados = df.groupby(pd.Grouper(key=col_fecha, freq=frecuencia))[col_metrica].sum().reset_index()
+        # La fecha ya viene tipada desde la carga; solo se descartan las vacías
+        df = df.dropna(subset=[col_fecha])
+
+        if periodo == 'W':
+            frecuencia = 'W-MON'
+        elif periodo == 'M':
+            frecuencia = 'MS'
+        else:
+            frecuencia = 'YS' 
+        
+        datos_agrupados = df.groupby(pd.Grouper(key=col_fecha, freq=frecuencia))[col_metrica].sum().reset_index()
 
     if datos_agrupados.empty:
         return None
@@ -119,16 +336,19 @@ def grafico_barras_temporal(df, col_fecha, col_metrica, periodo='M', titulo="Evo
 
 """
 Grafico circular indicando el día de la semana de repostaje.
+Con 'totales' (serie con el total de cada valor, ya agregada) no se agrupan las filas.
 """
-def grafico_tarta_distribucion(df, columna, titulo):
+@perfilar()
+def grafico_tarta_distribucion(df, columna, titulo, totales=None):
 
-    if df is None or df.empty or columna not in df.columns:
+    if totales is not None:
+        df_counts = totales.rename_axis(columna).reset_index(name='valor')
+    elif df is None or df.empty or columna not in df.columns:
         return None
-
-    if "repostado" in df.columns:
-        df_counts = df.groupby(columna)["repostado"].sum().reset_index(name='valor')
+    elif "repostado" in df.columns:
+        df_counts = df.groupby(columna, observed=True)["repostado"].sum().reset_index(name='valor')
     else:
-        df_counts = df.groupby(columna).size().reset_index(name='valor')
+        df_counts = df.groupby(columna, observed=True).size().reset_index(name='valor')
     
     if df_counts.empty:
         return None
@@ -151,29 +371,41 @@ def grafico_tarta_distribucion(df, columna, titulo):
 
 """
 Grafico de barras indicando el dia de la semana de repostaje.
+Con el cubo temporal se suman los totales diarios en lugar de las filas (y df puede ser None).
 """
-def grafico_dia_semana(df, col_fecha):
+@perfilar()
+def grafico_dia_semana(df, col_fecha, cubo=None):
 
-    if df is None or df.empty or col_fecha not in df.columns:
+    usar_cubo = cubo is not None and col_fecha == "fecha"
+    if df is None and not usar_cubo:
         return None
-    
-    df = df.copy()
-    df[col_fecha] = pd.to_datetime(df[col_fecha], errors='coerce')
-    df = df.dropna(subset=[col_fecha])
-    
-    if df.empty:
+
+    if df is not None and (df.empty or col_fecha not in df.columns):
         return None
 
-    # Obtiene el índice del día de semana (0=Lunes, 6=Domingo)
-    df['dia_index'] = df[col_fecha].dt.dayofweek
+    columnas = df.columns if df is not None else cubo["metricas"]
+    if not usar_cubo:
+        df = df.dropna(subset=[col_fecha])
+    
+        if df.empty:
+            return None
+
+        # Obtiene el índice del día de semana (0=Lunes, 6=Domingo)
+        dia_index = df[col_fecha].dt.dayofweek.rename('dia_index')
     
     # Si hay repostado sumamos, si no contamos.
-    if "repostado" in df.columns:
-        datos_agrupados = df.groupby('dia_index')["repostado"].sum().reset_index()
+    if "repostado" in columnas:
+        if usar_cubo:
+            datos_agrupados = totales_dia_semana(cubo, "repostado").reset_index(name="repostado")
+        else:
+            datos_agrupados = df["repostado"].groupby(dia_index).sum().reset_index()
         columna_y = "repostado"
         etiqueta_y = "Total Repostado"
     else:
-        datos_agrupados = df.groupby('dia_index').size().reset_index(name='conteo')
+        if usar_cubo:
+            datos_agrupados = totales_dia_semana(cubo).reset_index(name='conteo')
+        else:
+            datos_agrupados = dia_index.groupby(dia_index).size().reset_index(name='conteo')
         columna_y = "conteo"
         etiqueta_y = "Cantidad de Repostajes"
 
@@ -209,8 +441,10 @@ def grafico_dia_semana(df, col_fecha):
 
 """
 Grafico lineal indicando si el consumo va a más o menos.
+Los repostajes anómalos (ver modulos.anomalias) se resaltan siempre, aunque la serie se reduzca.
 """
-def grafico_lineal_consumo(df, col_fecha, col_consumo="consumo"):
+@perfilar()
+def grafico_lineal_consumo(df, col_fecha, col_consumo="consumo", tendencias=None, max_puntos=MAX_PUNTOS_LINEA, umbral_webgl=UMBRAL_WEBGL, anomalias=None):
 
     if df is None or df.empty:
         return None
@@ -222,31 +456,69 @@ def grafico_lineal_consumo(df, col_fecha, col_consumo="consumo"):
     if col_fecha not in df.columns:
         return None
     
-    df = df.copy()
-    df[col_fecha] = pd.to_datetime(df[col_fecha], errors='coerce')
-    df = df.dropna(subset=[col_fecha, columna_consumo])
-    df = df.sort_values(col_fecha)
+    # Las tendencias llegan ya calculadas (ver modulos.tendencias); si no, se calculan para estos datos
+    if tendencias is None:
+        tendencias = calcular_tendencias(df[[col_fecha, columna_consumo]], col_fecha, columna_consumo)["puntos"]
+    df = tendencias
     
     if df.empty:
         return None
 
+    # Series largas: se reducen los puntos (LTTB conserva picos y forma) y se dibujan con WebGL
+    posiciones = reducir_serie(df[col_fecha].to_numpy(), df[columna_consumo].to_numpy(), max_puntos)
+    if len(posiciones) < len(df):
+        df = df.iloc[posiciones]
+    webgl = len(df) > umbral_webgl
+    Traza = go.Scattergl if webgl else go.Scatter
+
     fig = px.line(
         df, 
         x=col_fecha, 
         y=columna_consumo, 
         markers=True,
         title=f"Evolución del {columna_consumo.capitalize()}",
-        color_discrete_sequence=["#EF553B"]
+        color_discrete_sequence=["#EF553B"],
+        render_mode="webgl" if webgl else "svg"
     )
     
-    if len(df) > 2:
-        try:
-            tendencia = px.scatter(df, x=col_fecha, y=columna_consumo, trendline="ols").data[1]
-            tendencia.line.color = 'white'
-            tendencia.line.dash = 'dot'
-            fig.add_trace(tendencia)
-        except Exception:
-            pass
+    # Líneas de tendencia precalculadas
+    if df["tendencia_ols"].notna().any():
+        fig.add_trace(Traza(
+            x=df[col_fecha],
+            y=df["tendencia_ols"],
+            mode='lines',
+            line=dict(color='white', dash='dot'),
+            name="Tendencia (MCO)"
+        ))
+
+    fig.add_trace(Traza(
+        x=df[col_fecha],
+        y=df["mediana_movil"],
+        mode='lines',
+        line=dict(color='#FFA15A', width=2),
+        name="Mediana móvil"
+    ))
+
+    fig.add_trace(Traza(
+        x=df[col_fecha],
+        y=df["media_exponencial"],
+        mode='lines',
+        line=dict(color='#19D3F3', width=2),
+        name="Media exponencial",
+        visible='legendonly'
+    ))
+
+    # Repostajes anómalos marcados sobre la serie
+    if anomalias is not None and not anomalias.empty and columna_consumo in anomalias.columns:
+        fig.add_trace(go.Scatter(
+            x=anomalias[col_fecha],
+            y=anomalias[columna_consumo],
+            mode='markers',
+            marker=dict(color='#FF1744', size=12, symbol='x', line=dict(width=1, color='white')),
+            name="Anomalías",
+            customdata=np.column_stack([anomalias["puntuacion"].to_numpy(), anomalias["motivo"].astype(str).to_numpy()]),
+            hovertemplate="%{x}<br>%{y:.2f}<br>Puntuación %{customdata[0]:.1f}<br>%{customdata[1]}<extra></extra>"
+        ))
 
     fig.update_layout(
         template="plotly_dark",
@@ -260,27 +532,53 @@ def grafico_lineal_consumo(df, col_fecha, col_consumo="consumo"):
 """
 Comparativa: Vehículo Seleccionado vs Media del Modelo.
 """
-def grafico_comparativo_modelo(df_total, vehiculo_sel, col_fecha, col_metrica, col_modelo):
+@perfilar()
+def grafico_comparativo_modelo(df_total, vehiculo_sel, col_fecha, col_metrica, col_modelo, cubo=None, indice_vehiculos=None):
+
+    if df_total is None and cubo is None:
+        return None
 
-    if df_total is None or df_total.empty:
+    if df_total is not None and df_total.empty:
         return None
     
+    # Sin filas (solo el cubo) las columnas disponibles son las del cubo
+    columnas = df_total.columns if df_total is not None else [cubo["columna_modelo"], col_fecha] + cubo["metricas"]
     columna_modelo = col_modelo
-    if columna_modelo not in df_total.columns:
-        if "tipo_vehiculo" in df_total.columns:
+    if columna_modelo not in columnas:
+        if "tipo_vehiculo" in columnas:
             columna_modelo = "tipo_vehiculo"
         else:
             return None
 
-    # 1. Obtiene los datos del vehículo seleccionado.
-    datos_vehiculo = df_total[df_total["vehiculo"].astype(str) == str(vehiculo_sel)]
+    if cubo is not None and col_fecha == "fecha" and cubo["columna_modelo"] == columna_modelo and col_metrica in cubo["metricas"]:
+        # Con el cubo se leen los totales mensuales ya acumulados por vehículo
+        if str(vehiculo_sel) not in cubo["modelos"]:
+            return None
+        nombre_modelo = cubo["modelos"][str(vehiculo_sel)]
+        datos_vehiculo_agrupados = serie_temporal(cubo, col_metrica, "M", str(vehiculo_sel)).rename(col_metrica).rename_axis(col_fecha).reset_index()
+        datos_modelo_agrupados = media_mensual_modelo(cubo, nombre_modelo, col_metrica).rename(col_metrica).rename_axis(col_fecha).reset_index()
+        if datos_modelo_agrupados.empty:
+            return None
+        return figura_comparativa(datos_vehiculo_agrupados, datos_modelo_agrupados, vehiculo_sel, nombre_modelo, col_fecha, col_metrica)
+
+    if df_total is None:
+        return None
+
+    # 1. Obtiene los datos del vehículo seleccionado (con el índice de vehículos si se tiene).
+    if indice_vehiculos is not None:
+        datos_vehiculo = filas_valor(df_total, indice_vehiculos, str(vehiculo_sel))
+    else:
+        datos_vehiculo = df_total[df_total["vehiculo"] == str(vehiculo_sel)]
     if datos_vehiculo.empty:
         return None
     
-    nombre_modelo = datos_vehiculo.iloc[0][columna_modelo]
+    if indice_vehiculos is not None and columna_modelo == "tipo_vehiculo":
+        nombre_modelo = indice_vehiculos["modelos"][str(vehiculo_sel)]
+    else:
+        nombre_modelo = datos_vehiculo.iloc[0][columna_modelo]
 
     # 2. Obtiene los datos de todo el modelo y calcula la media mensual.
-    datos_modelo = df_total[df_total[columna_modelo] == nombre_modelo].copy()
+    datos_modelo = df_total[df_total[columna_modelo] == nombre_modelo]
     
     if datos_modelo.empty:
         return None
@@ -288,12 +586,8 @@ def grafico_comparativo_modelo(df_total, vehiculo_sel, col_fecha, col_metrica, c
     if col_fecha not in datos_modelo.columns:
         return None
 
-    # Estandariza las fechas.
-    datos_modelo[col_fecha] = pd.to_datetime(datos_modelo[col_fecha], errors='coerce')
+    # Descarta las fechas vacías (ya vienen tipadas desde la carga).
     datos_modelo = datos_modelo.dropna(subset=[col_fecha])
-    
-    datos_vehiculo = datos_vehiculo.copy()
-    datos_vehiculo[col_fecha] = pd.to_datetime(datos_vehiculo[col_fecha], errors='coerce')
     datos_vehiculo = datos_vehiculo.dropna(subset=[col_fecha])
 
     # 3. Calcula la métrica mensual. 
@@ -303,17 +597,32 @@ def grafico_comparativo_modelo(df_total, vehiculo_sel, col_fecha, col_metrica, c
     datos_vehiculo_agrupados = datos_vehiculo.groupby(pd.Grouper(key=col_fecha, freq=frecuencia))[col_metrica].sum().reset_index()
     
     # Primero sumamos por [Mes, Vehículo] para obtener el total de CADA coche en CADA mes
-    datos_modelo_por_vehiculo = datos_modelo.groupby([pd.Grouper(key=col_fecha, freq=frecuencia), "vehiculo"])[col_metrica].sum().reset_index()
+    datos_modelo_por_vehiculo = datos_modelo.groupby([pd.Grouper(key=col_fecha, freq=frecuencia), "vehiculo"], observed=True)[col_metrica].sum().reset_index()
     
     # Ahora promediamos esos totales por mes dando como resultado el promedio mensual de repostajes del modelo
     datos_modelo_agrupados = datos_modelo_por_vehiculo.groupby(col_fecha)[col_metrica].mean().reset_index()
     
+    return figura_comparativa(datos_vehiculo_agrupados, datos_modelo_agrupados, vehiculo_sel, nombre_modelo, col_fecha, col_metrica)
+
+# Dibuja la comparativa a partir de las series mensuales del vehículo y de la media del modelo
+def figura_comparativa(datos_vehiculo_agrupados, datos_modelo_agrupados, vehiculo_sel, nombre_modelo, col_fecha, col_metrica,
+                       max_puntos=MAX_PUNTOS_LINEA, umbral_webgl=UMBRAL_WEBGL):
+
+    # Series largas: se reducen los puntos de cada serie y se dibujan con WebGL
+    series = []
+    for datos in (datos_vehiculo_agrupados, datos_modelo_agrupados):
+        posiciones = reducir_serie(datos[col_fecha].to_numpy(), datos[col_metrica].to_numpy(), max_puntos)
+        series.append(datos.iloc[posiciones] if len(posiciones) < len(datos) else datos)
+    datos_vehiculo_agrupados, datos_modelo_agrupados = series
+    webgl = max(len(datos_vehiculo_agrupados), len(datos_modelo_agrupados)) > umbral_webgl
+    Traza = go.Scattergl if webgl else go.Scatter
+
     # Crea el gráfico
     fig = go.Figure()
     
     #Datos de la media del modelo
     if not datos_modelo_agrupados.empty:
-        fig.add_trace(go.Scatter(
+        fig.add_trace(Traza(
             x=datos_modelo_agrupados[col_fecha],
             y=datos_modelo_agrupados[col_metrica],
             mode='lines',
@@ -324,7 +633,7 @@ def grafico_comparativo_modelo(df_total, vehiculo_sel, col_fecha, col_metrica, c
         
     #Datos del vehículo seleccionado
     if not datos_vehiculo_agrupados.empty:
-        fig.add_trace(go.Scatter(
+        fig.add_trace(Traza(
             x=datos_vehiculo_agrupados[col_fecha],
             y=datos_vehiculo_agrupados[col_metrica],
             mode='lines+markers',
@@ -349,34 +658,32 @@ def grafico_comparativo_modelo(df_total, vehiculo_sel, col_fecha, col_metrica, c
 
 """
 Muestra el top de vehículos por consumo, recorrido y repostado.
+Los totales por vehículo se pueden pasar ya calculados para que cambiar N no vuelva a agrupar.
+Con los totales ya calculados df puede ser None.
 """
-def mostrar_top_vehiculos(df, top_n=5):
-    
-    if df is None or df.empty:
-        return None
+@perfilar()
+def mostrar_top_vehiculos(df, top_n=5, totales=None):
     
-    if "vehiculo" not in df.columns:
-        return None
+    # Una sola agrupación con todas las métricas
+    if totales is None:
+        if df is None or df.empty or "vehiculo" not in df.columns:
+            return None
+        totales = totales_por_vehiculo(df)
     
     # Preparamos un diccionario para almacenar los resultados
     resultados = {}
     
-    # Top vehículos por consumo
-    if "consumo" in df.columns:
-        top_consumo = df.groupby("vehiculo")["consumo"].sum().nlargest(top_n).reset_index()
-        top_consumo.columns = ["Vehículo", "Total Consumo (l/km)"]
-        resultados["consumo"] = top_consumo
-    
-    # Top vehículos por recorrido
-    if "distancia" in df.columns:
-        top_recorrido = df.groupby("vehiculo")["distancia"].sum().nlargest(top_n).reset_index()
-        top_recorrido.columns = ["Vehículo", "Total Recorrido (km)"]
-        resultados["recorrido"] = top_recorrido
-    
-    # Top vehículos por repostado
-    if "repostado" in df.columns:
-        top_repostado = df.groupby("vehiculo")["repostado"].sum().nlargest(top_n).reset_index()
-        top_repostado.columns = ["Vehículo", "Total Repostado (l)"]
-        resultados["repostado"] = top_repostado
+    tablas = [
+        ("consumo", "consumo", "Total Consumo (l/km)"),
+        ("distancia", "recorrido", "Total Recorrido (km)"),
+        ("repostado", "repostado", "Total Repostado (l)")
+    ]
+    
+    for metrica, nombre, etiqueta in tablas:
+        if metrica in totales.columns:
+            posiciones = posiciones_top(totales[metrica].to_numpy(), top_n)
+            top = totales[metrica].iloc[posiciones].reset_index()
+            top.columns = ["Vehículo", etiqueta]
+            resultados[nombre] = top
     
     return resultados
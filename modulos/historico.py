@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from modulos.agregados import METRICAS_CUBO
+from modulos.carga import tipar_columnas
+from modulos.perfilado import perfilar
+
+# Carpeta del histórico de la flota (se puede cambiar con REPOSTAJES_HISTORICO)
+DIRECTORIO_HISTORICO = Path(os.environ.get("REPOSTAJES_HISTORICO", Path.home() / ".repostajes" / "historico"))
+
+# Versión del formato del histórico
+VERSION_HISTORICO = 1
+
+# Columnas que identifican un repostaje; una fila con los mismos valores que otra ya guardada es un duplicado
+CLAVE_REPOSTAJE = ["vehiculo", "fecha", "repostado"]
+
+# Métricas que se acumulan por mes y vehículo (y en los totales por vehículo)
+METRICAS_HISTORICO = METRICAS_CUBO + ["coste"]
+
+# Partición de las filas sin fecha
+SIN_FECHA = "sin_fecha"
+
+# Las escrituras del histórico se hacen de una en una dentro del proceso
+BLOQUEO_HISTORICO = threading.Lock()
+
+
+def ruta_manifiesto(directorio):
+    return directorio / "manifiesto.json"
+
+
+def ruta_particion(directorio, mes):
+    return directorio / "particiones" / f"{mes}.parquet"
+
+
+def ruta_mensual(directorio):
+    return directorio / "agregados" / "mensual.parquet"
+
+
+def ruta_vehiculos(directorio):
+    return directorio / "agregados" / "vehiculos.parquet"
+
+
+# Lee el manifiesto del histórico: archivos añadidos, filas por partición y huella del contenido
+def leer_manifiesto(directorio=None):
+    directorio = Path(directorio) if directorio else DIRECTORIO_HISTORICO
+    ruta = ruta_manifiesto(directorio)
+    if ruta.exists():
+        try:
+            manifiesto = json.loads(ruta.read_text(encoding="utf-8"))
+            if manifiesto.get("version") == VERSION_HISTORICO:
+                return manifiesto
+        except ValueError:
+            pass
+    return {"version": VERSION_HISTORICO, "archivos": {}, "particiones": {}, "huella": None, "pendiente": False}
+
+
+# Escribe un archivo con un nombre temporal y lo renombra al final, para no dejar nunca uno a medias
+def escribir_atomico(ruta, escribir):
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+    escribir(temporal)
+    os.replace(temporal, ruta)
+
+
+def guardar_parquet(ruta, df, index=False):
+    escribir_atomico(ruta, lambda temporal: df.to_parquet(temporal, index=index))
+
+
+def guardar_manifiesto(directorio, manifiesto):
+    texto = json.dumps(manifiesto, indent=1, ensure_ascii=False)
+    escribir_atomico(ruta_manifiesto(directorio), lambda temporal: temporal.write_text(texto, encoding="utf-8"))
+
+
+# Huella del contenido del histórico; cambia cada vez que se añaden filas. None si está vacío.
+def huella_historico(directorio=None):
+    return leer_manifiesto(directorio)["huella"]
+
+
+# Mes (AAAA-MM) de cada fila; las filas sin fecha van a su propia partición
+def meses_filas(fechas):
+    fechas = pd.to_datetime(fechas)
+    claves = (fechas.dt.year * 100 + fechas.dt.month).to_numpy(dtype="float64")
+    # Sin centinela: las fechas vacías tienen su propio código en lugar de -1
+    codigos, unicos = pd.factorize(claves, use_na_sentinel=False)
+    nombres = np.array([SIN_FECHA if np.isnan(k) else f"{int(k) // 100:04d}-{int(k) % 100:02d}" for k in unicos], dtype=object)
+    return nombres[codigos] if len(unicos) else np.array([], dtype=object)
+
+
+# Sumas, conteos y número de repostajes de las métricas agrupadas por las columnas indicadas.
+# Con dropna=True las filas sin clave quedan fuera, como en agregados.totales_por_vehiculo.
+def acumular(df, columnas, dropna=False):
+    metricas = [metrica for metrica in METRICAS_HISTORICO if metrica in df.columns]
+    grupos = df.groupby(columnas, observed=True, dropna=dropna)[metricas]
+    resultado = pd.concat([grupos.sum().add_suffix("_suma"), grupos.count().add_suffix("_n")], axis=1)
+    resultado["repostajes"] = grupos.size()
+    return resultado
+
+
+# Suma un delta a una tabla de acumulados (las claves nuevas se añaden, las existentes se incrementan)
+def sumar_acumulados(actual, delta):
+    if actual is None or actual.empty:
+        return delta
+    return actual.add(delta, fill_value=0)
+
+
+def leer_acumulados(ruta, niveles):
+    if not ruta.exists():
+        return None
+    return pd.read_parquet(ruta).set_index(niveles)
+
+
+# Añade un conjunto de repostajes (ya preparado con preparar_datos) al histórico.
+# Solo se leen y reescriben las particiones de los meses que aparecen en los datos, se descartan
+# las filas que ya estaban (misma matrícula, fecha y litros) y los acumulados por mes y por
+# vehículo se incrementan con las filas nuevas en lugar de recalcularse sobre todo el histórico.
+@perfilar()
+def anadir_al_historico(df, huella=None, nombre=None, directorio=None):
+    directorio = Path(directorio) if directorio else DIRECTORIO_HISTORICO
+    faltan = [columna for columna in CLAVE_REPOSTAJE if columna not in df.columns]
+    if faltan:
+        raise ValueError(f"Faltan columnas para el histórico: {', '.join(faltan)}")
+
+    with BLOQUEO_HISTORICO:
+        manifiesto = leer_manifiesto(directorio)
+        informe = {"archivo": nombre, "filas": len(df), "nuevas": 0, "duplicadas": 0, "meses": [], "vehiculos": 0}
+        if huella is not None and huella in manifiesto["archivos"]:
+            informe["duplicadas"] = len(df)
+            informe["repetido"] = True
+            return informe
+
+        # Una escritura anterior se interrumpió: los acumulados se rehacen desde las particiones
+        if manifiesto.get("pendiente"):
+            reconstruir_acumulados(directorio, manifiesto)
+
+        meses = meses_filas(df["fecha"])
+        nuevas_por_mes = []
+        for mes in pd.unique(meses):
+            filas_mes = df[meses == mes]
+            ruta = ruta_particion(directorio, mes)
+            existentes = pd.read_parquet(ruta) if ruta.exists() else None
+
+            # Duplicados frente a lo ya guardado y dentro del propio archivo
+            if existentes is not None:
+                combinadas = pd.concat([existentes, filas_mes], ignore_index=True)
+                repetidas = combinadas.duplicated(subset=CLAVE_REPOSTAJE).to_numpy()[len(existentes):]
+            else:
+                repetidas = filas_mes.duplicated(subset=CLAVE_REPOSTAJE).to_numpy()
+
+            nuevas = filas_mes[~repetidas]
+            informe["duplicadas"] += int(repetidas.sum())
+            if nuevas.empty:
+                continue
+
+            # Mientras se reescriben particiones los acumulados no cuadran; se marca por si se interrumpe
+            if not manifiesto.get("pendiente"):
+                manifiesto["pendiente"] = True
+                guardar_manifiesto(directorio, manifiesto)
+
+            particion = nuevas if existentes is None else pd.concat([existentes, nuevas], ignore_index=True)
+            particion = tipar_columnas(particion.reset_index(drop=True))
+            guardar_parquet(ruta, particion)
+            manifiesto["particiones"][mes] = len(particion)
+
+            nuevas = nuevas.assign(mes=mes)
+            nuevas_por_mes.append(nuevas)
+            informe["meses"].append(mes)
+
+        if nuevas_por_mes:
+            nuevas = tipar_columnas(pd.concat(nuevas_por_mes, ignore_index=True))
+            informe["nuevas"] = len(nuevas)
+            informe["vehiculos"] = int(nuevas["vehiculo"].nunique())
+
+            # Acumulados incrementales: solo cambian los pares mes-vehículo y los vehículos con filas nuevas
+            niveles_mensual = ["mes", "vehiculo"] + (["tipo_vehiculo"] if "tipo_vehiculo" in nuevas.columns else [])
+            mensual = sumar_acumulados(leer_acumulados(ruta_mensual(directorio), niveles_mensual), acumular(nuevas, niveles_mensual))
+            guardar_parquet(ruta_mensual(directorio), mensual.reset_index())
+
+            vehiculos = sumar_acumulados(leer_acumulados(ruta_vehiculos(directorio), ["vehiculo"]), acumular(nuevas, ["vehiculo"], dropna=True))
+            guardar_parquet(ruta_vehiculos(directorio), vehiculos.reset_index())
+
+        # El archivo solo se da por añadido al final; si algo falla antes se puede volver a añadir
+        # (sus filas ya guardadas se descartan como duplicadas y los acumulados se reconstruyen)
+        manifiesto["pendiente"] = False
+        if huella is not None:
+            manifiesto["archivos"][huella] = {"nombre": nombre, "filas": informe["filas"], "nuevas": informe["nuevas"]}
+        if informe["nuevas"]:
+            huellas = sorted(manifiesto["archivos"]) if manifiesto["archivos"] else [str(manifiesto["particiones"])]
+            manifiesto["huella"] = hashlib.sha256(
+                f"{VERSION_HISTORICO}|{'|'.join(huellas)}|{sum(manifiesto['particiones'].values())}".encode("utf-8")
+            ).hexdigest()
+        guardar_manifiesto(directorio, manifiesto)
+
+    return informe
+
+
+# Recalcula los acumulados y el número de filas de cada partición leyendo todas las particiones.
+# Solo se usa para recuperarse de una escritura interrumpida.
+def reconstruir_acumulados(directorio, manifiesto):
+    mensual, vehiculos = None, None
+    manifiesto["particiones"] = {}
+    for ruta in sorted((directorio / "particiones").glob("*.parquet")):
+        particion = pd.read_parquet(ruta)
+        manifiesto["particiones"][ruta.stem] = len(particion)
+        particion = particion.assign(mes=ruta.stem)
+        niveles_mensual = ["mes", "vehiculo"] + (["tipo_vehiculo"] if "tipo_vehiculo" in particion.columns else [])
+        mensual = sumar_acumulados(mensual, acumular(particion, niveles_mensual))
+        vehiculos = sumar_acumulados(vehiculos, acumular(particion, ["vehiculo"], dropna=True))
+
+    if mensual is not None:
+        guardar_parquet(ruta_mensual(directorio), mensual.reset_index())
+        guardar_parquet(ruta_vehiculos(directorio), vehiculos.reset_index())
+    manifiesto["pendiente"] = False
+    guardar_manifiesto(directorio, manifiesto)
+
+
+# Carga el histórico completo (o los meses entre 'desde' y 'hasta', en formato AAAA-MM) como un único dataframe
+@perfilar()
+def cargar_historico(desde=None, hasta=None, directorio=None):
+    directorio = Path(directorio) if directorio else DIRECTORIO_HISTORICO
+    meses = sorted(leer_manifiesto(directorio)["particiones"])
+    if desde or hasta:
+        meses = [mes for mes in meses if mes != SIN_FECHA and (not desde or mes >= desde) and (not hasta or mes <= hasta)]
+
+    partes = [pd.read_parquet(ruta_particion(directorio, mes)) for mes in meses]
+    if not partes:
+        return pd.DataFrame()
+    return tipar_columnas(pd.concat(partes, ignore_index=True))
+
+
+# Totales por vehículo con el mismo formato que agregados.totales_por_vehiculo, leídos de los acumulados
+def totales_historico(directorio=None):
+    directorio = Path(directorio) if directorio else DIRECTORIO_HISTORICO
+    vehiculos = leer_acumulados(ruta_vehiculos(directorio), ["vehiculo"])
+    if vehiculos is None:
+        return None
+    # Históricos escritos antes de descartar las filas sin matrícula
+    vehiculos = vehiculos[vehiculos.index.notna()]
+    metricas = [metrica for metrica in METRICAS_CUBO if f"{metrica}_suma" in vehiculos.columns]
+    totales = vehiculos[[f"{metrica}_suma" for metrica in metricas]]
+    totales.columns = metricas
+    return totales
+
+
+# Totales mensuales de la flota (una fila por mes) leídos de los acumulados por mes y vehículo
+def mensual_historico(directorio=None):
+    directorio = Path(directorio) if directorio else DIRECTORIO_HISTORICO
+    ruta = ruta_mensual(directorio)
+    if not ruta.exists():
+        return None
+    return pd.read_parquet(ruta).drop(columns=["vehiculo", "tipo_vehiculo"], errors="ignore").groupby("mes").sum()
+
+
+# Resumen del histórico para el panel lateral
+def resumen_historico(directorio=None):
+    manifiesto = leer_manifiesto(directorio)
+    meses = sorted(mes for mes in manifiesto["particiones"] if mes != SIN_FECHA)
+    return {
+        "archivos": len(manifiesto["archivos"]),
+        "filas": sum(manifiesto["particiones"].values()),
+        "meses": len(meses),
+        "desde": meses[0] if meses else None,
+        "hasta": meses[-1] if meses else None
+    }
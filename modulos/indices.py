@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from modulos.perfilado import perfilar
+
+# Métricas que se resumen para cada partición
+METRICAS_RESUMEN = ["repostado", "distancia", "coste"]
+
+
+# Construye el índice de particiones de una columna: para cada valor, las posiciones de sus filas.
+# Las posiciones se guardan juntas en un único array ordenado por valor (y por fila dentro de
+# cada valor), así obtener las filas de un valor es un corte de ese array.
+@perfilar()
+def construir_particiones(df, columna):
+    codigos, valores = pd.factorize(df[columna], sort=True)
+    tipo_posicion = np.int32 if len(df) < np.iinfo(np.int32).max else np.int64
+
+    # Ordenación estable: dentro de cada valor las filas mantienen su orden original
+    orden = np.argsort(codigos, kind="stable").astype(tipo_posicion)
+    limites = np.searchsorted(codigos[orden], np.arange(len(valores) + 1))
+
+    # Resumen por valor (los nulos, con código -1, quedan fuera)
+    validos = codigos >= 0
+    resumen = pd.DataFrame({"repostajes": np.diff(limites)}, index=pd.Index(valores, name=columna))
+    for metrica in METRICAS_RESUMEN:
+        if metrica in df.columns:
+            pesos = np.nan_to_num(df[metrica].to_numpy(dtype="float64")[validos])
+            resumen[metrica] = np.bincount(codigos[validos], weights=pesos, minlength=len(valores))
+
+    return {
+        "columna": columna,
+        "valores": list(valores),
+        "posiciones_valor": {valor: i for i, valor in enumerate(valores)},
+        "orden": orden,
+        "limites": limites,
+        "resumen": resumen
+    }
+
+
+# Posiciones (ordenadas) de las filas con un valor; vacío si el valor no existe
+def posiciones_valor(particiones, valor):
+    i = particiones["posiciones_valor"].get(valor)
+    if i is None:
+        return particiones["orden"][:0]
+    return particiones["orden"][particiones["limites"][i]:particiones["limites"][i + 1]]
+
+
+# Filas del dataframe con un valor, sin recorrer la columna completa
+def filas_valor(df, particiones, valor):
+    return df.iloc[posiciones_valor(particiones, valor)]
+
+
+# Índice de vehículos: particiones por matrícula más el modelo de cada vehículo (el de su primera fila)
+@perfilar()
+def construir_indice_vehiculos(df, columna_modelo="tipo_vehiculo"):
+    indice = construir_particiones(df, "vehiculo")
+
+    indice["modelos"] = {}
+    if columna_modelo in df.columns and indice["valores"]:
+        primeras = indice["orden"][indice["limites"][:-1]]
+        modelos = df[columna_modelo].to_numpy()[primeras]
+        indice["modelos"] = dict(zip(indice["valores"], modelos))
+
+    return indice
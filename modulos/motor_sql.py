@@ -0,0 +1,259 @@
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from modulos.agregados import METRICAS_CUBO, cubo_desde_diario
+from modulos.carga import COLUMNAS_CATEGORICAS, tipar_columnas
+from modulos.filtros import COLUMNAS_FACETAS
+from modulos.indices import METRICAS_RESUMEN
+from modulos.perfilado import perfilar
+
+# DuckDB es opcional: sin él la aplicación trabaja solo en memoria
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+MOTOR_DISPONIBLE = duckdb is not None
+
+
+# Escapa un texto para usarlo como literal de SQL
+def literal(texto):
+    return "'" + str(texto).replace("'", "''") + "'"
+
+
+def identificador(nombre):
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+
+# Consulta los archivos Parquet (por ejemplo, las particiones del histórico) sin cargarlos en memoria.
+# Los filtros del panel lateral se traducen a un WHERE y las agregaciones de los gráficos a GROUP BY,
+# de modo que a la aplicación solo llegan tablas ya agregadas (o las filas de un único vehículo).
+# Los filtros se pasan como un diccionario con las mismas claves que filtros.calcular_mascara.
+class MotorSQL:
+
+    def __init__(self, archivos):
+        if duckdb is None:
+            raise ImportError("El motor en disco necesita el paquete 'duckdb' (pip install duckdb)")
+
+        archivos = [str(Path(archivo)) for archivo in archivos]
+        if not archivos:
+            raise ValueError("No hay archivos Parquet que consultar")
+
+        self.conexion = duckdb.connect(database=":memory:")
+        self.conexion.execute(
+            "CREATE VIEW repostajes AS SELECT * FROM read_parquet("
+            f"[{', '.join(literal(archivo) for archivo in archivos)}], union_by_name = true)"
+        )
+        self.columnas = [fila[0] for fila in self.conexion.execute("DESCRIBE repostajes").fetchall()]
+        self.bloqueo = threading.Lock()
+
+    # Ejecuta una consulta y devuelve un dataframe. Cada consulta usa su propio cursor,
+    # así varias sesiones de Streamlit pueden consultar a la vez.
+    def consultar(self, sql, parametros=()):
+        with self.bloqueo:
+            cursor = self.conexion.cursor()
+        try:
+            return cursor.execute(sql, list(parametros)).df()
+        finally:
+            cursor.close()
+
+    # Traduce los filtros a condiciones SQL con parámetros (mismo criterio que calcular_mascara:
+    # OR dentro de una columna, AND entre columnas y los valores vacíos quedan fuera de los rangos)
+    def condiciones(self, filtros=None, extra=None):
+        filtros = filtros or {}
+        partes, parametros = list(extra or []), []
+
+        criterios = {
+            "tipo_vehiculo": filtros.get("tipos_vehiculo"),
+            "tipo_combustible": filtros.get("tipos_combustible"),
+            "provincia": filtros.get("provincia"),
+            "vehiculo": filtros.get("vehiculos")
+        }
+        for columna, valores in criterios.items():
+            if valores and columna in self.columnas:
+                partes.append(f"{identificador(columna)} IN ({', '.join('?' for _ in valores)})")
+                parametros.extend(str(valor) for valor in valores)
+
+        for columna, (min_valor, max_valor) in (filtros.get("rangos") or {}).items():
+            if columna.lower() in self.columnas:
+                partes.append(f"{identificador(columna.lower())} BETWEEN ? AND ?")
+                parametros.extend([float(min_valor), float(max_valor)])
+
+        fechas = filtros.get("fechas")
+        if fechas and "fecha" in self.columnas:
+            if len(fechas) == 2:
+                partes.append("CAST(fecha AS DATE) BETWEEN ? AND ?")
+                parametros.extend(pd.Timestamp(fecha).date() for fecha in fechas)
+            elif len(fechas) == 1:
+                partes.append("CAST(fecha AS DATE) = ?")
+                parametros.append(pd.Timestamp(fechas[0]).date())
+
+        where = " WHERE " + " AND ".join(partes) if partes else ""
+        return where, parametros
+
+    def contar(self, filtros=None):
+        where, parametros = self.condiciones(filtros)
+        return int(self.consultar(f"SELECT COUNT(*) AS filas FROM repostajes{where}", parametros)["filas"].iloc[0])
+
+    # Tabla de facetas con el mismo formato que filtros.construir_facetas
+    @perfilar("motor.facetas")
+    def facetas(self, filtros=None):
+        columnas = [columna for columna in COLUMNAS_FACETAS if columna in self.columnas]
+        if not columnas:
+            return pd.DataFrame(columns=["filas"])
+        lista = ", ".join(f"CAST({identificador(columna)} AS VARCHAR) AS {identificador(columna)}" for columna in columnas)
+        where, parametros = self.condiciones(filtros)
+        return self.consultar(f"SELECT {lista}, COUNT(*) AS filas FROM repostajes{where} GROUP BY ALL ORDER BY ALL", parametros)
+
+    # Mínimo y máximo de cada columna numérica, para los sliders de rangos
+    @perfilar("motor.rangos")
+    def rangos(self, columnas, filtros=None):
+        columnas = [columna for columna in columnas if columna in self.columnas]
+        if not columnas:
+            return {}
+        expresiones = ", ".join(
+            f"MIN({identificador(c)}) AS {identificador(c + '_min')}, MAX({identificador(c)}) AS {identificador(c + '_max')}"
+            for c in columnas
+        )
+        where, parametros = self.condiciones(filtros)
+        fila = self.consultar(f"SELECT {expresiones} FROM repostajes{where}", parametros).iloc[0]
+        return {c: (fila[f"{c}_min"], fila[f"{c}_max"]) for c in columnas if pd.notna(fila[f"{c}_min"])}
+
+    # Valores distintos (ordenados) de una columna con los filtros aplicados
+    def valores(self, columna, filtros=None):
+        if columna not in self.columnas:
+            return []
+        where, parametros = self.condiciones(filtros, [f"{identificador(columna)} IS NOT NULL"])
+        tabla = self.consultar(f"SELECT DISTINCT {identificador(columna)} AS valor FROM repostajes{where} ORDER BY valor", parametros)
+        return tabla["valor"].astype(str).tolist()
+
+    # Número de repostajes y totales de las métricas por valor de una columna (como indices.construir_particiones)
+    @perfilar("motor.resumen")
+    def resumen(self, columna, filtros=None):
+        metricas = [metrica for metrica in METRICAS_RESUMEN if metrica in self.columnas]
+        sumas = "".join(f", COALESCE(SUM({identificador(m)}), 0) AS {identificador(m)}" for m in metricas)
+        where, parametros = self.condiciones(filtros, [f"{identificador(columna)} IS NOT NULL"])
+        tabla = self.consultar(
+            f"SELECT CAST({identificador(columna)} AS VARCHAR) AS {identificador(columna)}, COUNT(*) AS repostajes{sumas} "
+            f"FROM repostajes{where} GROUP BY 1 ORDER BY 1",
+            parametros
+        )
+        return tabla.set_index(columna)
+
+    # Cubo temporal (ver agregados.construir_cubo) calculado con una sola agregación diaria en el motor
+    @perfilar("motor.cubo")
+    def cubo(self, filtros=None):
+        if "fecha" not in self.columnas or "vehiculo" not in self.columnas:
+            return None
+
+        metricas = [metrica for metrica in METRICAS_CUBO if metrica in self.columnas]
+        columna_modelo = "tipo_vehiculo" if "tipo_vehiculo" in self.columnas else None
+        claves = ["vehiculo"] + ([columna_modelo] if columna_modelo else [])
+
+        seleccion = [f"CAST({identificador(c)} AS VARCHAR) AS {identificador(c)}" for c in claves]
+        seleccion.append("CAST(date_trunc('day', fecha) AS TIMESTAMP) AS fecha")
+        seleccion += [f"COALESCE(SUM({identificador(m)}), 0) AS {identificador(m + '_suma')}" for m in metricas]
+        seleccion += [f"COUNT({identificador(m)}) AS {identificador(m + '_n')}" for m in metricas]
+        seleccion.append("COUNT(*) AS repostajes")
+
+        where, parametros = self.condiciones(filtros, ["fecha IS NOT NULL"])
+        diario = self.consultar(
+            f"SELECT {', '.join(seleccion)} FROM repostajes{where} GROUP BY ALL",
+            parametros
+        )
+        if diario.empty:
+            return None
+
+        # Mismos tipos y orden que la agrupación de pandas
+        for columna in claves:
+            diario[columna] = diario[columna].astype("category")
+        diario["fecha"] = pd.to_datetime(diario["fecha"])
+        for m in metricas:
+            diario[f"{m}_n"] = diario[f"{m}_n"].astype("int64")
+        diario["repostajes"] = diario["repostajes"].astype("int64")
+        diario = diario.set_index(claves + ["fecha"]).sort_index()
+
+        # Modelo de cada vehículo: el de su repostaje más antiguo
+        modelos = {}
+        if columna_modelo:
+            where_modelo, parametros_modelo = self.condiciones(filtros, ["vehiculo IS NOT NULL"])
+            tabla = self.consultar(
+                f"SELECT CAST(vehiculo AS VARCHAR) AS vehiculo, CAST(arg_min({identificador(columna_modelo)}, fecha) AS VARCHAR) AS modelo "
+                f"FROM repostajes{where_modelo} GROUP BY 1",
+                parametros_modelo
+            )
+            modelos = dict(zip(tabla["vehiculo"], tabla["modelo"]))
+
+        return cubo_desde_diario(diario, metricas, columna_modelo, modelos)
+
+    # Totales por vehículo con el formato de agregados.totales_por_vehiculo
+    @perfilar("motor.totales_vehiculo")
+    def totales_vehiculo(self, filtros=None):
+        metricas = [metrica for metrica in METRICAS_CUBO if metrica in self.columnas]
+        sumas = "".join(f", COALESCE(SUM({identificador(m)}), 0) AS {identificador(m)}" for m in metricas)
+        where, parametros = self.condiciones(filtros, ["vehiculo IS NOT NULL"])
+        tabla = self.consultar(
+            f"SELECT CAST(vehiculo AS VARCHAR) AS vehiculo{sumas} FROM repostajes{where} GROUP BY 1 ORDER BY 1",
+            parametros
+        )
+        return tabla.set_index("vehiculo")
+
+    # Total de litros (o número de repostajes) por valor de una columna, para el gráfico de tarta
+    @perfilar("motor.distribucion")
+    def distribucion(self, columna, filtros=None):
+        if columna not in self.columnas:
+            return None
+        valor = 'SUM("repostado")' if "repostado" in self.columnas else "COUNT(*)"
+        where, parametros = self.condiciones(filtros, [f"{identificador(columna)} IS NOT NULL"])
+        tabla = self.consultar(
+            f"SELECT CAST({identificador(columna)} AS VARCHAR) AS clave, COALESCE({valor}, 0) AS valor "
+            f"FROM repostajes{where} GROUP BY 1 ORDER BY 1",
+            parametros
+        )
+        return tabla.set_index("clave")["valor"]
+
+    # Rejilla de coordenadas con las mismas columnas que graficos.agregar_rejilla
+    @perfilar("motor.rejilla")
+    def rejilla(self, tamano_celda, filtros=None):
+        if "latitud" not in self.columnas or "longitud" not in self.columnas:
+            return None
+        litros = 'COALESCE(SUM("repostado"), 0)' if "repostado" in self.columnas else "0"
+        coste = 'COALESCE(SUM("coste"), 0)' if "coste" in self.columnas else "0"
+        where, parametros = self.condiciones(filtros, ["latitud IS NOT NULL", "longitud IS NOT NULL", "NOT isnan(latitud)", "NOT isnan(longitud)"])
+        celdas = self.consultar(
+            f"SELECT CAST(floor(latitud / ?) AS BIGINT) AS fila, CAST(floor(longitud / ?) AS BIGINT) AS columna, "
+            f"COUNT(*) AS visitas, {litros} AS litros, {coste} AS coste "
+            f"FROM repostajes{where} GROUP BY 1, 2 ORDER BY 1, 2",
+            [float(tamano_celda), float(tamano_celda)] + parametros
+        )
+        return pd.DataFrame({
+            "lat_min": celdas["fila"].to_numpy(dtype="float64") * tamano_celda,
+            "lon_min": celdas["columna"].to_numpy(dtype="float64") * tamano_celda,
+            "visitas": celdas["visitas"].to_numpy(dtype=np.int64),
+            "litros": celdas["litros"].to_numpy(dtype="float64"),
+            "coste": celdas["coste"].to_numpy(dtype="float64")
+        })
+
+    # Filas de un vehículo (pocas), ya tipadas, para los gráficos y el mapa de detalle
+    @perfilar("motor.filas_vehiculo")
+    def filas_vehiculo(self, vehiculo, filtros=None):
+        where, parametros = self.condiciones({**(filtros or {}), "vehiculos": [vehiculo]})
+        df = self.consultar(f"SELECT * FROM repostajes{where} ORDER BY fecha", parametros)
+        for columna in COLUMNAS_CATEGORICAS:
+            if columna in df.columns:
+                df[columna] = df[columna].astype("string").astype(object)
+        return tipar_columnas(df)
+
+    def cerrar(self):
+        self.conexion.close()
+
+
+# Motor sobre las particiones del histórico de la flota (modulos.historico)
+def motor_historico(directorio=None):
+    from modulos.historico import DIRECTORIO_HISTORICO
+
+    directorio = Path(directorio) if directorio else DIRECTORIO_HISTORICO
+    return MotorSQL(sorted((directorio / "particiones").glob("*.parquet")))
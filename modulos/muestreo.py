@@ -0,0 +1,76 @@
+import numpy as np
+
+# Número máximo de puntos por serie que se envían al navegador en los gráficos de líneas
+MAX_PUNTOS_LINEA = 2000
+
+# Número de puntos a partir del cual las trazas se dibujan con WebGL (Scattergl)
+UMBRAL_WEBGL = 1500
+
+
+# Convierte fechas u otros valores del eje x a números para poder medir áreas
+def eje_numerico(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[ns]").astype("int64").astype("float64")
+    return x.astype("float64")
+
+
+# Largest-Triangle-Three-Buckets: elige en cada tramo el punto que forma el triángulo de mayor
+# área con el punto elegido antes y la media del tramo siguiente. Conserva picos y forma.
+# Devuelve las posiciones de los puntos que se conservan (siempre el primero y el último).
+def indices_lttb(x, y, max_puntos):
+    total = len(y)
+    if max_puntos >= total or max_puntos < 3:
+        return np.arange(total)
+
+    x = eje_numerico(x)
+    y = np.asarray(y, dtype="float64")
+
+    # Límites de los tramos intermedios (el primer y el último punto van solos)
+    limites = np.linspace(1, total - 1, max_puntos - 1).astype(np.intp)
+    seleccion = np.empty(max_puntos, dtype=np.intp)
+    seleccion[0] = 0
+    seleccion[-1] = total - 1
+
+    anterior = 0
+    for i in range(max_puntos - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        siguiente_inicio, siguiente_fin = limites[i + 1], (limites[i + 2] if i + 2 < len(limites) else total)
+        media_x = x[siguiente_inicio:siguiente_fin].mean()
+        media_y = y[siguiente_inicio:siguiente_fin].mean()
+
+        areas = np.abs(
+            (x[anterior] - media_x) * (y[inicio:fin] - y[anterior])
+            - (x[anterior] - x[inicio:fin]) * (media_y - y[anterior])
+        )
+        anterior = inicio + int(np.argmax(areas)) if len(areas) else inicio
+        seleccion[i + 1] = anterior
+
+    return seleccion
+
+
+# Min-max: conserva el mínimo y el máximo de cada tramo, útil para series con mucho ruido
+def indices_minmax(y, max_puntos):
+    total = len(y)
+    if max_puntos >= total or max_puntos < 4:
+        return np.arange(total)
+
+    y = np.asarray(y, dtype="float64")
+    tramos = max_puntos // 2
+    limites = np.linspace(0, total, tramos + 1).astype(np.intp)
+    seleccion = []
+    for inicio, fin in zip(limites[:-1], limites[1:]):
+        if fin <= inicio:
+            continue
+        tramo = y[inicio:fin]
+        seleccion.append(inicio + int(np.argmin(tramo)))
+        seleccion.append(inicio + int(np.argmax(tramo)))
+
+    return np.unique(seleccion)
+
+
+# Posiciones a conservar de una serie ordenada por x según el método elegido ("lttb" o "minmax")
+def reducir_serie(x, y, max_puntos=MAX_PUNTOS_LINEA, metodo="lttb"):
+    if metodo == "minmax":
+        return indices_minmax(y, max_puntos)
+    return indices_lttb(x, y, max_puntos)
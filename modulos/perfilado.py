@@ -0,0 +1,253 @@
+import contextvars
+import functools
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from modulos.cache_figuras import estimar_tamano
+
+# Activa el perfilado desde el arranque (REPOSTAJES_PERFILADO=1); también se puede activar en el panel lateral
+PERFILADO_INICIAL = os.environ.get("REPOSTAJES_PERFILADO", "0") == "1"
+
+# Carpeta donde se guardan las medidas (se puede cambiar con REPOSTAJES_PERFILADO_DIR)
+DIRECTORIO_PERFILADO = Path(os.environ.get("REPOSTAJES_PERFILADO_DIR", Path.home() / ".cache" / "repostajes" / "perfilado"))
+
+# Una línea JSON por ejecución del script con todas sus etapas
+NOMBRE_JSONL = "ejecuciones.jsonl"
+
+# Contadores acumulados por etapa en formato de texto de Prometheus (node_exporter textfile collector)
+NOMBRE_PROMETHEUS = "repostajes.prom"
+
+# Una línea JSON por arranque del servidor con los tiempos de importación y de la primera pintura
+NOMBRE_ARRANQUE = "arranque.jsonl"
+
+# Registro de la ejecución en curso; None cuando el perfilado está desactivado.
+# Al ser una variable de contexto, cada sesión de Streamlit (un hilo por ejecución) tiene el suyo.
+REGISTRO_ACTUAL = contextvars.ContextVar("registro_perfilado", default=None)
+
+# Acumulados del proceso para el archivo de Prometheus: etapa -> llamadas, segundos, filas y bytes
+ACUMULADOS = {}
+BLOQUEO_ACUMULADOS = threading.Lock()
+
+# Tiempos de arranque del proceso: importaciones diferidas y el informe de la primera pintura
+ARRANQUE = {"importaciones": {}, "informe": None}
+BLOQUEO_ARRANQUE = threading.Lock()
+
+
+# Empieza a registrar las etapas de una ejecución.
+# Con 'activo' a False se descarta cualquier registro anterior que no llegara a cerrarse (p. ej. por st.rerun).
+def iniciar_registro(activo=True):
+    registro = {"inicio": time.perf_counter(), "marca": time.time(), "etapas": [], "nivel": 0} if activo else None
+    REGISTRO_ACTUAL.set(registro)
+    return registro
+
+
+def perfilado_activo():
+    return REGISTRO_ACTUAL.get() is not None
+
+
+# Número de filas de un dataframe (o serie); None para cualquier otro objeto
+def contar_filas(objeto):
+    if isinstance(objeto, (pd.DataFrame, pd.Series)):
+        return len(objeto)
+    return None
+
+
+# Bytes que se envían al navegador para mostrar un objeto: JSON de las figuras de Plotly,
+# HTML de los mapas de Folium y tamaño en memoria para el resto (dataframes)
+def tamano_envio(objeto):
+    if objeto is None:
+        return 0
+    if hasattr(objeto, "to_plotly_json"):
+        return len(objeto.to_json())
+    if hasattr(objeto, "get_root"):
+        return len(objeto.get_root().render())
+    return estimar_tamano(objeto)
+
+
+# Mide una etapa. Devuelve un diccionario en el que se pueden añadir 'filas_salida' y 'bytes'.
+# Sin registro activo solo cuesta una consulta a la variable de contexto.
+@contextmanager
+def medir(etapa, filas_entrada=None):
+    registro = REGISTRO_ACTUAL.get()
+    medida = {"etapa": etapa, "filas_entrada": filas_entrada, "filas_salida": None, "bytes": None}
+    if registro is None:
+        yield medida
+        return
+
+    # Se añade al empezar para que las etapas queden en el orden en que se ejecutan
+    medida["nivel"] = registro["nivel"]
+    medida["segundos"] = 0.0
+    registro["etapas"].append(medida)
+    registro["nivel"] += 1
+    inicio = time.perf_counter()
+    try:
+        yield medida
+    finally:
+        medida["segundos"] = time.perf_counter() - inicio
+        registro["nivel"] -= 1
+
+
+# Decorador para las funciones de 'modulos': mide la llamada y cuenta las filas del primer
+# argumento y del resultado cuando son dataframes
+def perfilar(etapa=None):
+    def decorador(funcion):
+        nombre = etapa or funcion.__name__
+
+        @functools.wraps(funcion)
+        def envoltorio(*args, **kwargs):
+            if REGISTRO_ACTUAL.get() is None:
+                return funcion(*args, **kwargs)
+            with medir(nombre, contar_filas(args[0]) if args else None) as medida:
+                resultado = funcion(*args, **kwargs)
+                medida["filas_salida"] = contar_filas(resultado)
+            return resultado
+
+        return envoltorio
+    return decorador
+
+
+# Cierra el registro de la ejecución: añade el total, lo escribe en disco y lo devuelve
+def finalizar_registro(registro, sesion=None, directorio=None):
+    REGISTRO_ACTUAL.set(None)
+    if registro is None:
+        return None
+
+    registro["total_segundos"] = time.perf_counter() - registro["inicio"]
+
+    try:
+        guardar_registro(registro, sesion, Path(directorio) if directorio else DIRECTORIO_PERFILADO)
+    except OSError:
+        # Un disco lleno o de solo lectura no debe romper la aplicación
+        pass
+    return registro
+
+
+# Añade la ejecución al archivo JSON-lines y reescribe los contadores de Prometheus
+def guardar_registro(registro, sesion, directorio):
+    directorio.mkdir(parents=True, exist_ok=True)
+
+    linea = {
+        "marca": registro["marca"],
+        "sesion": sesion,
+        "total_segundos": round(registro["total_segundos"], 6),
+        "etapas": [
+            {clave: (round(valor, 6) if clave == "segundos" else valor) for clave, valor in medida.items()}
+            for medida in registro["etapas"]
+        ]
+    }
+    with open(directorio / NOMBRE_JSONL, "a", encoding="utf-8") as archivo:
+        archivo.write(json.dumps(linea, ensure_ascii=False, default=str) + "\n")
+
+    with BLOQUEO_ACUMULADOS:
+        for medida in registro["etapas"] + [{"etapa": "ejecucion", "segundos": registro["total_segundos"]}]:
+            acumulado = ACUMULADOS.setdefault(medida["etapa"], {"llamadas": 0, "segundos": 0.0, "filas": 0, "bytes": 0})
+            acumulado["llamadas"] += 1
+            acumulado["segundos"] += medida["segundos"]
+            acumulado["filas"] += medida.get("filas_entrada") or 0
+            acumulado["bytes"] += medida.get("bytes") or 0
+        texto = texto_prometheus(ACUMULADOS)
+
+    ruta = directorio / NOMBRE_PROMETHEUS
+    temporal = ruta.with_suffix(f".{os.getpid()}.tmp")
+    temporal.write_text(texto, encoding="utf-8")
+    os.replace(temporal, ruta)
+
+
+# Formato de texto de Prometheus con un contador por etapa y magnitud
+def texto_prometheus(acumulados):
+    metricas = [
+        ("repostajes_etapa_llamadas_total", "llamadas", "Número de veces que se ha ejecutado la etapa"),
+        ("repostajes_etapa_segundos_total", "segundos", "Tiempo total de la etapa en segundos"),
+        ("repostajes_etapa_filas_total", "filas", "Filas de entrada procesadas por la etapa"),
+        ("repostajes_etapa_bytes_total", "bytes", "Bytes enviados al navegador por la etapa")
+    ]
+    lineas = []
+    for nombre, clave, ayuda in metricas:
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} counter")
+        for etapa, acumulado in sorted(acumulados.items()):
+            etiqueta = etapa.replace("\\", "\\\\").replace('"', '\\"')
+            lineas.append(f'{nombre}{{etapa="{etiqueta}"}} {acumulado[clave]}')
+    return "\n".join(lineas) + "\n"
+
+
+# Tabla con las etapas de una ejecución para el panel de depuración
+def tabla_etapas(registro):
+    filas = [
+        {
+            "Etapa": "  " * medida.get("nivel", 0) + medida["etapa"],
+            "ms": medida["segundos"] * 1000,
+            "Filas entrada": medida.get("filas_entrada"),
+            "Filas salida": medida.get("filas_salida"),
+            "KB enviados": medida["bytes"] / 1024 if medida.get("bytes") is not None else None
+        }
+        for medida in registro["etapas"]
+    ]
+    return pd.DataFrame(filas, columns=["Etapa", "ms", "Filas entrada", "Filas salida", "KB enviados"])
+
+
+# Importa un módulo la primera vez que se necesita y anota cuánto tardó
+def importar(nombre):
+    modulo = sys.modules.get(nombre)
+    if modulo is not None:
+        return modulo
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nombre)
+    with BLOQUEO_ARRANQUE:
+        ARRANQUE["importaciones"].setdefault(nombre, time.perf_counter() - inicio)
+    return modulo
+
+
+def registrar_importacion(nombre, segundos):
+    with BLOQUEO_ARRANQUE:
+        ARRANQUE["importaciones"].setdefault(nombre, segundos)
+
+
+# Informe de arranque, generado una sola vez por proceso al terminar la primera ejecución del script.
+# El lanzador deja en REPOSTAJES_ARRANQUE (JSON) el instante de inicio y sus propios tiempos.
+# Se añade a arranque.jsonl y se muestra en el panel de perfilado, como el resto de medidas.
+def registrar_primera_pintura(directorio=None):
+    with BLOQUEO_ARRANQUE:
+        if ARRANQUE["informe"] is not None:
+            return ARRANQUE["informe"]
+
+        try:
+            lanzador = json.loads(os.environ.get("REPOSTAJES_ARRANQUE", "{}"))
+        except ValueError:
+            lanzador = {}
+        inicio = lanzador.get("inicio")
+
+        informe = {
+            "marca": time.time(),
+            "empaquetado": bool(getattr(sys, "frozen", False)),
+            "importaciones": {**lanzador.get("importaciones", {}), **ARRANQUE["importaciones"]},
+            "servidor_listo": lanzador.get("servidor_listo"),
+            "primera_pintura": time.time() - inicio if inicio else None
+        }
+        ARRANQUE["informe"] = informe
+
+    try:
+        directorio = Path(directorio) if directorio else DIRECTORIO_PERFILADO
+        directorio.mkdir(parents=True, exist_ok=True)
+        with open(directorio / NOMBRE_ARRANQUE, "a", encoding="utf-8") as archivo:
+            archivo.write(json.dumps(informe, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+    return informe
+
+
+# Tabla de tiempos de importación para el panel de depuración
+def tabla_importaciones(importaciones):
+    return pd.DataFrame(
+        [{"Módulo": nombre, "ms": segundos * 1000} for nombre, segundos in importaciones.items()],
+        columns=["Módulo", "ms"]
+    )
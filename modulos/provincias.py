@@ -0,0 +1,104 @@
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Nombre canónico de cada provincia y las variantes con las que puede aparecer
+PROVINCIAS = {
+    "A Coruña": ["la coruña", "coruña", "la coruna", "coruna"],
+    "Álava": ["araba", "araba/alava", "alava/araba"],
+    "Albacete": [],
+    "Alicante": ["alacant", "alicante/alacant"],
+    "Almería": [],
+    "Asturias": ["principado de asturias", "oviedo"],
+    "Ávila": [],
+    "Badajoz": [],
+    "Barcelona": [],
+    "Bizkaia": ["vizcaya", "bilbao"],
+    "Burgos": [],
+    "Cáceres": [],
+    "Cádiz": [],
+    "Cantabria": ["santander"],
+    "Castellón": ["castello", "castello de la plana", "castellon de la plana"],
+    "Ceuta": [],
+    "Ciudad Real": [],
+    "Córdoba": [],
+    "Cuenca": [],
+    "Gipuzkoa": ["guipuzcoa", "guipuzkoa"],
+    "Girona": ["gerona"],
+    "Granada": [],
+    "Guadalajara": [],
+    "Huelva": [],
+    "Huesca": [],
+    "Illes Balears": ["baleares", "islas baleares", "balears", "palma", "palma de mallorca"],
+    "Jaén": [],
+    "La Rioja": ["rioja", "logroño"],
+    "Las Palmas": ["palmas", "las palmas de gran canaria", "gran canaria"],
+    "León": [],
+    "Lleida": ["lerida"],
+    "Lugo": [],
+    "Madrid": ["comunidad de madrid"],
+    "Málaga": [],
+    "Melilla": [],
+    "Murcia": ["region de murcia"],
+    "Navarra": ["nafarroa", "pamplona", "comunidad foral de navarra"],
+    "Ourense": ["orense"],
+    "Palencia": [],
+    "Pontevedra": [],
+    "Salamanca": [],
+    "Santa Cruz de Tenerife": ["tenerife", "sta. cruz de tenerife", "s.c. tenerife"],
+    "Segovia": [],
+    "Sevilla": [],
+    "Soria": [],
+    "Tarragona": [],
+    "Teruel": [],
+    "Toledo": [],
+    "Valencia": ["valència"],
+    "Valladolid": [],
+    "Zamora": [],
+    "Zaragoza": [],
+}
+
+
+# Pasa un texto a minúsculas, sin tildes y sin espacios sobrantes para poder compararlo
+def clave_provincia(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).strip().lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split())
+
+
+# Tabla de búsqueda: clave normalizada -> nombre canónico
+TABLA_PROVINCIAS = {}
+for canonico, variantes in PROVINCIAS.items():
+    for variante in [canonico] + variantes:
+        TABLA_PROVINCIAS[clave_provincia(variante)] = canonico
+
+
+# Devuelve el nombre canónico de una provincia.
+# Los valores que no están en la tabla se devuelven limpios y con mayúscula inicial.
+@lru_cache(maxsize=4096)
+def normalizar_provincia(texto):
+    clave = clave_provincia(texto)
+    if not clave:
+        return None
+    return TABLA_PROVINCIAS.get(clave, " ".join(str(texto).split()).title())
+
+
+# Normaliza una serie de provincias consultando cada valor distinto una sola vez
+def normalizar_serie_provincias(serie):
+    codigos, unicos = pd.factorize(serie)
+    canonicos = np.array([normalizar_provincia(valor) for valor in unicos] + [None], dtype=object)
+
+    # El código -1 (valores nulos) apunta al None añadido al final
+    return pd.Series(canonicos[codigos], index=serie.index, name="provincia", dtype=object)
+
+
+# Extrae la provincia de la dirección (el texto tras la primera coma) y la normaliza
+def extraer_provincia(direcciones):
+    direcciones = direcciones.astype("string")
+    provincia = direcciones.str.extract(r"^[^,]*,([^,]*)", expand=False)
+
+    # Si la dirección no tiene comas se usa la dirección completa
+    provincia = provincia.fillna(direcciones).str.strip()
+    return normalizar_serie_provincias(provincia)
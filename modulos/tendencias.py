@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+from modulos.perfilado import perfilar
+
+# Número de repostajes de la ventana de la mediana móvil
+VENTANA_MEDIANA = 7
+
+# Factor de suavizado de la media exponencial (más alto = sigue más de cerca los datos)
+ALFA_EXPONENCIAL = 0.3
+
+# Mínimo de puntos para ajustar una recta de tendencia
+MIN_PUNTOS_RECTA = 3
+
+
+# Calcula las tendencias de una métrica para todos los vehículos en una sola pasada.
+# Ordena una vez por (vehículo, fecha) y devuelve, para cada repostaje, la recta de mínimos
+# cuadrados de su vehículo, la mediana móvil y la media exponencial, más la pendiente por vehículo.
+@perfilar()
+def calcular_tendencias(df, col_fecha="fecha", col_valor="consumo", ventana=VENTANA_MEDIANA, alfa=ALFA_EXPONENCIAL):
+    if df is None or col_fecha not in df.columns or col_valor not in df.columns:
+        return None
+
+    # Las filas sin matrícula, fecha o valor no pertenecen a ninguna serie: se descartan antes de agrupar
+    columnas = [col_fecha, col_valor] + (["vehiculo"] if "vehiculo" in df.columns else [])
+    datos = df[columnas].dropna()
+    if "vehiculo" not in datos.columns:
+        datos = datos.assign(vehiculo="")
+    datos = datos.sort_values(["vehiculo", col_fecha], kind="stable").reset_index(drop=True)
+
+    # Código de grupo consecutivo por vehículo e inicio de cada grupo en el array ordenado
+    grupo, vehiculos = pd.factorize(datos["vehiculo"], sort=True)
+    inicios = np.flatnonzero(np.r_[True, grupo[1:] != grupo[:-1]]) if len(grupo) else np.array([], dtype=np.intp)
+    tamanos = np.diff(np.r_[inicios, len(grupo)])
+
+    # Mínimos cuadrados por vehículo con sumas por tramos (x en días)
+    x = datos[col_fecha].to_numpy().astype("datetime64[s]").astype("float64") / 86400.0
+    y = datos[col_valor].to_numpy(dtype="float64")
+
+    media_x = np.add.reduceat(x, inicios) / tamanos if len(inicios) else np.array([])
+    media_y = np.add.reduceat(y, inicios) / tamanos if len(inicios) else np.array([])
+    dx = x - media_x[grupo]
+    dy = y - media_y[grupo]
+    sxx = np.add.reduceat(dx * dx, inicios) if len(inicios) else np.array([])
+    sxy = np.add.reduceat(dx * dy, inicios) if len(inicios) else np.array([])
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pendiente = np.where((tamanos >= MIN_PUNTOS_RECTA) & (sxx > 0), sxy / sxx, np.nan)
+
+    por_grupo = datos.groupby(grupo, sort=False)[col_valor]
+    datos["tendencia_ols"] = media_y[grupo] + pendiente[grupo] * dx
+    datos["mediana_movil"] = por_grupo.rolling(ventana, min_periods=1, center=True).median().reset_index(level=0, drop=True)
+    datos["media_exponencial"] = por_grupo.ewm(alpha=alfa).mean().reset_index(level=0, drop=True)
+
+    coeficientes = pd.DataFrame({
+        "vehiculo": vehiculos,
+        "inicio": inicios,
+        "fin": inicios + tamanos,
+        "puntos": tamanos,
+        "pendiente_dia": pendiente
+    }).set_index("vehiculo")
+
+    return {"puntos": datos, "coeficientes": coeficientes, "col_fecha": col_fecha, "col_valor": col_valor}
+
+
+# Devuelve las tendencias ya calculadas de un vehículo (un corte del array ordenado)
+def tendencias_vehiculo(tendencias, vehiculo):
+    if tendencias is None or vehiculo not in tendencias["coeficientes"].index:
+        return None
+
+    limites = tendencias["coeficientes"].loc[vehiculo]
+    return tendencias["puntos"].iloc[int(limites["inicio"]):int(limites["fin"])]
@@ -1,6 +1,8 @@
 import streamlit as st
 import random
 
+from modulos.cache_figuras import estimar_tamano
+
 def set_animated_background():
 
     fondo_css = """
@@ -127,3 +129,8 @@ def set_star_background():
 
     css = get_star_css()
     st.markdown(css, unsafe_allow_html=True)
+
+
+# Memoria aproximada (bytes) que ocupa el estado de la sesión actual
+def memoria_sesion():
+    return sum(estimar_tamano(valor) for valor in st.session_state.to_dict().values())
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.generador import generar_flota
+
+
+# Flota sintética pequeña, la misma en todas las pruebas
+@pytest.fixture
+def flota():
+    return generar_flota(num_vehiculos=40, num_repostajes=3000, dias=400, semilla=7)
+
+
+# La misma flota con huecos: filas sin matrícula, sin fecha, sin modelo y sin métricas,
+# como las que deja tipar_columnas al leer celdas vacías
+@pytest.fixture
+def flota_con_huecos(flota):
+    df = flota.copy()
+    aleatorio = np.random.default_rng(3)
+    for columna in ["vehiculo", "fecha", "tipo_vehiculo", "provincia", "repostado", "distancia", "consumo"]:
+        filas = aleatorio.choice(len(df), 5, replace=False)
+        df.loc[filas, columna] = pd.NA if isinstance(df[columna].dtype, pd.CategoricalDtype) else np.nan
+    return df
@@ -0,0 +1,142 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from modulos.agregados import (
+    FRECUENCIAS,
+    construir_cubo,
+    media_mensual_modelo,
+    posiciones_top,
+    reducir_cubo,
+    serie_temporal,
+    totales_dia_semana,
+    totales_por_vehiculo
+)
+from modulos.filtros import aplicar_filtros
+
+
+# Suma de una métrica por periodo agrupando las filas, como hacían los gráficos antes del cubo
+def serie_pandas(df, metrica, periodo):
+    return df.dropna(subset=["fecha"]).groupby(pd.Grouper(key="fecha", freq=FRECUENCIAS[periodo]))[metrica].sum()
+
+
+def comparar_series(obtenida, esperada):
+    pd.testing.assert_series_equal(obtenida, esperada, check_names=False, check_freq=False, check_index_type=False)
+
+
+@pytest.mark.parametrize("periodo", ["W", "M", "Y"])
+@pytest.mark.parametrize("datos", ["flota", "flota_con_huecos"])
+def test_serie_de_la_flota(request, datos, periodo):
+    df = request.getfixturevalue(datos)
+    cubo = construir_cubo(df)
+    for metrica in cubo["metricas"]:
+        comparar_series(serie_temporal(cubo, metrica, periodo), serie_pandas(df, metrica, periodo))
+
+
+@pytest.mark.parametrize("periodo", ["W", "M", "Y"])
+def test_serie_de_un_vehiculo(flota_con_huecos, periodo):
+    df = flota_con_huecos
+    cubo = construir_cubo(df)
+    for vehiculo in df["vehiculo"].cat.categories[:5]:
+        del_vehiculo = df[df["vehiculo"] == vehiculo]
+        comparar_series(serie_temporal(cubo, "repostado", periodo, vehiculo), serie_pandas(del_vehiculo, "repostado", periodo))
+
+    assert serie_temporal(cubo, "repostado", "M", "NO-EXISTE").empty
+
+
+def test_dia_de_la_semana(flota_con_huecos):
+    df = flota_con_huecos
+    cubo = construir_cubo(df)
+    validas = df.dropna(subset=["fecha"])
+    dias = validas["fecha"].dt.dayofweek.rename("dia_index")
+
+    comparar_series(totales_dia_semana(cubo, "repostado"), validas.groupby(dias)["repostado"].sum())
+    comparar_series(totales_dia_semana(cubo), validas.groupby(dias).size())
+
+
+def test_media_mensual_del_modelo(flota):
+    cubo = construir_cubo(flota)
+    # Suma mensual de cada vehículo del modelo y media entre vehículos, mes a mes
+    del_modelo = flota[flota["tipo_vehiculo"] == "Furgoneta"]
+    esperada = (
+        del_modelo.groupby(["vehiculo", pd.Grouper(key="fecha", freq="MS")], observed=True)["consumo"].sum()
+        .groupby(level="fecha").mean()
+    )
+    comparar_series(media_mensual_modelo(cubo, "Furgoneta", "consumo"), esperada)
+    assert media_mensual_modelo(cubo, "Modelo inexistente", "consumo").empty
+
+
+def test_totales_y_modelos(flota):
+    cubo = construir_cubo(flota)
+    diario = cubo["periodos"]["D"]
+    totales = diario.groupby(level="vehiculo", observed=True)[["repostado_suma", "consumo_n", "repostajes"]].sum()
+    esperado = flota.groupby("vehiculo", observed=True).agg(
+        repostado_suma=("repostado", "sum"), consumo_n=("consumo", "count"), repostajes=("fecha", "size")
+    )
+    pd.testing.assert_frame_equal(totales, esperado, check_dtype=False)
+
+    primeras = flota.drop_duplicates("vehiculo")
+    assert cubo["modelos"] == dict(zip(primeras["vehiculo"], primeras["tipo_vehiculo"]))
+
+
+def test_sin_datos(flota):
+    assert construir_cubo(None) is None
+    assert construir_cubo(flota.drop(columns="fecha")) is None
+    assert totales_por_vehiculo(flota.iloc[:0]).empty
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, 20, 100])
+def test_posiciones_top_como_nlargest(n):
+    # Valores con muchos empates para comprobar también el desempate
+    valores = pd.Series(np.random.default_rng(n).integers(0, 10, 50).astype("float64"))
+    np.testing.assert_array_equal(posiciones_top(valores.to_numpy(), n), valores.nlargest(n).index.to_numpy())
+
+
+# Combinaciones de filtros laterales que se pueden resolver reduciendo el cubo
+CASOS_REDUCCION = [
+    {},
+    {"tipos_vehiculo": ["Turismo"]},
+    {"tipos_combustible": ["Diésel", "GLP"], "provincia": ["Madrid", "Sevilla", "Valencia"]},
+    {"provincia": ["Provincia inexistente"]},
+    {"fechas": (datetime.date(2022, 3, 1), datetime.date(2022, 6, 30))},
+    {"fechas": (datetime.date(2022, 5, 10),)},
+]
+
+
+@pytest.mark.parametrize("filtros", CASOS_REDUCCION)
+@pytest.mark.parametrize("datos", ["flota", "flota_con_huecos"])
+@pytest.mark.parametrize("rangos_completos", [False, True])
+def test_reducir_cubo_igual_que_filtrar_filas(request, datos, filtros, rangos_completos):
+    df = request.getfixturevalue(datos)
+    if rangos_completos:
+        # Rangos que abarcan todos los valores: solo quitan las filas sin valor
+        filtros = {**filtros, "rangos": {m: (df[m].min(), df[m].max()) for m in ["repostado", "distancia", "consumo"]}}
+
+    reducido = reducir_cubo(construir_cubo(df, filtrable=True), **filtros)
+    esperado = construir_cubo(aplicar_filtros(df, **filtros))
+
+    for periodo in ["D", "W", "M", "Y"]:
+        pd.testing.assert_frame_equal(reducido["periodos"][periodo], esperado["periodos"][periodo], check_index_type=False)
+        pd.testing.assert_frame_equal(reducido["flota"][periodo], esperado["flota"][periodo], check_freq=False)
+    assert {v: m for v, m in reducido["modelos"].items() if pd.notna(v)} == {
+        v: m for v, m in esperado["modelos"].items() if pd.notna(v) and (reducido["periodos"]["D"].index.get_level_values("vehiculo") == v).any()
+    }
+
+
+def test_reducir_cubo_con_rango_parcial_pide_las_filas(flota):
+    cubo = construir_cubo(flota, filtrable=True)
+    assert reducir_cubo(cubo, rangos={"repostado": (20.0, 60.0)}) is None
+    assert reducir_cubo(cubo, rangos={"coste": (0.0, 1.0)}) is None
+
+
+@pytest.mark.parametrize("n", [0, 1, 2, 4, 5, 6, 10])
+@pytest.mark.parametrize("valores", [
+    [3, np.nan, 5, 1, np.nan, 4],
+    [np.nan, np.nan, np.nan],
+    [np.inf, np.nan, -np.inf, 1, 1, np.nan, -np.inf],
+])
+def test_posiciones_top_con_nan(valores, n):
+    serie = pd.Series(valores, dtype="float64")
+    np.testing.assert_array_equal(posiciones_top(serie.to_numpy(), n), serie.nlargest(n).index.to_numpy())
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from modulos.almacen import RegistroDatos
+from modulos.cache_figuras import CacheFiguras, estimar_tamano
+
+
+def test_expulsa_el_menos_usado_y_avisa(flota):
+    tamano = estimar_tamano(flota)
+    registro = RegistroDatos(presupuesto_bytes=int(tamano * 2.5))
+    expulsadas = []
+    registro.al_expulsar.append(expulsadas.append)
+
+    for huella in ["a", "b"]:
+        registro.obtener(huella, lambda: flota.copy())
+    registro.obtener("a", lambda: None)
+    registro.obtener("c", lambda: flota.copy())
+
+    assert expulsadas == ["b"]
+    estadisticas = registro.estadisticas()
+    assert estadisticas["conjuntos"] == 2
+    assert estadisticas["bytes_residentes"] <= registro.presupuesto_bytes
+    assert (estadisticas["aciertos"], estadisticas["fallos"], estadisticas["expulsiones"]) == (1, 3, 1)
+
+
+def test_descartar_figuras_de_un_conjunto():
+    cache = CacheFiguras()
+    for clave in [(("a", None), "barras"), (("a", "filtros"), "tarta"), (("b", None), "barras")]:
+        cache.obtener(clave, lambda: pd.DataFrame({"x": range(10)}))
+
+    cache.descartar(lambda clave: clave[0][0] == "a")
+    assert list(cache.entradas) == [(("b", None), "barras")]
+    assert cache.bytes_usados == estimar_tamano(pd.DataFrame({"x": range(10)}))
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modulos.anomalias import (
+    ESCALA_DESVIACION_MEDIA,
+    ESCALA_MAD,
+    MIN_PUNTOS_ANOMALIA,
+    VENTANA_ANOMALIAS,
+    anomalias_vehiculo,
+    detectar_anomalias,
+    ranking_anomalias
+)
+
+
+# Puntuación z robusta de un valor frente a una muestra, calculada directamente
+def z_robusta(valor, muestra):
+    muestra = muestra[~np.isnan(muestra)]
+    if len(muestra) < MIN_PUNTOS_ANOMALIA or np.isnan(valor):
+        return np.nan
+    mediana = np.median(muestra)
+    escala = ESCALA_MAD * np.median(np.abs(muestra - mediana))
+    if escala == 0:
+        escala = ESCALA_DESVIACION_MEDIA * np.mean(np.abs(muestra - mediana))
+    return (valor - mediana) / escala if escala > 0 else 0.0
+
+
+# Puntuaciones de referencia: vehículo a vehículo y repostaje a repostaje, con pandas
+def anomalias_referencia(df):
+    datos = df.dropna(subset=["vehiculo", "fecha"]).sort_values(["vehiculo", "fecha"], kind="stable").copy()
+    distancia = datos["distancia"].where(datos["distancia"] > 0)
+    datos["litros_100km"] = datos["repostado"] / distancia * 100
+
+    mitad = VENTANA_ANOMALIAS // 2
+    for columna, destino in [("consumo", "z_consumo"), ("litros_100km", "z_litros")]:
+        puntuaciones = []
+        for _, grupo in datos.groupby("vehiculo", observed=True, sort=True):
+            valores = grupo[columna].to_numpy(dtype="float64")
+            puntuaciones += [z_robusta(valores[i], valores[max(0, i - mitad):i + mitad + 1]) for i in range(len(valores))]
+        datos[destino] = puntuaciones
+
+    datos["z_modelo"] = np.nan
+    for _, grupo in datos.groupby("tipo_vehiculo", observed=True, dropna=False):
+        muestra = grupo["litros_100km"].to_numpy(dtype="float64")
+        datos.loc[grupo.index, "z_modelo"] = [z_robusta(valor, muestra) for valor in muestra]
+    return datos
+
+
+@pytest.mark.parametrize("datos", ["flota", "flota_con_huecos"])
+def test_igual_que_la_referencia(request, datos):
+    df = request.getfixturevalue(datos)
+    anomalias = detectar_anomalias(df)
+    referencia = anomalias_referencia(df)
+
+    # Solo quedan fuera los repostajes sin ninguna puntuación
+    puntuables = referencia[["z_consumo", "z_litros", "z_modelo"]].notna().any(axis=1)
+    referencia = referencia[puntuables]
+    np.testing.assert_array_equal(anomalias["fila"].to_numpy(), df.index.get_indexer(referencia.index))
+
+    for columna in ["z_consumo", "z_litros", "z_modelo"]:
+        np.testing.assert_allclose(anomalias[columna].to_numpy(), referencia[columna].to_numpy(), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(anomalias["puntuacion"].to_numpy(), referencia[["z_consumo", "z_litros", "z_modelo"]].abs().max(axis=1).to_numpy())
+
+
+def test_detecta_un_repostaje_inflado(flota):
+    df = flota.copy()
+    fila = 100
+    df.loc[fila, ["repostado", "consumo"]] *= 4
+
+    ranking = ranking_anomalias(detectar_anomalias(df))
+    assert ranking["fila"].iloc[0] == fila
+
+    vehiculo = df.loc[fila, "vehiculo"]
+    del_vehiculo = anomalias_vehiculo(detectar_anomalias(df), vehiculo)
+    assert fila in del_vehiculo["fila"].to_numpy()
+    assert (del_vehiculo["vehiculo"] == vehiculo).all()
+    assert ranking_anomalias(detectar_anomalias(df), vehiculos=["NO-EXISTE"]).empty
+
+
+def test_sin_datos(flota):
+    assert detectar_anomalias(None) is None
+    assert detectar_anomalias(flota.iloc[:0]) is None
+    assert detectar_anomalias(flota[["vehiculo", "fecha", "provincia"]]) is None
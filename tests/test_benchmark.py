@@ -0,0 +1,19 @@
+import pytest
+
+from benchmarks import benchmark
+
+ARGUMENTOS = ["--tamanos", "2000", "--repeticiones", "1", "--casos", "aplicar_filtros", "grafico_dia_semana"]
+
+
+def test_comprobar_sin_linea_base_falla(tmp_path):
+    with pytest.raises(SystemExit) as salida:
+        benchmark.main(ARGUMENTOS + ["--linea-base", str(tmp_path / "no_existe.json"), "--comprobar"])
+    assert salida.value.code != 0
+
+
+def test_comprobar_con_linea_base(tmp_path):
+    ruta = str(tmp_path / "linea_base.json")
+    assert benchmark.main(ARGUMENTOS + ["--linea-base", ruta, "--guardar-linea-base"]) == 0
+
+    # Un caso medido que no está en la línea base también hace fallar la comprobación
+    assert benchmark.main(ARGUMENTOS + ["mostrar_top_vehiculos", "--linea-base", ruta, "--comprobar", "--tolerancia-tiempo", "100"]) == 1
@@ -0,0 +1,95 @@
+import io
+
+import pandas as pd
+import pytest
+
+from modulos import carga
+
+
+@pytest.fixture
+def carpeta_datos(tmp_path, monkeypatch):
+    # Los procesos hijos arrancan con 'spawn' y leen la carpeta de la caché del entorno
+    monkeypatch.setenv("REPOSTAJES_CACHE", str(tmp_path / "cache"))
+    monkeypatch.setattr(carga, "DIRECTORIO_CACHE", tmp_path / "cache")
+    raiz = tmp_path / "datos"
+    raiz.mkdir()
+    monkeypatch.setattr(carga, "CARPETAS_PERMITIDAS", [raiz.resolve()])
+    return raiz
+
+
+def test_carpeta_permitida_no_sale_de_la_raiz(tmp_path):
+    raiz = tmp_path / "datos"
+    (raiz / "sub").mkdir(parents=True)
+    assert carga.carpeta_permitida(raiz / "sub", [raiz.resolve()])
+    assert not carga.carpeta_permitida(raiz / "..", [raiz.resolve()])
+    assert not carga.carpeta_permitida("/etc", [raiz.resolve()])
+    assert not carga.carpeta_permitida(raiz, [])
+
+
+def test_cargar_carpeta_rechaza_rutas_no_permitidas(carpeta_datos, tmp_path):
+    with pytest.raises(ValueError):
+        carga.cargar_carpeta(tmp_path)
+    with pytest.raises(ValueError):
+        carga.huella_carpeta(carpeta_datos / "..")
+
+
+def test_cargar_carpeta_en_procesos(carpeta_datos, flota):
+    columnas = ["vehiculo", "fecha", "repostado", "distancia"]
+    partes = [flota[columnas].iloc[:50], flota[columnas].iloc[50:120]]
+    for i, parte in enumerate(partes):
+        parte.assign(vehiculo=parte["vehiculo"].astype(str)).to_excel(carpeta_datos / f"parte_{i}.xlsx", index=False)
+
+    informe = {}
+    df = carga.cargar_carpeta(carpeta_datos, procesos=2, informe=informe)
+
+    assert informe["modo"] == "procesos"
+    assert not any("error" in archivo for archivo in informe["archivos"])
+    assert len(df) == 120
+    pd.testing.assert_series_equal(
+        df["vehiculo"].astype(str), flota["vehiculo"].iloc[:120].astype(str).reset_index(drop=True), check_names=False
+    )
+
+
+def test_lectura_por_bloques_con_cabeceras_repetidas(flota):
+    datos = flota[["vehiculo", "fecha", "repostado", "distancia"]].head(200).astype({"vehiculo": str})
+    datos.columns = ["vehiculo", "fecha", "repostado", "repostado"]
+    datos.insert(4, "repostado.1", 1.0)
+    archivo = io.BytesIO()
+    datos.to_excel(archivo, index=False)
+    contenido = archivo.getvalue()
+
+    esperado = pd.read_excel(io.BytesIO(contenido))
+    obtenido = carga.leer_excel_streaming(contenido, filas_por_bloque=64)
+
+    assert list(obtenido.columns) == list(esperado.columns)
+    for columna in esperado.columns:
+        pd.testing.assert_series_equal(obtenido[columna], esperado[columna], check_dtype=False)
+
+
+def test_lectura_normal_y_por_bloques_dan_lo_mismo(flota):
+    archivo = io.BytesIO()
+    flota.head(300).astype({"vehiculo": str}).to_excel(archivo, index=False)
+    contenido = archivo.getvalue()
+
+    normal = carga.preparar_datos(pd.read_excel(io.BytesIO(contenido)))
+    por_bloques = carga.preparar_datos(carga.leer_excel_streaming(contenido, filas_por_bloque=64))
+
+    pd.testing.assert_frame_equal(por_bloques, normal, check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize("separador, decimal", [(",", "."), (";", ","), ("\t", "."), ("|", ".")])
+def test_csv_con_cualquier_separador(flota, tmp_path, monkeypatch, separador, decimal):
+    monkeypatch.setattr(carga, "DIRECTORIO_CACHE", tmp_path / "cache")
+    ruta = tmp_path / "datos.csv"
+    flota.head(500).to_csv(ruta, sep=separador, decimal=decimal, index=False)
+    contenido = ruta.read_bytes()
+
+    assert carga.detectar_separador(contenido) == separador
+    df, _ = carga.leer_archivo_local(ruta)
+    esperado = carga.preparar_datos(pd.read_csv(io.BytesIO(contenido), sep=separador))
+    pd.testing.assert_frame_equal(df, esperado)
+
+
+def test_separador_por_defecto():
+    assert carga.detectar_separador(b"") == ","
+    assert carga.detectar_separador(b"vehiculo\nAB123\n") == ","
@@ -0,0 +1,106 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from modulos.filtros import (
+    aplicar_filtros,
+    calcular_mascara,
+    comprimir_seleccion,
+    construir_indice,
+    filtro_fechas,
+    filtro_provincia,
+    filtro_rango,
+    filtro_tipo_combustible,
+    filtro_tipo_vehiculo,
+    materializar_seleccion,
+    posiciones_seleccion
+)
+
+CASOS = [
+    {},
+    {"tipos_vehiculo": ["Turismo"]},
+    {"tipos_vehiculo": ["Turismo", "Camión"], "tipos_combustible": ["Diésel"]},
+    {"provincia": ["Madrid", "Sevilla"], "rangos": {"repostado": (20.0, 60.0)}},
+    {"rangos": {"repostado": (10.0, 200.0), "consumo": (5.0, 10.0)}},
+    {"fechas": (datetime.date(2022, 3, 1), datetime.date(2022, 6, 30))},
+    {"fechas": (datetime.date(2022, 5, 10),)},
+    {"provincia": ["Provincia inexistente"]},
+    {"tipos_vehiculo": ["Furgoneta"], "tipos_combustible": ["Gasolina", "GLP"], "provincia": ["Madrid"],
+     "rangos": {"distancia": (100.0, 800.0)}, "fechas": (datetime.date(2022, 1, 1), datetime.date(2022, 12, 31))}
+]
+
+
+# Los filtros originales, aplicados uno tras otro sobre el dataframe
+def filtrar_con_pandas(df, tipos_vehiculo=None, tipos_combustible=None, provincia=None, rangos=None, fechas=None):
+    df = filtro_tipo_vehiculo(df, tipos_vehiculo)
+    df = filtro_tipo_combustible(df, tipos_combustible)
+    df = filtro_provincia(df, provincia)
+    for columna, rango in (rangos or {}).items():
+        df = filtro_rango(df, columna, rango)
+    return filtro_fechas(df, fechas)
+
+
+@pytest.mark.parametrize("filtros", CASOS)
+@pytest.mark.parametrize("datos", ["flota", "flota_con_huecos"])
+def test_mascara_igual_que_pandas(request, datos, filtros):
+    df = request.getfixturevalue(datos)
+    esperado = filtrar_con_pandas(df, **filtros)
+
+    mascara = calcular_mascara(construir_indice(df), **filtros)
+    np.testing.assert_array_equal(np.flatnonzero(mascara), df.index.get_indexer(esperado.index))
+
+    pd.testing.assert_frame_equal(aplicar_filtros(df, **filtros), esperado)
+
+
+def test_indice_de_otro_tamano_se_reconstruye(flota):
+    indice = construir_indice(flota.iloc[:100])
+    filtrado = aplicar_filtros(flota, tipos_vehiculo=["Turismo"], indice=indice)
+    pd.testing.assert_frame_equal(filtrado, filtro_tipo_vehiculo(flota, ["Turismo"]))
+
+
+def test_sin_filas(flota):
+    vacio = flota.iloc[:0]
+    assert len(calcular_mascara(construir_indice(vacio), tipos_vehiculo=["Turismo"])) == 0
+    assert aplicar_filtros(vacio, provincia=["Madrid"]).empty
+    assert aplicar_filtros(None) is None
+
+
+@pytest.mark.parametrize("seleccionadas", [0, 1, 10, 1500, 2999, 3000])
+def test_seleccion_comprimida(flota, seleccionadas):
+    aleatorio = np.random.default_rng(seleccionadas)
+    mascara = np.zeros(len(flota), dtype=bool)
+    mascara[aleatorio.choice(len(flota), seleccionadas, replace=False)] = True
+
+    seleccion = comprimir_seleccion(mascara)
+    if seleccionadas == len(flota):
+        assert seleccion is None
+    else:
+        np.testing.assert_array_equal(posiciones_seleccion(seleccion), np.flatnonzero(mascara))
+        # Pocas filas se guardan como posiciones y muchas como bitmap, lo que ocupe menos
+        assert seleccion["tipo"] == ("posiciones" if seleccionadas * 4 < (len(flota) + 7) // 8 else "bitmap")
+    pd.testing.assert_frame_equal(materializar_seleccion(flota, seleccion), flota[mascara])
+
+
+# La misma flota sin tipar: categorías como texto y métricas como texto
+@pytest.fixture
+def flota_sin_tipar(flota_con_huecos):
+    df = flota_con_huecos.copy()
+    for columna in ["tipo_vehiculo", "tipo_combustible", "provincia"]:
+        df[columna] = df[columna].astype(object)
+    df["distancia"] = df["distancia"].map(lambda valor: None if pd.isna(valor) else str(valor))
+    return df
+
+
+@pytest.mark.parametrize("filtros", [caso for caso in CASOS if "distancia" not in caso.get("rangos", {})])
+def test_columnas_sin_tipar_no_se_ignoran(flota_sin_tipar, filtros):
+    esperado = filtrar_con_pandas(flota_sin_tipar, **filtros)
+    pd.testing.assert_frame_equal(aplicar_filtros(flota_sin_tipar, **filtros), esperado)
+
+
+def test_rango_sobre_columna_de_texto(flota_sin_tipar):
+    numeros = pd.to_numeric(flota_sin_tipar["distancia"], errors="coerce")
+    esperado = flota_sin_tipar[numeros.between(100.0, 800.0)]
+    filtrado = aplicar_filtros(flota_sin_tipar, provincia=["Madrid"], rangos={"distancia": (100.0, 800.0)})
+    pd.testing.assert_frame_equal(filtrado, esperado[esperado["provincia"].isin(["Madrid"])])
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from modulos.agregados import totales_por_vehiculo
+from modulos.historico import (
+    SIN_FECHA,
+    anadir_al_historico,
+    cargar_historico,
+    guardar_manifiesto,
+    leer_manifiesto,
+    mensual_historico,
+    resumen_historico,
+    totales_historico
+)
+
+
+def comprobar_acumulados(directorio):
+    historico = cargar_historico(directorio=directorio)
+
+    # Totales por vehículo incrementales frente a recalcularlos sobre todo el histórico
+    esperado = totales_por_vehiculo(historico)
+    obtenido = totales_historico(directorio)
+    esperado.index = esperado.index.astype(str)
+    obtenido.index = obtenido.index.astype(str)
+    pd.testing.assert_frame_equal(obtenido.sort_index(), esperado.sort_index(), check_dtype=False, check_names=False, check_index_type=False)
+
+    # Totales mensuales de toda la flota (incluidas las filas sin matrícula)
+    meses = historico["fecha"].dt.strftime("%Y-%m")
+    esperado_mensual = historico.groupby(meses)[["repostado", "coste"]].sum()
+    mensual = mensual_historico(directorio)
+    np.testing.assert_allclose(mensual.loc[esperado_mensual.index, "repostado_suma"], esperado_mensual["repostado"])
+    np.testing.assert_allclose(mensual.loc[esperado_mensual.index, "coste_suma"], esperado_mensual["coste"])
+    assert mensual.loc[esperado_mensual.index, "repostajes"].tolist() == historico.groupby(meses).size().tolist()
+    return historico
+
+
+def test_anadir_por_partes_con_solapes(flota_con_huecos, tmp_path):
+    df = flota_con_huecos
+    primera, segunda = df.iloc[:2000], df.iloc[1500:]
+
+    informe = anadir_al_historico(primera, "a", "primera.xlsx", tmp_path)
+    assert informe["nuevas"] == len(primera.drop_duplicates(subset=["vehiculo", "fecha", "repostado"]))
+    comprobar_acumulados(tmp_path)
+
+    informe = anadir_al_historico(segunda, "b", "segunda.xlsx", tmp_path)
+    assert informe["duplicadas"] == 500
+    historico = comprobar_acumulados(tmp_path)
+
+    # El histórico tiene exactamente las filas distintas de ambos archivos
+    assert len(historico) == len(df.drop_duplicates(subset=["vehiculo", "fecha", "repostado"]))
+    assert resumen_historico(tmp_path)["filas"] == len(historico)
+    assert totales_historico(tmp_path).index.notna().all()
+
+    # Las filas sin fecha van a su propia partición y no entran en los rangos de meses
+    assert leer_manifiesto(tmp_path)["particiones"][SIN_FECHA] == historico["fecha"].isna().sum() > 0
+    tramo = cargar_historico("2022-03", "2022-05", directorio=tmp_path)
+    fechas = historico["fecha"]
+    assert len(tramo) == ((fechas >= "2022-03-01") & (fechas < "2022-06-01")).sum()
+
+    # El mismo archivo otra vez no cambia nada
+    huella = leer_manifiesto(tmp_path)["huella"]
+    assert anadir_al_historico(segunda, "b", "segunda.xlsx", tmp_path).get("repetido")
+    assert leer_manifiesto(tmp_path)["huella"] == huella
+
+
+def test_escritura_interrumpida(flota, tmp_path):
+    anadir_al_historico(flota.iloc[:1000], "a", directorio=tmp_path)
+
+    # Se simula una escritura que se cortó después de reescribir particiones
+    manifiesto = leer_manifiesto(tmp_path)
+    manifiesto["pendiente"] = True
+    (tmp_path / "agregados" / "vehiculos.parquet").unlink()
+    guardar_manifiesto(tmp_path, manifiesto)
+
+    anadir_al_historico(flota.iloc[1000:], "b", directorio=tmp_path)
+    comprobar_acumulados(tmp_path)
+    assert not leer_manifiesto(tmp_path)["pendiente"]
+
+
+def test_historico_vacio(tmp_path):
+    assert cargar_historico(directorio=tmp_path).empty
+    assert totales_historico(tmp_path) is None
+    assert mensual_historico(tmp_path) is None
+    assert resumen_historico(tmp_path)["filas"] == 0
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modulos.indices import METRICAS_RESUMEN, construir_indice_vehiculos, construir_particiones, filas_valor
+
+
+@pytest.mark.parametrize("datos", ["flota", "flota_con_huecos"])
+def test_particiones_igual_que_groupby(request, datos):
+    df = request.getfixturevalue(datos)
+    particiones = construir_particiones(df, "provincia")
+
+    esperado = df.groupby("provincia", observed=True).agg(
+        repostajes=("provincia", "size"), **{m: (m, "sum") for m in METRICAS_RESUMEN}
+    )
+    pd.testing.assert_frame_equal(particiones["resumen"], esperado, check_dtype=False, check_index_type=False)
+    assert particiones["valores"] == list(esperado.index)
+
+    for valor in particiones["valores"]:
+        pd.testing.assert_frame_equal(filas_valor(df, particiones, valor), df[df["provincia"] == valor])
+    assert filas_valor(df, particiones, "Provincia inexistente").empty
+
+
+def test_sin_filas(flota):
+    particiones = construir_particiones(flota.iloc[:0], "provincia")
+    assert particiones["valores"] == []
+    assert particiones["resumen"].empty
+
+
+def test_indice_de_vehiculos(flota_con_huecos):
+    df = flota_con_huecos
+    indice = construir_indice_vehiculos(df)
+
+    primeras = df.dropna(subset=["vehiculo"]).drop_duplicates("vehiculo")
+    modelos = dict(zip(primeras["vehiculo"], primeras["tipo_vehiculo"]))
+    assert indice["valores"] == sorted(modelos)
+    for vehiculo in indice["valores"]:
+        modelo = indice["modelos"][vehiculo]
+        assert modelo == modelos[vehiculo] or (pd.isna(modelo) and pd.isna(modelos[vehiculo]))
+        pd.testing.assert_frame_equal(filas_valor(df, indice, vehiculo), df[df["vehiculo"] == vehiculo])
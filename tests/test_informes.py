@@ -0,0 +1,39 @@
+import informes
+
+
+def test_nombre_archivo_no_colisiona():
+    valores = ["AB 123", "AB_123", "AB/123", "ab_123", "", "///"]
+    nombres = [informes.nombre_archivo(valor) for valor in valores]
+
+    assert len({nombre.lower() for nombre in nombres}) == len(valores)
+    assert all(nombre.startswith(("AB_123-", "ab_123-", "sin_nombre-")) for nombre in nombres)
+    assert informes.nombre_archivo("AB 123") == informes.nombre_archivo("AB 123")
+
+
+def test_un_informe_por_vehiculo_aunque_se_limpien_igual(flota, tmp_path, monkeypatch):
+    monkeypatch.setattr(informes, "cargar_excel", lambda archivo, huella, streaming=False: datos)
+    monkeypatch.setattr(informes, "leer_bytes", lambda archivo: b"datos")
+
+    primeros = list(flota["vehiculo"].dropna().unique()[:2])
+    datos = flota[flota["vehiculo"].isin(primeros)].copy()
+    datos["vehiculo"] = datos["vehiculo"].astype(str).map(dict(zip(map(str, primeros), ["AB 123", "AB_123"]))).astype("category")
+    datos = datos.drop(columns=["provincia"])
+
+    informes.main(["datos.xlsx", "--salida", str(tmp_path / "informes"), "--procesos", "1"])
+
+    assert len(list((tmp_path / "informes" / "vehiculos").glob("*.html"))) == 2
+
+
+def test_no_deja_datos_en_la_carpeta_de_salida(flota, tmp_path, monkeypatch):
+    datos = flota.head(300)
+    monkeypatch.setattr(informes, "cargar_excel", lambda archivo, huella, streaming=False: datos)
+    monkeypatch.setattr(informes, "leer_bytes", lambda archivo: b"datos")
+    salida = tmp_path / "informes"
+    salida.mkdir()
+    (salida / ".datos-0123456789abcdef.parquet").write_bytes(b"resto")
+
+    informes.main(["datos.xlsx", "--salida", str(salida), "--procesos", "1"])
+
+    assert not list(salida.glob(".datos-*"))
+    assert not [ruta for ruta in salida.rglob("*") if ruta.is_file() and ruta.suffix not in (".html", ".json")]
+    assert (salida / informes.NOMBRE_MANIFIESTO).exists()
@@ -0,0 +1,94 @@
+import datetime
+
+import pandas as pd
+import pytest
+
+from modulos.agregados import construir_cubo, totales_por_vehiculo
+from modulos.filtros import aplicar_filtros, construir_facetas
+from modulos.graficos import agregar_rejilla
+from modulos.historico import anadir_al_historico, cargar_historico
+from modulos.indices import construir_particiones
+
+pytest.importorskip("duckdb")
+
+from modulos.motor_sql import motor_historico  # noqa: E402
+
+FILTROS = [
+    None,
+    {"provincia": ["Madrid", "Sevilla"], "rangos": {"repostado": (20.0, 60.0)}},
+    {"tipos_vehiculo": ["Camión"], "fechas": (datetime.date(2022, 3, 1), datetime.date(2022, 8, 15))},
+    {"tipos_combustible": ["Diésel"], "fechas": (datetime.date(2022, 5, 10),)}
+]
+
+
+# El mismo histórico en memoria (cargar_historico) y en disco (MotorSQL)
+@pytest.fixture
+def historico(flota_con_huecos, tmp_path):
+    anadir_al_historico(flota_con_huecos, "a", directorio=tmp_path)
+    motor = motor_historico(tmp_path)
+    yield cargar_historico(directorio=tmp_path), motor
+    motor.cerrar()
+
+
+def con_indice_texto(tabla):
+    tabla = tabla.copy()
+    tabla.index = tabla.index.astype(str)
+    return tabla.sort_index()
+
+
+@pytest.mark.parametrize("filtros", FILTROS)
+def test_igual_que_en_memoria(historico, filtros):
+    df, motor = historico
+    datos = aplicar_filtros(df, **(filtros or {}))
+    assert motor.contar(filtros) == len(datos)
+
+    # Cubo temporal en todos los periodos
+    cubo, cubo_motor = construir_cubo(datos), motor.cubo(filtros)
+    for periodo in ["D", "W", "M", "Y"]:
+        pd.testing.assert_frame_equal(
+            cubo_motor["periodos"][periodo].sort_index(), cubo["periodos"][periodo].sort_index(),
+            check_dtype=False, check_index_type=False, check_categorical=False
+        )
+        pd.testing.assert_frame_equal(cubo_motor["flota"][periodo], cubo["flota"][periodo], check_dtype=False, check_freq=False)
+    assert cubo_motor["modelos"] == {str(v): m for v, m in cubo["modelos"].items() if pd.notna(v)}
+
+    # Totales por vehículo, rejilla del mapa y distribución por combustible
+    pd.testing.assert_frame_equal(
+        con_indice_texto(motor.totales_vehiculo(filtros)), con_indice_texto(totales_por_vehiculo(datos)),
+        check_dtype=False, check_names=False
+    )
+    rejilla = agregar_rejilla(datos).sort_values(["lat_min", "lon_min"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(motor.rejilla(0.05, filtros), rejilla, check_dtype=False)
+    distribucion = datos.groupby("tipo_combustible", observed=True)["repostado"].sum()
+    pd.testing.assert_series_equal(con_indice_texto(motor.distribucion("tipo_combustible", filtros)), con_indice_texto(distribucion),
+                                   check_names=False, check_dtype=False)
+
+    # Resumen por provincia
+    resumen = construir_particiones(datos, "provincia")["resumen"]
+    pd.testing.assert_frame_equal(con_indice_texto(motor.resumen("provincia", filtros)), con_indice_texto(resumen), check_dtype=False)
+
+
+def test_facetas_rangos_y_vehiculo(historico):
+    df, motor = historico
+
+    facetas = construir_facetas(df)
+    facetas_motor = motor.facetas()
+    assert facetas_motor["filas"].sum() == facetas["filas"].sum() == len(df)
+    assert len(facetas_motor) == len(facetas)
+
+    rangos = motor.rangos(["repostado", "distancia"])
+    assert rangos["repostado"] == (df["repostado"].min(), df["repostado"].max())
+
+    vehiculo = motor.valores("vehiculo")[0]
+    filas = motor.filas_vehiculo(vehiculo)
+    esperadas = df[df["vehiculo"] == vehiculo].sort_values("fecha", kind="stable")
+    assert len(filas) == len(esperadas)
+    pd.testing.assert_series_equal(filas["repostado"].reset_index(drop=True), esperadas["repostado"].reset_index(drop=True))
+
+
+def test_filtro_sin_filas(historico):
+    _, motor = historico
+    filtros = {"provincia": ["Provincia inexistente"]}
+    assert motor.contar(filtros) == 0
+    assert motor.cubo(filtros) is None
+    assert motor.totales_vehiculo(filtros).empty
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from modulos.muestreo import indices_lttb, indices_minmax, reducir_serie
+
+
+# Implementación de referencia de LTTB (Steinarsson, 2013), punto a punto
+def lttb_referencia(x, y, max_puntos):
+    total = len(x)
+    cada = (total - 2) / (max_puntos - 2)
+    anterior = 0
+    seleccion = [0]
+    for i in range(max_puntos - 2):
+        inicio_siguiente = int(np.floor((i + 1) * cada)) + 1
+        fin_siguiente = min(int(np.floor((i + 2) * cada)) + 1, total)
+        media_x = x[inicio_siguiente:fin_siguiente].mean()
+        media_y = y[inicio_siguiente:fin_siguiente].mean()
+
+        mayor_area, elegido = -1.0, None
+        for j in range(int(np.floor(i * cada)) + 1, int(np.floor((i + 1) * cada)) + 1):
+            area = abs((x[anterior] - media_x) * (y[j] - y[anterior]) - (x[anterior] - x[j]) * (media_y - y[anterior]))
+            if area > mayor_area:
+                mayor_area, elegido = area, j
+        seleccion.append(elegido)
+        anterior = elegido
+    seleccion.append(total - 1)
+    return np.array(seleccion)
+
+
+@pytest.mark.parametrize("total,max_puntos", [(101, 7), (1000, 100), (5000, 2000), (20_000, 2000)])
+def test_lttb_igual_que_la_referencia(total, max_puntos):
+    aleatorio = np.random.default_rng(total)
+    x = np.arange(total, dtype="float64")
+    y = aleatorio.normal(size=total).cumsum()
+    np.testing.assert_array_equal(indices_lttb(x, y, max_puntos), lttb_referencia(x, y, max_puntos))
+
+
+def test_lttb_con_fechas():
+    fechas = pd.date_range("2022-01-01", periods=3000, freq="h").to_numpy()
+    y = np.sin(np.arange(3000) / 50.0)
+    x = fechas.astype("int64").astype("float64")
+    np.testing.assert_array_equal(indices_lttb(fechas, y, 500), lttb_referencia(x, y, 500))
+
+
+def test_series_cortas_no_se_reducen():
+    y = np.arange(10, dtype="float64")
+    np.testing.assert_array_equal(indices_lttb(y, y, 2000), np.arange(10))
+    np.testing.assert_array_equal(indices_lttb(y, y, 2), np.arange(10))
+    assert len(indices_lttb(y[:0], y[:0], 100)) == 0
+
+
+def test_minmax_conserva_extremos():
+    y = np.random.default_rng(1).normal(size=10_000)
+    posiciones = reducir_serie(None, y, 200, metodo="minmax")
+    assert len(posiciones) <= 200
+    assert np.all(np.diff(posiciones) > 0)
+    assert y.argmax() in posiciones and y.argmin() in posiciones
+    np.testing.assert_array_equal(indices_minmax(y[:50], 200), np.arange(50))
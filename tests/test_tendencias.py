@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from modulos.tendencias import MIN_PUNTOS_RECTA, VENTANA_MEDIANA, calcular_tendencias, tendencias_vehiculo
+
+
+# Tendencias de un vehículo calculadas directamente con pandas y np.polyfit
+def tendencias_pandas(df, vehiculo, columna="consumo"):
+    datos = df[df["vehiculo"] == vehiculo].dropna(subset=["fecha", columna]).sort_values("fecha", kind="stable")
+    x = datos["fecha"].to_numpy().astype("datetime64[s]").astype("float64") / 86400.0
+    y = datos[columna].to_numpy(dtype="float64")
+    pendiente = np.polyfit(x, y, 1)[0] if len(datos) >= MIN_PUNTOS_RECTA else np.nan
+    mediana = datos[columna].rolling(VENTANA_MEDIANA, min_periods=1, center=True).median().to_numpy()
+    return pendiente, mediana
+
+
+def test_coincide_con_pandas(flota):
+    tendencias = calcular_tendencias(flota)
+    for vehiculo in flota["vehiculo"].cat.categories[:10]:
+        pendiente, mediana = tendencias_pandas(flota, vehiculo)
+        np.testing.assert_allclose(tendencias["coeficientes"].loc[vehiculo, "pendiente_dia"], pendiente, rtol=1e-6)
+        np.testing.assert_allclose(tendencias_vehiculo(tendencias, vehiculo)["mediana_movil"].to_numpy(), mediana)
+
+
+def test_filas_sin_matricula_ni_fecha(flota_con_huecos):
+    tendencias = calcular_tendencias(flota_con_huecos)
+
+    coeficientes = tendencias["coeficientes"]
+    assert coeficientes.index.notna().all()
+    assert coeficientes["puntos"].sum() == len(flota_con_huecos.dropna(subset=["vehiculo", "fecha", "consumo"]))
+
+    vehiculo = coeficientes.index[0]
+    pendiente, mediana = tendencias_pandas(flota_con_huecos, vehiculo)
+    np.testing.assert_allclose(coeficientes.loc[vehiculo, "pendiente_dia"], pendiente, rtol=1e-6)
+    np.testing.assert_allclose(tendencias_vehiculo(tendencias, vehiculo)["mediana_movil"].to_numpy(), mediana)
+
+
+def test_sin_filas(flota):
+    tendencias = calcular_tendencias(flota.iloc[:0])
+    assert tendencias["coeficientes"].empty
+    assert tendencias_vehiculo(tendencias, "0000BBB") is None
+    assert calcular_tendencias(pd.DataFrame({"fecha": []})) is None